@@ -2,12 +2,13 @@ import streamlit as st
 import os
 import sys
 import glob
+import asyncio
 import streamlit.components.v1 as components
 
 # Add current dir to sys.path to ensure backend imports work
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from backend.processor import DataProcessor
+from backend.processor import DataProcessor, FILE_FAILED
 from backend.vector_store import VectorStore
 from backend.embedding import EmbeddingClient
 from backend.llm import LLMClient
@@ -95,24 +96,29 @@ with st.sidebar:
                     st.info(f"已选择 {len(selected_names)} 个用户: {', '.join(selected_names)}")
                     
                     if st.button("🚀 开始处理选中的文件夹", type="primary"):
-                        processor = DataProcessor()
                         progress_bar = st.progress(0)
                         status_text = st.empty()
                         
                         total_folders = len(selected_names)
-                        processed_files = 0
                         
-                        for idx, folder_name in enumerate(selected_names):
-                            folder_path = os.path.join(base_data_path, folder_name)
-                            status_text.text(f"处理用户文件夹: {folder_name}...")
-                            
-                            try:
-                                result = processor.process_directory(folder_path)
-                                processed_files += 1
-                            except Exception as e:
-                                st.warning(f"处理 {folder_name} 时出错: {e}")
-                            
-                            progress_bar.progress(int((idx + 1) / total_folders * 100))
+                        # 整个循环在同一个事件循环内运行：processor 的 HTTP 连接池绑定在创建它的循环上
+                        async def process_folders():
+                            processor = DataProcessor()
+                            processed = 0
+                            for idx, folder_name in enumerate(selected_names):
+                                folder_path = os.path.join(base_data_path, folder_name)
+                                status_text.text(f"处理用户文件夹: {folder_name}...")
+                                
+                                try:
+                                    await processor.process_directory(folder_path)
+                                    processed += 1
+                                except Exception as e:
+                                    st.warning(f"处理 {folder_name} 时出错: {e}")
+                                
+                                progress_bar.progress(int((idx + 1) / total_folders * 100))
+                            return processed
+                        
+                        processed_files = asyncio.run(process_folders())
                         
                         st.success(f"✅ 完成！已处理 {processed_files}/{total_folders} 个用户文件夹")
                         st.session_state['selected_all'] = False
@@ -140,7 +146,7 @@ with st.sidebar:
                     status_text.text(f"{msg} ({current}/{total})")
                 
                 try:
-                    result = processor.process_directory(data_path, progress_callback=update_progress)
+                    result = asyncio.run(processor.process_directory(data_path, progress_callback=update_progress))
                     st.success(result)
                 except Exception as e:
                     st.error(f"发生错误: {e}")
@@ -240,26 +246,31 @@ with st.sidebar:
                 
                 with st.spinner("处理中..."):
                     try:
-                        processor = DataProcessor()
                         total_files = len(uploaded_files)
-                        success_count = 0
                         
                         # 创建用户专属目录
                         user_upload_dir = os.path.join(UPLOAD_DIR, upload_person)
                         os.makedirs(user_upload_dir, exist_ok=True)
                         
-                        for i, uploaded_file in enumerate(uploaded_files):
-                            status_text.text(f"处理 {uploaded_file.name} ({i+1}/{total_files})...")
-                            
-                            # 保存到用户专属目录
-                            file_path = os.path.join(user_upload_dir, uploaded_file.name)
-                            with open(file_path, "wb") as f:
-                                f.write(uploaded_file.getbuffer())
-                            
-                            if processor.process_file(file_path, person_name=upload_person):
-                                success_count += 1
-                            
-                            progress_bar.progress(int((i + 1) / total_files * 100))
+                        # 整个循环在同一个事件循环内运行：processor 的 HTTP 连接池绑定在创建它的循环上
+                        async def process_uploads():
+                            processor = DataProcessor()
+                            succeeded = 0
+                            for i, uploaded_file in enumerate(uploaded_files):
+                                status_text.text(f"处理 {uploaded_file.name} ({i+1}/{total_files})...")
+                                
+                                # 保存到用户专属目录
+                                file_path = os.path.join(user_upload_dir, uploaded_file.name)
+                                with open(file_path, "wb") as f:
+                                    f.write(uploaded_file.getbuffer())
+                                
+                                if await processor.process_file(file_path, person_name=upload_person) != FILE_FAILED:
+                                    succeeded += 1
+                                
+                                progress_bar.progress(int((i + 1) / total_files * 100))
+                            return succeeded
+                        
+                        success_count = asyncio.run(process_uploads())
                         
                         st.success(f"✅ 成功处理 {success_count}/{total_files} 个文件，用户: {upload_person}")
                             
@@ -316,7 +327,7 @@ if st.session_state.messages and st.session_state.messages[-1]["role"] == "user"
                 response = "暂无文档数据，请先上传并处理文件"
             else:
                 # 1. Embed query
-                query_embedding = embed_client.get_embedding(prompt)
+                query_embedding = asyncio.run(embed_client.get_embedding(prompt))
                 
                 if query_embedding:
                     # 2. Search
@@ -324,7 +335,7 @@ if st.session_state.messages and st.session_state.messages[-1]["role"] == "user"
                     results = vector_store.search(query_embedding, k=5, person_filter=person_filter)
                     
                     # 3. Generate Answer
-                    raw_response = llm_client.get_answer(prompt, results)
+                    raw_response = asyncio.run(llm_client.get_answer(prompt, results))
                     
                     # 4. Process Thinking Block
                     # Assuming thinking is enclosed in <think>...</think>
@@ -0,0 +1,57 @@
+import time
+import threading
+from collections import OrderedDict
+from .metrics import CACHE_HITS_TOTAL, CACHE_MISSES_TOTAL
+
+class LRUCache:
+    """
+    Thread-safe in-process LRU cache with a per-entry TTL.
+    Keeps hit/miss counters so hit rates can be reported.
+    """
+    def __init__(self, maxsize=1024, ttl=None, name="cache", backend="memory"):
+        self.name = name
+        self.backend = backend
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    CACHE_HITS_TOTAL.inc(backend=self.backend, cache=self.name)
+                    return value
+                del self._data[key]
+            self.misses += 1
+        CACHE_MISSES_TOTAL.inc(backend=self.backend, cache=self.name)
+        return default
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,90 @@
+import os
+from .config import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+from .tokens import estimate_tokens, truncate_to_tokens
+
+def _split_long_line(line, max_tokens):
+    """Splits a single line that exceeds max_tokens into token-bounded pieces."""
+    pieces = []
+    rest = line
+    while rest:
+        piece = truncate_to_tokens(rest, max_tokens)
+        if not piece:
+            # A single alphanumeric run larger than the budget (~4 chars per token)
+            piece = rest[:max_tokens * 4]
+        pieces.append(piece)
+        rest = rest[len(piece):]
+    return pieces
+
+def chunk_text(text, max_tokens=CHUNK_MAX_TOKENS, overlap=CHUNK_OVERLAP_TOKENS):
+    """
+    Splits OCR text into token-bounded chunks along line boundaries.
+    Consecutive chunks share up to `overlap` tokens of trailing lines.
+    Returns a list of (char_offset, chunk_text) tuples.
+    """
+    if not text or not text.strip():
+        return []
+    if estimate_tokens(text) <= max_tokens:
+        return [(0, text)]
+
+    # (offset, line) pairs, with over-long lines split further
+    lines = []
+    offset = 0
+    for raw_line in text.split("\n"):
+        if estimate_tokens(raw_line) > max_tokens:
+            piece_offset = offset
+            for piece in _split_long_line(raw_line, max_tokens):
+                lines.append((piece_offset, piece))
+                piece_offset += len(piece)
+        else:
+            lines.append((offset, raw_line))
+        offset += len(raw_line) + 1
+
+    chunks = []
+    current = []
+    used = 0
+    for line_offset, line in lines:
+        cost = estimate_tokens(line) + 1
+        if current and used + cost > max_tokens:
+            chunks.append((current[0][0], "\n".join(l for _, l in current)))
+            # Carry trailing lines over as overlap
+            carried = []
+            carried_tokens = 0
+            for prev in reversed(current):
+                prev_cost = estimate_tokens(prev[1]) + 1
+                if carried_tokens + prev_cost > overlap or carried_tokens + prev_cost + cost > max_tokens:
+                    break
+                carried.insert(0, prev)
+                carried_tokens += prev_cost
+            current = carried
+            used = carried_tokens
+        current.append((line_offset, line))
+        used += cost
+
+    if current:
+        chunks.append((current[0][0], "\n".join(l for _, l in current)))
+    return chunks
+
+def chunk_pages(pages, file_path, person_name, max_tokens=CHUNK_MAX_TOKENS, overlap=CHUNK_OVERLAP_TOKENS,
+                attributes=None):
+    """
+    Chunks per-page OCR texts of one file into metadata dicts ready for embedding.
+    Pages are numbered from 1; chunk_offset is the character offset within the page text.
+    attributes (file type, document type, upload time) are copied into every chunk.
+    """
+    metas = []
+    for page_idx, page_text in enumerate(pages):
+        for chunk_idx, (offset, text) in enumerate(chunk_text(page_text, max_tokens, overlap)):
+            # Filter out empty or very short garbage
+            if len(text.strip()) < 5:
+                continue
+            metas.append({
+                "text": text,
+                "source": file_path,
+                "person": person_name,
+                "filename": os.path.basename(file_path),
+                "page": page_idx + 1,
+                "chunk_index": chunk_idx,
+                "chunk_offset": offset,
+                **(attributes or {}),
+            })
+    return metas
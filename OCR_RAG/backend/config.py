@@ -1,27 +1,200 @@
 import os
 
+# Every backend setting can be overridden through the environment
+# (e.g. to point at local stand-ins, see bench/stub_backends.py).
+
 # OCR Configuration
-OCR_API_BASE = "http://localhost:8009/v1"
-OCR_API_KEY = "EMPTY"
-OCR_MODEL = "HunyuanOCR" 
+OCR_API_BASE = os.environ.get("OCR_API_BASE", "http://localhost:8009/v1")
+OCR_API_KEY = os.environ.get("OCR_API_KEY", "EMPTY")
+OCR_MODEL = os.environ.get("OCR_MODEL", "HunyuanOCR")
 
 # Embedding Configuration
 # User provided: http://10.10.18.210:7288
 # We assume standard OpenAI-compatible format: /v1/embeddings
-EMBED_API_BASE = "http://10.10.18.210:7288/v1" 
-EMBED_API_KEY = "weshare_llm"
-EMBED_MODEL = "bge-m3"
+EMBED_API_BASE = os.environ.get("EMBED_API_BASE", "http://10.10.18.210:7288/v1")
+EMBED_API_KEY = os.environ.get("EMBED_API_KEY", "weshare_llm")
+EMBED_MODEL = os.environ.get("EMBED_MODEL", "bge-m3")
+
+# Query Caches (in-process)
+# Query embeddings are keyed by normalized query text; search results by
+# (embedding hash, person filter, k, index generation).
+QUERY_EMBED_CACHE_SIZE = 1024
+QUERY_EMBED_CACHE_TTL = 3600  # seconds
+SEARCH_CACHE_SIZE = 1024
+SEARCH_CACHE_TTL = 600  # seconds
 
 # LLM Configuration
-LLM_API_BASE = "http://10.10.18.210:8288/v1"
-LLM_API_KEY = "weshare_llm"
-LLM_MODEL = "qwq-32b"
+LLM_API_BASE = os.environ.get("LLM_API_BASE", "http://10.10.18.210:8288/v1")
+LLM_API_KEY = os.environ.get("LLM_API_KEY", "weshare_llm")
+LLM_MODEL = os.environ.get("LLM_MODEL", "qwq-32b")
+
+# Answer Modes
+# "full": unrestricted reasoning; "capped": the <think> phase is cut off after
+# LLM_REASONING_BUDGET tokens and the answer is forced; "none": no reasoning.
+# Capped/none rely on assistant prefill (vLLM continue_final_message).
+LLM_DEFAULT_ANSWER_MODE = "full"
+LLM_REASONING_BUDGET = 512
+# Set when the chat template already opens the think block (output has no <think> tag),
+# as qwq-32b's does. If unset for such a model, the reasoning is still recognized,
+# but only once its closing tag arrives (so capped mode cannot cut it short).
+LLM_THINK_PREFILLED = os.environ.get("LLM_THINK_PREFILLED", "1") != "0"
+
+# Prompt Budget (estimated tokens, see backend/tokens.py)
+# Retrieved context is packed until LLM_CONTEXT_TOKEN_BUDGET is reached; each
+# chunk is first trimmed to the window most relevant to the query.
+LLM_CONTEXT_TOKEN_BUDGET = 3000
+LLM_CHUNK_TOKEN_LIMIT = 800
+# Recent turns are kept verbatim; older turns are folded into a short summary.
+LLM_HISTORY_TOKEN_BUDGET = 1500
+LLM_HISTORY_SUMMARY_TOKENS = 200
 
 # Data Persistence Paths
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DATA_DIR = os.path.join(BASE_DIR, "data")
+DATA_DIR = os.environ.get("RAG_DATA_DIR", os.path.join(BASE_DIR, "data"))
 INDEX_FILE = os.path.join(DATA_DIR, "faiss_index.bin")
 METADATA_FILE = os.path.join(DATA_DIR, "metadata.pkl")
+UPLOAD_DIR = os.path.join(DATA_DIR, "uploads")
+# Partially received files of resumable chunked uploads
+UPLOAD_PARTS_DIR = os.path.join(DATA_DIR, "upload_parts")
+# Full-precision float32 vectors (memory-mapped) and store layout info
+VECTORS_FILE = os.path.join(DATA_DIR, "vectors.f32")
+STORE_INFO_FILE = os.path.join(DATA_DIR, "store_info.json")
+# Writers publish versioned index/metadata files here and then atomically replace
+# STORE_INFO_FILE, the manifest naming the current snapshot. Readers never lock.
+SNAPSHOT_DIR = os.path.join(DATA_DIR, "snapshots")
+SNAPSHOTS_KEEP = 2  # generations kept on disk for readers still opening an older one
+STORE_LOCK_FILE = os.path.join(DATA_DIR, "store.lock")
+# Index writer thread: adds arriving within the interval are merged into one commit
+INDEX_COMMIT_INTERVAL = 0.2  # seconds
+INDEX_COMMIT_MAX_VECTORS = 20000
+# Per-file OCR output, so chunks can be rebuilt without calling OCR again
+OCR_CACHE_DIR = os.path.join(DATA_DIR, "ocr_cache")
+
+# Re-embedding Migration (backend/migration.py)
+# The store records the model its vectors came from. After EMBED_MODEL changes,
+# queries and uploads keep using the store's model while a background job
+# re-embeds every chunk's saved text into shadow vectors, then swaps in one snapshot.
+MIGRATION_DIR = os.path.join(DATA_DIR, "migrations")
+MIGRATION_BATCH_SIZE = 32  # texts per embedding call
+MIGRATION_CONCURRENCY = 2  # embedding calls in flight (bulk priority, behind uploads and chat)
+MIGRATION_PAUSE_SECONDS = 0.0  # pause after each call, to leave the embedding server headroom
+MIGRATION_SWAP_MAX_PENDING = 256  # chunks added meanwhile, re-embedded while holding the write lock
+MIGRATION_AUTO_RESUME = True  # the server resumes an interrupted migration on startup
+
+# Chunking Configuration (estimated tokens, see backend/tokens.py)
+# bge-m3 accepts long inputs, but retrieval quality drops well before that.
+CHUNK_MAX_TOKENS = 400
+CHUNK_OVERLAP_TOKENS = 50
+
+# Vector Index Encoding
+# "flat" (float32), "fp16", "sq8" (scalar 8-bit) or "pq" (product quantization).
+# Compressed encodings can re-rank their top candidates exactly against the
+# full float32 vectors kept (memory-mapped) in VECTORS_FILE.
+VECTOR_ENCODING = os.environ.get("VECTOR_ENCODING", "flat")
+VECTOR_RERANK = True
+VECTOR_RERANK_FACTOR = 4  # candidates fetched per requested result when re-ranking
+PQ_SUBQUANTIZERS = 64  # bytes per vector with 8-bit codes; must divide the dimension
+PQ_MIN_TRAIN_VECTORS = 10000  # PQ falls back to flat storage below this corpus size
+
+# Dimensionality Reduction (applied before encoding, see backend/projection.py)
+# "none", "pca" (fitted on the corpus) or "truncate" (leading dimensions, only
+# for embedding models trained for it; bge-m3 is not). The index holds projected
+# vectors and projects queries itself; re-ranking uses the full vectors.
+VECTOR_PROJECTION = os.environ.get("VECTOR_PROJECTION", "none")
+VECTOR_PROJECTION_DIM = int(os.environ.get("VECTOR_PROJECTION_DIM", 256))
+PROJECTION_MIN_TRAIN_VECTORS = 2000  # PCA is only fitted above this corpus size
+
+# Retrieval Mode
+# "dense" (FAISS only), "lexical" (BM25 over chunk text only) or "hybrid"
+# (reciprocal rank fusion of both). The lexical index uses CJK bigrams plus
+# alphanumeric tokens, so exact ID numbers, phone numbers and names match.
+SEARCH_MODE = "hybrid"
+BM25_K1 = 1.2
+BM25_B = 0.75
+HYBRID_CANDIDATES = 4  # candidates taken from each retriever per requested result
+HYBRID_RRF_K = 60
+LEXICAL_IDENTIFIER_FAST_PATH = True  # identifier-only queries skip the embedding call
+
+# Backend Scheduling (backend/scheduler.py)
+# Calls in flight per backend; waiting calls are served interactive (chat) >
+# single (/api/add_file) > bulk (upload, ingest, rechunk).
+OCR_MAX_INFLIGHT = int(os.environ.get("OCR_MAX_INFLIGHT", 8))
+EMBED_MAX_INFLIGHT = int(os.environ.get("EMBED_MAX_INFLIGHT", 16))
+PRIORITY_AGING_SECONDS = 10.0  # a waiter gains one class of urgency per this many seconds (no starvation)
+PRIORITY_RESERVED_SLOTS = 1  # slots per backend only interactive calls may take
+
+# Request Tracing (backend/tracing.py) and Profiling (backend/profiling.py)
+# Every request records timed spans of its stages; finished traces are kept when
+# slow, sampled, or asked for with the "X-Trace: 1" header (see /api/traces).
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "1") != "0"
+TRACE_SLOW_MS = float(os.environ.get("TRACE_SLOW_MS", 2000))  # requests at least this slow are always kept
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 0.01))  # share of faster requests kept
+TRACE_BUFFER_SIZE = 200  # kept traces held in memory, per kind (requests, background jobs)
+TRACE_MAX_SPANS = 2000  # per trace; a long PDF stops recording page spans beyond this
+TRACE_EXPORT_FILE = os.environ.get("TRACE_EXPORT_FILE", "")  # kept traces are appended here as JSON lines
+TRACE_IGNORE_PATHS = ("/static", "/api/progress", "/api/metrics", "/api/traces", "/api/admin/profile")
+# /api/admin/profile is off unless enabled; then it takes the PROFILE_TOKEN in an
+# "X-Profile-Token" header, or with no token set only accepts loopback clients
+PROFILE_ENDPOINT_ENABLED = os.environ.get("PROFILE_ENDPOINT_ENABLED", "0") == "1"
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_MAX_SECONDS = 60  # longest capture of /api/admin/profile
+PROFILE_SAMPLE_INTERVAL = 0.01  # seconds between stack samples
+
+# Metadata Filters (person, filename, file_type, doc_type, page, upload date)
+# Document type is detected once per file from keywords near the start of its
+# OCR text; the first matching entry wins.
+DOC_TYPE_KEYWORDS = [
+    ("身份证", ["公民身份号码", "居民身份证"]),
+    ("户口本", ["常住人口登记卡", "户口簿"]),
+    ("营业执照", ["营业执照", "统一社会信用代码"]),
+    ("发票", ["发票代码", "发票号码"]),
+    ("银行流水", ["交易明细", "账户明细", "流水"]),
+    ("合同", ["合同", "协议书"]),
+]
+DOC_TYPE_DEFAULT = "其他"
+DOC_TYPE_SCAN_CHARS = 500
+# Filtered sets up to this many chunks are scored exactly against the full
+# vectors; larger ones are searched in FAISS with the filter as an ID selector.
+FILTER_EXACT_MAX_ROWS = 2000
+
+# Field Lookups
+# Short questions asking for one extracted field of a named person ("张三的身份证号")
+# are answered from the field index (backend/field_index.py) without the LLM.
+FIELD_ANSWER_FAST_PATH = True
+FIELD_QUERY_MAX_CHARS = 30  # longer questions always go through RAG
+
+# Sharded Deployment (backend/shard_router.py, backend/shard_server.py)
+# Comma-separated shard server URLs; empty = the single local store. Persons are
+# hash-partitioned over the shards in this order, so changing the list means
+# re-distributing the corpus (python -m backend.rechunk does so from the OCR cache).
+SHARD_URLS = [url.strip().rstrip("/") for url in os.environ.get("SHARD_URLS", "").split(",") if url.strip()]
+SHARD_TIMEOUT_SECONDS = float(os.environ.get("SHARD_TIMEOUT_SECONDS", 2.0))  # per shard; slower shards are left out of the results
+SHARD_WRITE_TIMEOUT_SECONDS = 300.0  # adds, replaces and deletes are never partial
+
+# Diversity Re-ranking (maximal marginal relevance over a wider candidate set)
+SEARCH_MMR = False  # default for requests that do not choose
+SEARCH_MMR_LAMBDA = 0.5  # 1.0 = pure relevance, 0.0 = pure diversity
+SEARCH_MMR_CANDIDATES = 4  # candidates fetched per requested result
+SEARCH_MMR_MAX_CANDIDATES = 100  # keeps the pairwise similarity matrix small
+
+# Page Previews (/api/view?page=N): rendered pages and thumbnails, cached on disk
+PAGE_CACHE_DIR = os.path.join(DATA_DIR, "page_cache")
+PAGE_CACHE_MAX_BYTES = 2 * 1024 ** 3  # least recently viewed pages are evicted beyond this
+PAGE_CACHE_AT_INGEST = True  # cache PDF pages from the images rendered for OCR
+PAGE_RENDER_DPI = 150
+PAGE_MAX_WIDTH = 1600
+THUMBNAIL_WIDTH = 320
+PAGE_JPEG_QUALITY = 85
+
+# Upload Intake
+UPLOAD_WRITE_BUFFER_BYTES = 1024 * 1024  # received bytes buffered before each disk write
+UPLOAD_CHUNK_MAX_BYTES = 64 * 1024 * 1024  # largest accepted chunk of a resumable upload
+UPLOAD_PROCESS_CONCURRENCY = 1  # uploaded files processed at once (OCR server is fragile under load)
 
 # Ensure data directory exists
 os.makedirs(DATA_DIR, exist_ok=True)
+os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+os.makedirs(UPLOAD_PARTS_DIR, exist_ok=True)
+os.makedirs(PAGE_CACHE_DIR, exist_ok=True)
+os.makedirs(MIGRATION_DIR, exist_ok=True)
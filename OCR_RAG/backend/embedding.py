@@ -1,23 +1,75 @@
+import re
+import unicodedata
 from openai import AsyncOpenAI
-from .config import EMBED_API_BASE, EMBED_API_KEY, EMBED_MODEL
+from .cache import LRUCache
+from .metrics import EMBED_SECONDS, FAILURES_TOTAL, INFLIGHT_REQUESTS
+from .scheduler import get_scheduler, request_priority
+from .tracing import span, annotate
+from .config import (
+    EMBED_API_BASE, EMBED_API_KEY, EMBED_MODEL, EMBED_MAX_INFLIGHT, QUERY_EMBED_CACHE_SIZE, QUERY_EMBED_CACHE_TTL,
+)
+
+# Shared across client instances (one is created per request)
+QUERY_EMBEDDING_CACHE = LRUCache(maxsize=QUERY_EMBED_CACHE_SIZE, ttl=QUERY_EMBED_CACHE_TTL,
+                                 name="query_embedding", backend=EMBED_MODEL)
+
+def normalize_query(text):
+    """Normalizes a query for cache lookup: width/case folding, whitespace and trailing punctuation."""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip("?？。.!！~ ")
 
 class EmbeddingClient:
-    def __init__(self):
+    def __init__(self, model=None):
+        """model defaults to EMBED_MODEL; queries must use the model the store was built with."""
+        self.model = model or EMBED_MODEL
         self.client = AsyncOpenAI(
             base_url=EMBED_API_BASE,
             api_key=EMBED_API_KEY,
         )
 
+    async def _create(self, inputs):
+        # One slot pool per embedding server, whichever model a call uses
+        with span("embedding", backend=self.model, texts=len(inputs)):
+            async with get_scheduler(EMBED_MODEL, EMBED_MAX_INFLIGHT).slot():
+                with INFLIGHT_REQUESTS.track_inprogress(backend=self.model), EMBED_SECONDS.time(backend=self.model):
+                    response = await self.client.embeddings.create(
+                        input=inputs,
+                        model=self.model
+                    )
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
     async def get_embedding(self, text):
         if not text or not text.strip():
             return None
         text = text.replace("\n", " ")
         try:
-            response = await self.client.embeddings.create(
-                input=[text],
-                model=EMBED_MODEL
-            )
-            return response.data[0].embedding
+            return (await self._create([text]))[0]
         except Exception as e:
+            FAILURES_TOTAL.inc(backend=self.model, stage="embedding")
             print(f"Embedding Error: {e}")
             return None
+
+    async def get_embeddings(self, texts):
+        """Embeds several texts in one call (bulk jobs); raises on failure instead of returning None."""
+        try:
+            return await self._create([text.replace("\n", " ") for text in texts])
+        except Exception:
+            FAILURES_TOTAL.inc(backend=self.model, stage="embedding")
+            raise
+
+    async def get_query_embedding(self, query):
+        """Embeds a user query (interactive priority), reusing cached embeddings of equivalent queries."""
+        key = (self.model, normalize_query(query))
+        if not key[1]:
+            return None
+        with span("embed_query", backend=self.model):
+            embedding = QUERY_EMBEDDING_CACHE.get(key)
+            annotate(cache_hit=embedding is not None)
+            if embedding is not None:
+                return embedding
+            with request_priority("interactive"):
+                embedding = await self.get_embedding(query)
+        if embedding:
+            QUERY_EMBEDDING_CACHE.set(key, embedding)
+        return embedding
@@ -0,0 +1,164 @@
+"""
+Typed fields (name, ID number, birth date, address, ...) extracted from chunk
+text at ingest into a per-person key/value index, so questions like
+"张三的身份证号" are answered without embedding, retrieval or the LLM.
+
+Entries point at VectorStore rows, so every answer carries its source chunk.
+"""
+import re
+import numpy as np
+from .config import FIELD_QUERY_MAX_CHARS
+
+# Words that follow 姓名 on ID cards when OCR merges the label lines
+_NAME_STOPWORDS = ["证件", "号码", "一致", "签发", "出生", "性别", "住址", "民族", "有效", "起始"]
+
+# field -> (display label, extraction patterns, what a lookup question asks for)
+# A question is a lookup only when it ends with one of these (plus an optional
+# "是什么" style tail): "张三的身份证有效期到哪天" is not asking for the number.
+FIELDS = {
+    "name": ("姓名", [
+        r"姓名[:：\s]*([\u4e00-\u9fa5]{2,4})(?:$|\s|，|。)",
+        r"Name[:\s]*([A-Za-z][A-Za-z ]+[A-Za-z])\s*$",
+    ], ["姓名", "名字", "全名", "叫什么名字", "叫什么"]),
+    "id_number": ("身份证号", [
+        r"(?:公民身份号码|身份证号码|身份证号|身份号码)[:：\s]*(\d{17}[\dXx])(?!\d)",
+    ], ["身份证号码", "身份证号", "公民身份号码", "身份号码", "证件号码", "证件号"]),
+    "birth_date": ("出生日期", [
+        r"出生(?:日期)?[:：\s]*(\d{4}\s*年\s*\d{1,2}\s*月\s*\d{1,2}\s*日)",
+        r"出生(?:日期)?[:：\s]*(\d{4}[-/.]\d{1,2}[-/.]\d{1,2})",
+    ], ["出生日期", "出生年月日", "生日", "哪年出生", "哪年生", "哪天出生", "什么时候出生"]),
+    "gender": ("性别", [r"性别[:：\s]*(男|女)"], ["性别"]),
+    "ethnicity": ("民族", [r"民族[:：\s]*([\u4e00-\u9fa5]{1,4}?)族?(?:$|\s)"], ["民族"]),
+    "address": ("住址", [r"(?:住址|地址)[:：\s]*([^\s:：][^\n]{3,60})"],
+                ["家庭住址", "住址", "地址", "住在哪里", "住在哪", "住哪里", "住哪"]),
+    "phone": ("联系电话", [
+        r"(?:电话|手机|联系方式)(?:号码)?[:：\s]*(1[3-9]\d{9})(?!\d)",
+    ], ["电话号码", "电话", "手机号码", "手机号", "联系方式"]),
+}
+_COMPILED = {field: [re.compile(p, re.MULTILINE) for p in patterns] for field, (_, patterns, _) in FIELDS.items()}
+_QUESTION_TAIL = r"(?:是什么|是多少|是哪天|是几号|是哪里|是|为|多少|的)?(?:呢|啊)?$"
+_ASKS = {field: re.compile("(?:" + "|".join(re.escape(k) for k in sorted(keywords, key=len, reverse=True)) + ")"
+                          + _QUESTION_TAIL)
+         for field, (_, _, keywords) in FIELDS.items()}
+
+
+def extract_fields(text):
+    """{field: value} found in one chunk of OCR text (first match per field)."""
+    found = {}
+    for field, patterns in _COMPILED.items():
+        for pattern in patterns:
+            match = pattern.search(text)
+            if not match:
+                continue
+            value = re.sub(r"\s+", "" if field != "name" else " ", match.group(1)).strip()
+            if field == "name" and any(word in value for word in _NAME_STOPWORDS):
+                continue
+            found[field] = value
+            break
+    return found
+
+
+def detect_field_query(query):
+    """The field a short lookup question asks for, or None (also when it names several fields)."""
+    query = query.strip().rstrip("?？。!！ ")
+    if not query or len(query) > FIELD_QUERY_MAX_CHARS:
+        return None
+    asked = [field for field, pattern in _ASKS.items() if pattern.search(query)]
+    if len(asked) != 1:
+        return None
+    # "张三的地址和电话" ends with one field but asks for two
+    mentioned = {field for field, (_, _, keywords) in FIELDS.items() if any(k in query for k in keywords)}
+    return asked[0] if mentioned == {asked[0]} else None
+
+
+class FieldIndex:
+    def __init__(self):
+        self.size = 0
+        # person -> field -> [(value, row)] in row order
+        self.entries = {}
+
+    def __len__(self):
+        return self.size
+
+    def add(self, metas):
+        """Extracts fields from metadata dicts indexed as the next rows."""
+        for offset, meta in enumerate(metas):
+            fields = extract_fields(meta.get("text", ""))
+            if not fields:
+                continue
+            by_field = self.entries.setdefault(meta.get("person", "unknown"), {})
+            for field, value in fields.items():
+                by_field.setdefault(field, []).append((value, self.size + offset))
+        self.size += len(metas)
+
+    def keep(self, rows):
+        """Keeps only the given rows (ascending), renumbered 0..len(rows)-1, as after a delete."""
+        remap = np.full(self.size, -1, dtype='int64')
+        remap[rows] = np.arange(len(rows))
+        for person, by_field in list(self.entries.items()):
+            for field, values in list(by_field.items()):
+                kept = [(value, int(remap[row])) for value, row in values if remap[row] >= 0]
+                if kept:
+                    by_field[field] = kept
+                else:
+                    del by_field[field]
+            if not by_field:
+                del self.entries[person]
+        self.size = len(rows)
+
+    def lookup(self, person, field):
+        """[(value, [rows])] for a person's field, most frequently seen value first."""
+        grouped = {}
+        for value, row in self.entries.get(person, {}).get(field, []):
+            grouped.setdefault(value, []).append(row)
+        return sorted(grouped.items(), key=lambda item: -len(item[1]))
+
+    def first(self, person, field):
+        values = self.lookup(person, field)
+        return values[0][0] if values else None
+
+    def people_named(self, text):
+        """Persons whose id or extracted name occurs in text; only the longest match wins ("张三丰" over "张三")."""
+        matches = {}
+        for person, by_field in self.entries.items():
+            names = {person} | {value for value, _ in by_field.get("name", [])}
+            best = max((len(name) for name in names if len(name) >= 2 and name in text), default=0)
+            if best:
+                matches[person] = best
+        longest = max(matches.values(), default=0)
+        return sorted(person for person, length in matches.items() if length == longest)
+
+    def answer(self, query, metadata, person=None):
+        """
+        Answers a field lookup question from the index: (answer text, cited rows), or
+        None when the question is not a recognizable lookup, names no indexed person
+        or the field was never extracted for them (the caller falls back to RAG).
+        """
+        field = detect_field_query(query)
+        if field is None:
+            return None
+        persons = self.people_named(query)[:3]
+        if person:
+            # A question about someone other than the selected person is left to RAG
+            persons = [person] if not persons or person in persons else []
+        label = FIELDS[field][0]
+        lines = []
+        rows = []
+        for p in persons:
+            values = self.lookup(p, field)
+            if not values:
+                continue
+            name = self.first(p, "name")
+            who = f"{name}（{p}）" if name and name != p else p
+            for value, value_rows in values:
+                meta = metadata[value_rows[0]]
+                lines.append(f"{who}的{label}：{value}（来源：{meta.get('filename', '')} 第{meta.get('page', 1)}页）")
+                rows.append(value_rows[0])
+        if not lines:
+            return None
+        return "\n".join(lines), rows
+
+    def fields_of(self, person):
+        """{field: [distinct values]} extracted for a person."""
+        return {field: [value for value, _ in self.lookup(person, field)]
+                for field in self.entries.get(person, {})}
@@ -0,0 +1,239 @@
+"""
+Attribute filters over chunk metadata, answered from precomputed per-value row
+sets and numeric columns instead of scanning metadata dicts at query time.
+
+A filter expression is a JSON object, e.g. ChatRequest.filters:
+    {"person": "张三", "file_type": ["pdf", "jpg"], "doc_type": "身份证",
+     "page": {"lte": 2}, "uploaded": {"gte": "2024-01-01", "lt": "2024-07-01"}}
+Fields are ANDed and a list matches any of its values. "source" matches exact
+file paths and "folder" any file below one of the given directories. "and" / "or" take a list
+of expressions and "not" a single one, so combinations nest freely.
+Row ids are VectorStore row numbers, so the resulting mask can be handed to
+FAISS as an IDSelectorBitmap.
+"""
+import datetime
+import os
+import time
+import numpy as np
+from .config import DOC_TYPE_KEYWORDS, DOC_TYPE_DEFAULT, DOC_TYPE_SCAN_CHARS
+
+CATEGORICAL_FIELDS = ("person", "filename", "file_type", "doc_type", "source")
+# Filter name -> metadata key of numeric fields
+RANGE_FIELDS = {"page": "page", "uploaded": "uploaded_at"}
+RANGE_OPS = ("gt", "gte", "lt", "lte")
+# Bumped when the pickled layout changes; older snapshots are re-indexed from metadata
+FILTER_INDEX_VERSION = 2
+
+
+class FilterError(ValueError):
+    pass
+
+
+def file_type_of(filename):
+    return os.path.splitext(filename or "")[1].lstrip(".").lower()
+
+
+def detect_doc_type(pages):
+    """Document type from keywords near the start of the OCR text (DOC_TYPE_KEYWORDS order wins)."""
+    head = "".join(pages)[:DOC_TYPE_SCAN_CHARS]
+    for doc_type, keywords in DOC_TYPE_KEYWORDS:
+        if any(keyword in head for keyword in keywords):
+            return doc_type
+    return DOC_TYPE_DEFAULT
+
+
+def document_attributes(file_path, pages, uploaded_at=None):
+    """Per-file metadata copied into every chunk of the file."""
+    return {
+        "file_type": file_type_of(file_path),
+        "doc_type": detect_doc_type(pages),
+        "uploaded_at": uploaded_at if uploaded_at is not None else time.time(),
+    }
+
+
+def _timestamp(value, op):
+    """Epoch seconds from a number or an ISO date/datetime; a plain date covers the whole day."""
+    if isinstance(value, (int, float)):
+        return op, float(value)
+    try:
+        if len(value) == 10:
+            day = datetime.date.fromisoformat(value)
+            if op in ("lte", "gt"):
+                # "lte 2024-03-01" means up to the end of that day
+                day += datetime.timedelta(days=1)
+                op = "lt" if op == "lte" else "gte"
+            return op, time.mktime(day.timetuple())
+        return op, datetime.datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        raise FilterError(f"Invalid date '{value}', expected YYYY-MM-DD or an ISO datetime")
+
+
+def parse_filter(expr):
+    """
+    Validates a filter expression and normalizes it (dates to epoch seconds, single
+    values to lists). Returns None for an empty expression; raises FilterError.
+    """
+    if expr is None:
+        return None
+    if not isinstance(expr, dict):
+        raise FilterError("Filter must be a JSON object")
+    clauses = []
+    for key, value in expr.items():
+        if key in ("and", "or"):
+            if not isinstance(value, list):
+                raise FilterError(f"'{key}' takes a list of filters")
+            parts = [part for part in (parse_filter(part) for part in value) if part is not None]
+            # An empty "and" matches every row (and an empty "or", negated, too)
+            if not parts:
+                raise FilterError(f"'{key}' needs at least one non-empty filter")
+            clauses.append({key: parts})
+        elif key == "not":
+            inner = parse_filter(value)
+            if inner is not None:
+                clauses.append({"not": inner})
+        elif key in CATEGORICAL_FIELDS:
+            values = value if isinstance(value, list) else [value]
+            if not all(isinstance(v, str) for v in values):
+                raise FilterError(f"'{key}' takes a string or a list of strings")
+            if key == "file_type":
+                values = [v.lstrip(".").lower() for v in values]
+            clauses.append({key: values})
+        elif key == "folder":
+            values = value if isinstance(value, list) else [value]
+            if not values or not all(isinstance(v, str) and v for v in values):
+                raise FilterError("'folder' takes a directory path or a list of them")
+            # Trailing separator, so "uploads/张三" does not also match "uploads/张三丰"
+            clauses.append({key: [os.path.join(os.path.abspath(v), "") for v in values]})
+        elif key in RANGE_FIELDS:
+            if not isinstance(value, dict) or not value or set(value) - set(RANGE_OPS):
+                raise FilterError(f"'{key}' takes an object with {RANGE_OPS}")
+            bounds = {}
+            for op, bound in value.items():
+                if key == "uploaded":
+                    op, bound = _timestamp(bound, op)
+                elif not isinstance(bound, (int, float)):
+                    raise FilterError(f"'{key}' bounds must be numbers")
+                bounds[op] = float(bound)
+            clauses.append({key: bounds})
+        else:
+            raise FilterError(f"Unknown filter field '{key}'")
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"and": clauses}
+
+
+def merge_filters(*exprs):
+    """ANDs normalized expressions, skipping empty ones."""
+    exprs = [e for e in exprs if e is not None]
+    if not exprs:
+        return None
+    return exprs[0] if len(exprs) == 1 else {"and": exprs}
+
+
+class FilterIndex:
+    def __init__(self):
+        self.version = FILTER_INDEX_VERSION
+        self.size = 0
+        # field -> value -> row ids (int32, ascending)
+        self.rows = {field: {} for field in CATEGORICAL_FIELDS}
+        # filter name -> float64 column, NaN where the chunk has no value
+        self.columns = {name: np.zeros(0, dtype='float64') for name in RANGE_FIELDS}
+
+    def __len__(self):
+        return self.size
+
+    def add(self, metas):
+        """Indexes metadata dicts as the next rows."""
+        start = self.size
+        batch = {field: {} for field in CATEGORICAL_FIELDS}
+        columns = {name: [] for name in RANGE_FIELDS}
+        for offset, meta in enumerate(metas):
+            row = start + offset
+            values = {
+                "person": meta.get("person"),
+                "filename": meta.get("filename"),
+                # Chunks indexed before these attributes were recorded
+                "file_type": meta.get("file_type") or file_type_of(meta.get("filename")),
+                "doc_type": meta.get("doc_type"),
+                "source": meta.get("source"),
+            }
+            for field, value in values.items():
+                if value is not None:
+                    batch[field].setdefault(value, []).append(row)
+            for name, key in RANGE_FIELDS.items():
+                value = meta.get(key)
+                columns[name].append(np.nan if value is None else value)
+        for field, by_value in batch.items():
+            for value, rows in by_value.items():
+                rows = np.array(rows, dtype='int32')
+                old = self.rows[field].get(value)
+                self.rows[field][value] = rows if old is None else np.concatenate([old, rows])
+        for name, values in columns.items():
+            self.columns[name] = np.concatenate([self.columns[name], np.array(values, dtype='float64')])
+        self.size += len(metas)
+
+    def keep(self, rows):
+        """Keeps only the given rows (ascending), renumbered 0..len(rows)-1, as after a delete."""
+        remap = np.full(self.size, -1, dtype='int32')
+        remap[rows] = np.arange(len(rows), dtype='int32')
+        for by_value in self.rows.values():
+            for value, old_rows in list(by_value.items()):
+                new_rows = remap[old_rows]
+                new_rows = new_rows[new_rows >= 0]
+                if len(new_rows):
+                    by_value[value] = new_rows
+                else:
+                    del by_value[value]
+        for name in self.columns:
+            self.columns[name] = self.columns[name][rows]
+        self.size = len(rows)
+
+    def mask(self, expr):
+        """Boolean array over rows for a parse_filter() expression (None = no filter)."""
+        if expr is None:
+            return None
+        return self._evaluate(expr)
+
+    def _evaluate(self, expr):
+        result = None
+        for key, value in expr.items():
+            if key == "and":
+                part = np.ones(self.size, dtype=bool)
+                for sub in value:
+                    part &= self._evaluate(sub)
+            elif key == "or":
+                part = np.zeros(self.size, dtype=bool)
+                for sub in value:
+                    part |= self._evaluate(sub)
+            elif key == "not":
+                part = ~self._evaluate(value)
+            elif key in RANGE_FIELDS:
+                column = self.columns[key]
+                part = ~np.isnan(column)
+                for op, bound in value.items():
+                    if op == "gt":
+                        part &= column > bound
+                    elif op == "gte":
+                        part &= column >= bound
+                    elif op == "lt":
+                        part &= column < bound
+                    else:
+                        part &= column <= bound
+            elif key == "folder":
+                # Prefix match over the distinct file paths, not over rows
+                part = np.zeros(self.size, dtype=bool)
+                for source, rows in self.rows["source"].items():
+                    if os.path.abspath(source).startswith(tuple(value)):
+                        part[rows] = True
+            else:
+                part = np.zeros(self.size, dtype=bool)
+                for v in value:
+                    rows = self.rows[key].get(v)
+                    if rows is not None:
+                        part[rows] = True
+            result = part if result is None else result & part
+        return result
+
+    def values(self, field):
+        """Distinct values of a categorical field with their chunk counts."""
+        return {value: len(rows) for value, rows in self.rows[field].items()}
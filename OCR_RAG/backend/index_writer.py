@@ -0,0 +1,189 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from .vector_store import VectorStore
+from .metrics import INDEX_COMMIT_SECONDS, INDEX_COMMIT_WAIT_SECONDS, INDEX_COMMIT_BATCH, QUEUE_DEPTH
+from .config import INDEX_COMMIT_INTERVAL, INDEX_COMMIT_MAX_VECTORS
+
+class _WriteRequest:
+    def __init__(self, op, embeddings, metas, embed_model=None, replace_sources=None):
+        self.op = op
+        self.embeddings = embeddings
+        self.metas = metas
+        self.embed_model = embed_model
+        self.replace_sources = set(replace_sources or ())
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+class IndexWriter:
+    """
+    Owns a writable VectorStore on a dedicated thread so FAISS updates and snapshot
+    publication never run on the event loop. Producers enqueue documents and await
+    the commit; adds arriving within commit_interval of each other are merged into
+    one index update and one published snapshot.
+    """
+    def __init__(self, commit_interval=INDEX_COMMIT_INTERVAL, max_vectors=INDEX_COMMIT_MAX_VECTORS):
+        self.commit_interval = commit_interval
+        self.max_vectors = max_vectors
+        self.store = None  # created on the writer thread
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._carry = None
+        self.commits = 0
+        self.requests_committed = 0
+        self.vectors_committed = 0
+        self.last_batch_vectors = 0
+        self.last_batch_requests = 0
+        self.last_commit_seconds = None
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="index-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, op, embeddings, metas, embed_model=None, replace_sources=None):
+        """
+        Enqueues a write ("add" or "replace"); returns a concurrent Future resolved on commit.
+        embed_model is the model the embeddings came from and replace_sources the files
+        whose current chunks the add replaces (see VectorStore.add_documents).
+        """
+        self._ensure_started()
+        request = _WriteRequest(op, embeddings, metas, embed_model, replace_sources)
+        QUEUE_DEPTH.inc(backend="faiss", queue="index_writer")
+        self._queue.put(request)
+        return request.future
+
+    async def add(self, embeddings, metas, embed_model=None, replace_sources=None):
+        """
+        Adds documents; returns once they are part of a published snapshot. The chunks
+        already indexed for the files in replace_sources are removed in that same snapshot.
+        """
+        return await asyncio.wrap_future(self.submit("add", embeddings, metas, embed_model, replace_sources))
+
+    async def replace(self, embeddings, metas, embed_model=None):
+        """Replaces the whole store with the given documents in a single snapshot."""
+        return await asyncio.wrap_future(self.submit("replace", embeddings, metas, embed_model))
+
+    def _next(self, timeout=None):
+        if self._carry is not None:
+            request, self._carry = self._carry, None
+            return request
+        request = self._queue.get(timeout=timeout) if timeout is not None else self._queue.get()
+        QUEUE_DEPTH.dec(backend="faiss", queue="index_writer")
+        return request
+
+    @staticmethod
+    def _claim(request):
+        """
+        Marks the request's future running so it can no longer be cancelled; False if the
+        producer was already cancelled (client gone, Ctrl-C), in which case it is dropped.
+        """
+        return request.future.set_running_or_notify_cancel()
+
+    @staticmethod
+    def _resolve(batch, result=None, error=None):
+        """Resolves the batch's futures; a failure on one must not stop the writer thread."""
+        for request in batch:
+            try:
+                if error is not None:
+                    request.future.set_exception(error)
+                else:
+                    request.future.set_result(result)
+            except Exception as e:
+                print(f"Index writer could not resolve a write request: {e}")
+
+    def _collect_batch(self, first):
+        """
+        Gathers adds arriving within commit_interval; any other op or embedding model ends
+        the batch, as does an add replacing a file whose new chunks the batch already holds.
+        """
+        batch = [first]
+        sources = {meta.get("source") for meta in first.metas}
+        vectors = len(first.embeddings)
+        # Publishing rewrites the metadata and lexical pickles whole, so while adds keep
+        # arriving the batch grows for up to as long as the last commit took: a steady
+        # ingest publishes (and readers reload) about once per commit, not once per file
+        deadline = time.monotonic() + max(self.commit_interval, self.last_commit_seconds or 0)
+        while vectors < self.max_vectors:
+            timeout = min(deadline - time.monotonic(), self.commit_interval)
+            if timeout <= 0:
+                break
+            try:
+                request = self._next(timeout)
+            except queue.Empty:
+                break
+            if request.op != "add" or request.embed_model != first.embed_model \
+                    or request.replace_sources & sources:
+                self._carry = request
+                break
+            if not self._claim(request):
+                continue
+            batch.append(request)
+            sources.update(meta.get("source") for meta in request.metas)
+            vectors += len(request.embeddings)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._next()
+            if not self._claim(first):
+                continue
+            batch = self._collect_batch(first) if first.op == "add" else [first]
+            embeddings = [e for request in batch for e in request.embeddings]
+            metas = [m for request in batch for m in request.metas]
+            replace_sources = set().union(*(request.replace_sources for request in batch))
+            t0 = time.perf_counter()
+            try:
+                if self.store is None:
+                    self.store = VectorStore()
+                if first.op == "replace":
+                    self.store.replace_documents(embeddings, metas, first.embed_model)
+                else:
+                    self.store.add_documents(embeddings, metas, first.embed_model, replace_sources)
+            except Exception as e:
+                print(f"Index writer commit failed: {e}")
+                # Drop the half-applied batch; the published snapshot is untouched
+                self.store = None
+                self._resolve(batch, error=e)
+                continue
+
+            done = time.perf_counter()
+            self.last_commit_seconds = done - t0
+            self.last_batch_vectors = len(embeddings)
+            self.last_batch_requests = len(batch)
+            self.commits += 1
+            self.requests_committed += len(batch)
+            self.vectors_committed += len(embeddings)
+            INDEX_COMMIT_SECONDS.observe(self.last_commit_seconds, backend="faiss")
+            INDEX_COMMIT_BATCH.observe(len(embeddings), backend="faiss")
+            for request in batch:
+                INDEX_COMMIT_WAIT_SECONDS.observe(done - request.enqueued_at, backend="faiss")
+            self._resolve(batch, result=self.store.generation)
+
+    def stats(self):
+        return {
+            "running": self._thread is not None and self._thread.is_alive(),
+            "pending": self._queue.qsize() + (1 if self._carry is not None else 0),
+            "commits": self.commits,
+            "requests_committed": self.requests_committed,
+            "vectors_committed": self.vectors_committed,
+            "avg_batch_requests": round(self.requests_committed / self.commits, 2) if self.commits else None,
+            "last_batch_vectors": self.last_batch_vectors,
+            "last_batch_requests": self.last_batch_requests,
+            "last_commit_ms": round(self.last_commit_seconds * 1000, 1) if self.last_commit_seconds is not None else None,
+        }
+
+_index_writer = None
+_index_writer_lock = threading.Lock()
+
+def get_index_writer():
+    """The process-wide index writer (its thread starts on the first write)."""
+    global _index_writer
+    with _index_writer_lock:
+        if _index_writer is None:
+            _index_writer = IndexWriter()
+        return _index_writer
@@ -0,0 +1,241 @@
+"""
+Headless bulk ingestion, bypassing HTTP and Streamlit.
+
+Usage (from the OCR_RAG directory):
+    python -m backend.ingest /mnt/share/customers --file-workers 8 --ocr-workers 16 --embed-workers 32
+    python -m backend.ingest /mnt/share/customers --person-from depth:2 --report ingest_report.json
+
+Completed files are recorded in a manifest (JSON lines); re-running the same
+command skips files already ingested unless they changed on disk. A file that
+is processed again (changed, failed before, or --no-resume) replaces its chunks.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from .config import DATA_DIR
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.png', '.jpg', '.jpeg')
+DEFAULT_MANIFEST = os.path.join(DATA_DIR, "ingest_manifest.jsonl")
+
+
+def person_from_path(rel_path, rule, root_name):
+    """
+    Derives the person id from a file path relative to the ingest root.
+      top      first directory under the root (process_directory's rule)
+      parent   immediate parent directory of the file
+      depth:N  N-th directory under the root (1-based)
+      regex:P  first group of P matched against the relative path (with '/' separators)
+    Files directly under the root fall back to the root folder name.
+    """
+    parts = rel_path.replace(os.sep, "/").split("/")
+    dirs = parts[:-1]
+    if rule == "top":
+        return dirs[0] if dirs else root_name
+    if rule == "parent":
+        return dirs[-1] if dirs else root_name
+    if rule.startswith("depth:"):
+        depth = int(rule.split(":", 1)[1])
+        return dirs[depth - 1] if len(dirs) >= depth else (dirs[-1] if dirs else root_name)
+    if rule.startswith("regex:"):
+        match = re.search(rule.split(":", 1)[1], "/".join(parts))
+        if match:
+            return match.group(1) if match.groups() else match.group(0)
+        return "unknown"
+    raise ValueError(f"Unknown person rule: {rule}")
+
+
+class Manifest:
+    """Append-only JSON-lines record of ingested files, keyed by absolute path."""
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Tolerate a torn last line from an interrupted run
+                        continue
+                    self.entries[entry["path"]] = entry
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def is_done(self, path, stat):
+        entry = self.entries.get(path)
+        return (entry is not None and entry.get("status") == "ok"
+                and entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime)
+
+    def record(self, entry):
+        self.entries[entry["path"]] = entry
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class Progress:
+    """Single-line progress display on stderr with throughput and ETA."""
+    def __init__(self, total_files, total_bytes):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files = 0
+        self.bytes = 0
+        self.failures = 0
+        self.start = time.perf_counter()
+        self._last_render = 0.0
+
+    def update(self, size, ok):
+        self.files += 1
+        self.bytes += size
+        if not ok:
+            self.failures += 1
+        self.render()
+
+    def render(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self._last_render < 1.0:
+            return
+        self._last_render = now
+        elapsed = max(now - self.start, 1e-6)
+        rate = self.files / elapsed
+        mb_rate = self.bytes / elapsed / 1e6
+        remaining = self.total_files - self.files
+        eta = remaining / rate if rate > 0 else float("inf")
+        eta_str = time.strftime("%H:%M:%S", time.gmtime(eta)) if eta != float("inf") else "--:--:--"
+        sys.stderr.write(f"\r[{self.files}/{self.total_files}] {rate:.2f} files/s {mb_rate:.2f} MB/s "
+                         f"ETA {eta_str} failures {self.failures}   ")
+        sys.stderr.flush()
+
+
+def collect_files(root, extensions):
+    files = []
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            if name.lower().endswith(extensions):
+                files.append(os.path.abspath(os.path.join(dirpath, name)))
+    files.sort()
+    return files
+
+
+async def run_ingest(args):
+    from .processor import DataProcessor, FILE_INDEXED, FILE_PARTIAL
+
+    root = os.path.abspath(args.root)
+    root_name = os.path.basename(os.path.normpath(root))
+    manifest = Manifest(args.manifest)
+    extensions = tuple(e if e.startswith(".") else "." + e for e in args.extensions.lower().split(","))
+
+    pending = []
+    skipped = 0
+    for path in collect_files(root, extensions):
+        stat = os.stat(path)
+        if args.resume and manifest.is_done(path, stat):
+            skipped += 1
+            continue
+        person = person_from_path(os.path.relpath(path, root), args.person_from, root_name)
+        pending.append((path, person, stat))
+
+    print(f"Found {len(pending) + skipped} files, {skipped} already ingested, {len(pending)} to process.")
+    if args.dry_run:
+        for path, person, _ in pending:
+            print(f"{person}\t{path}")
+        manifest.close()
+        return {"pending": len(pending), "skipped": skipped}
+
+    processor = DataProcessor(ocr_concurrency=args.ocr_workers, embed_concurrency=args.embed_workers)
+    progress = Progress(len(pending), sum(stat.st_size for _, _, stat in pending))
+    semaphore = asyncio.Semaphore(args.file_workers)
+    failures = []
+
+    async def ingest_one(path, person, stat):
+        async with semaphore:
+            t0 = time.perf_counter()
+            error = None
+            try:
+                status = await processor.process_file(path, person_name=person)
+                ok = status == FILE_INDEXED
+                if status == FILE_PARTIAL:
+                    error = "some chunks failed to embed"
+                elif not ok:
+                    error = "no text extracted or embedding failed"
+            except Exception as e:
+                ok = False
+                error = str(e)
+            entry = {
+                "path": path, "person": person, "size": stat.st_size, "mtime": stat.st_mtime,
+                "status": "ok" if ok else "failed", "seconds": round(time.perf_counter() - t0, 3),
+                "ts": time.time(),
+            }
+            if error:
+                entry["error"] = error
+                failures.append(entry)
+            manifest.record(entry)
+            progress.update(stat.st_size, ok)
+
+    try:
+        await asyncio.gather(*[ingest_one(*item) for item in pending])
+    finally:
+        progress.render(force=True)
+        sys.stderr.write("\n")
+        manifest.close()
+
+    elapsed = time.perf_counter() - progress.start
+    return {
+        "root": root,
+        "processed": len(pending),
+        "succeeded": len(pending) - len(failures),
+        "failed": len(failures),
+        "skipped": skipped,
+        "seconds": round(elapsed, 1),
+        "files_per_sec": round(len(pending) / elapsed, 2) if elapsed else None,
+        "failures": [{"path": f["path"], "person": f["person"], "error": f["error"]} for f in failures],
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Bulk-ingest a directory tree into the vector store.")
+    parser.add_argument("root", help="Directory to ingest")
+    parser.add_argument("--file-workers", type=int, default=5, help="Files processed concurrently")
+    parser.add_argument("--ocr-workers", type=int, default=8, help="Concurrent OCR requests")
+    parser.add_argument("--embed-workers", type=int, default=16, help="Concurrent embedding requests")
+    parser.add_argument("--person-from", default="top",
+                        help="Person id rule: top, parent, depth:N or regex:PATTERN (default: top)")
+    parser.add_argument("--extensions", default=",".join(SUPPORTED_EXTENSIONS))
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST, help="Resumable manifest (JSON lines)")
+    parser.add_argument("--no-resume", dest="resume", action="store_false",
+                        help="Re-process files already recorded as ingested")
+    parser.add_argument("--dry-run", action="store_true", help="List files and derived persons without ingesting")
+    parser.add_argument("--report", default=None, help="Write the final report as JSON to this file")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    if not os.path.isdir(args.root):
+        print(f"Path does not exist: {args.root}")
+        sys.exit(2)
+    report = asyncio.run(run_ingest(args))
+
+    if not args.dry_run:
+        print(f"Processed {report['processed']} files in {report['seconds']}s "
+              f"({report['succeeded']} ok, {report['failed']} failed, {report['skipped']} skipped).")
+        for failure in report["failures"]:
+            print(f"FAILED {failure['path']}: {failure['error']}")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if report.get("failed"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
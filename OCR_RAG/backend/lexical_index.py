@@ -0,0 +1,105 @@
+"""
+In-process lexical index (BM25) over chunk text, for exact strings dense
+retrieval handles poorly: ID numbers, phone numbers, Chinese names.
+
+Document ids are VectorStore row numbers, so results fuse directly with FAISS.
+"""
+import re
+from collections import Counter
+import numpy as np
+from .tokens import lexical_terms
+from .config import BM25_K1, BM25_B
+
+# A query made only of tokens like these (ID card / phone / contract numbers)
+# is answered from the lexical index without calling the embedding server.
+_IDENTIFIER_TOKEN = re.compile(r"^(?=(?:[A-Za-z]*\d){4})[A-Za-z0-9]{6,}$")
+
+
+def is_identifier_query(query):
+    """True if the query consists only of identifier-like tokens (at least 6 chars, 4+ digits)."""
+    terms = lexical_terms(query)
+    return bool(terms) and all(_IDENTIFIER_TOKEN.match(term) for term in terms)
+
+
+class LexicalIndex:
+    def __init__(self):
+        # term -> (row ids int32, term frequencies uint16), rows ascending
+        self.postings = {}
+        self.doc_lengths = np.zeros(0, dtype='int32')
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, texts):
+        """Indexes texts as the next rows."""
+        start = len(self.doc_lengths)
+        batch = {}
+        lengths = []
+        for offset, text in enumerate(texts):
+            counts = Counter(lexical_terms(text))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                rows, tfs = batch.setdefault(term, ([], []))
+                rows.append(start + offset)
+                tfs.append(min(tf, 65535))
+        for term, (rows, tfs) in batch.items():
+            rows = np.array(rows, dtype='int32')
+            tfs = np.array(tfs, dtype='uint16')
+            old = self.postings.get(term)
+            if old is not None:
+                rows = np.concatenate([old[0], rows])
+                tfs = np.concatenate([old[1], tfs])
+            self.postings[term] = (rows, tfs)
+        self.doc_lengths = np.concatenate([self.doc_lengths, np.array(lengths, dtype='int32')])
+
+    def keep(self, rows):
+        """Keeps only the given rows (ascending), renumbered 0..len(rows)-1, as after a delete."""
+        remap = np.full(len(self.doc_lengths), -1, dtype='int32')
+        remap[rows] = np.arange(len(rows), dtype='int32')
+        for term, (old_rows, tfs) in list(self.postings.items()):
+            new_rows = remap[old_rows]
+            mask = new_rows >= 0
+            if mask.all():
+                self.postings[term] = (new_rows, tfs)
+            elif mask.any():
+                self.postings[term] = (new_rows[mask], tfs[mask])
+            else:
+                del self.postings[term]
+        self.doc_lengths = self.doc_lengths[rows]
+
+    def search(self, query, k, mask=None):
+        """
+        Top-k (row, score) by BM25. mask (boolean array over rows) restricts the
+        result to the rows of a metadata filter before ranking.
+        """
+        n = len(self.doc_lengths)
+        terms = set(lexical_terms(query))
+        matched = [self.postings[t] for t in terms if t in self.postings]
+        if not n or not matched:
+            return []
+        avg_length = max(float(self.doc_lengths.mean()), 1.0)
+        rows_parts, score_parts = [], []
+        for rows, tfs in matched:
+            df = len(rows)
+            idf = np.log(1 + (n - df + 0.5) / (df + 0.5))
+            tf = tfs.astype('float32')
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[rows] / avg_length)
+            rows_parts.append(rows)
+            score_parts.append(idf * tf * (BM25_K1 + 1) / (tf + norm))
+        scores = np.bincount(np.concatenate(rows_parts), weights=np.concatenate(score_parts), minlength=n)
+        if mask is not None:
+            scores[~mask[:n]] = 0
+
+        # Partial sort of the best rows only
+        top = np.flatnonzero(scores) if k >= n else np.argpartition(-scores, k)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(row), float(scores[row])) for row in top if scores[row] > 0]
+
+
+def reciprocal_rank_fusion(rankings, rrf_k, limit):
+    """Fuses ranked row lists: score(row) = sum over rankings of 1 / (rrf_k + rank)."""
+    scores = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking):
+            scores[row] = scores.get(row, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)[:limit]
@@ -1,35 +1,253 @@
+import re
+import time
 from openai import AsyncOpenAI
-from .config import LLM_API_BASE, LLM_API_KEY, LLM_MODEL
+from .config import (
+    LLM_API_BASE, LLM_API_KEY, LLM_MODEL,
+    LLM_DEFAULT_ANSWER_MODE, LLM_REASONING_BUDGET, LLM_THINK_PREFILLED,
+    LLM_CONTEXT_TOKEN_BUDGET, LLM_CHUNK_TOKEN_LIMIT,
+    LLM_HISTORY_TOKEN_BUDGET, LLM_HISTORY_SUMMARY_TOKENS,
+)
+from .tokens import estimate_tokens, truncate_to_tokens, query_terms
+from .metrics import LLM_TTFT_SECONDS, LLM_SECONDS, FAILURES_TOTAL, INFLIGHT_REQUESTS
+from .tracing import span
+
+SYSTEM_PROMPT = """你是一个智能文档助手，负责分析用户的个人文档。
+请使用以下上下文信息来回答用户的问题。
+要求：
+1. 必须使用中文回答。
+2. 如果答案不在上下文中，请明确说明你不知道。
+3. 结合对话历史来理解用户的意图（例如“他的”指代上文提到的人）。
+"""
+
+THINK_PATTERN = re.compile(r"<think>.*?</think>", re.DOTALL | re.IGNORECASE)
+
+# Per-message overhead of the chat template (role markers etc.)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+ANSWER_MODES = ("full", "capped", "none")
+
+# Assistant prefix that skips the reasoning phase entirely
+NO_THINK_PREFILL = "<think>\n\n</think>\n\n"
+
+# Time-to-answer per answer mode, accumulated over the process lifetime
+ANSWER_MODE_STATS = {mode: {"requests": 0, "answered": 0, "time_to_answer_ms": 0.0, "thinking_tokens": 0, "capped": 0}
+                     for mode in ANSWER_MODES}
+
+def answer_mode_stats():
+    """Returns per-mode request counts and average time-to-answer / thinking tokens."""
+    result = {}
+    for mode, data in ANSWER_MODE_STATS.items():
+        n = data["requests"]
+        answered = data["answered"]
+        result[mode] = {
+            "requests": n,
+            "capped": data["capped"],
+            "avg_time_to_answer_ms": round(data["time_to_answer_ms"] / answered, 1) if answered else None,
+            "avg_thinking_tokens": round(data["thinking_tokens"] / n, 1) if n else None,
+        }
+    return result
+
+class ThinkStreamParser:
+    """
+    Incrementally splits streamed LLM output into thinking and answer events.
+    Tags may be split across stream chunks, so a possible partial tag is held back.
+    With detect_prefilled, output is held until the first tag: text before a lone
+    closing tag is reasoning whose opening tag the chat template already emitted
+    (output with no tag at all is released as answer by flush()).
+    """
+    OPEN_TAG = "<think>"
+    CLOSE_TAG = "</think>"
+
+    def __init__(self, detect_prefilled=False):
+        self.buffer = ""
+        self.in_think = False
+        self.undecided = detect_prefilled
+
+    def _partial_tag_len(self, text, tags):
+        lower = text.lower()
+        for size in range(min(len(lower), max(len(t) for t in tags) - 1), 0, -1):
+            if any(t.startswith(lower[-size:]) for t in tags):
+                return size
+        return 0
+
+    def feed(self, text):
+        self.buffer += text
+        events = []
+        while self.buffer:
+            tags = [self.CLOSE_TAG] if self.in_think else [self.OPEN_TAG, self.CLOSE_TAG]
+            lower = self.buffer.lower()
+            found = [(lower.find(t), t) for t in tags if lower.find(t) >= 0]
+            if found:
+                idx, tag = min(found)
+                if self.undecided:
+                    # The first tag tells what the held text was
+                    self.undecided = False
+                    self.in_think = tag == self.CLOSE_TAG
+                self._emit(events, self.buffer[:idx])
+                self.buffer = self.buffer[idx + len(tag):]
+                self.in_think = tag == self.OPEN_TAG
+                continue
+            if self.undecided:
+                break
+            keep = self._partial_tag_len(self.buffer, tags)
+            self._emit(events, self.buffer[:len(self.buffer) - keep])
+            self.buffer = self.buffer[len(self.buffer) - keep:]
+            break
+        return events
+
+    def flush(self):
+        events = []
+        self.undecided = False
+        self._emit(events, self.buffer)
+        self.buffer = ""
+        return events
+
+    def _emit(self, events, text):
+        if text:
+            events.append({"type": "thinking" if self.in_think else "answer", "content": text})
 
 class LLMClient:
-    def __init__(self):
+    def __init__(self, context_budget=LLM_CONTEXT_TOKEN_BUDGET, chunk_limit=LLM_CHUNK_TOKEN_LIMIT,
+                 history_budget=LLM_HISTORY_TOKEN_BUDGET, history_summary_tokens=LLM_HISTORY_SUMMARY_TOKENS):
         self.client = AsyncOpenAI(
             base_url=LLM_API_BASE,
             api_key=LLM_API_KEY,
         )
+        self.context_budget = context_budget
+        self.chunk_limit = chunk_limit
+        self.history_budget = history_budget
+        self.history_summary_tokens = history_summary_tokens
+        # Token accounting of the most recently built prompt
+        self.last_prompt_stats = None
+        # Answer mode / time-to-answer of the most recent streamed answer
+        self.last_answer_stats = None
 
-    async def get_answer_stream(self, query, context_chunks, history=None):
-        if not context_chunks and not history:
-             yield "我无法在提供的文档中找到任何相关信息。"
-             return
+    def trim_chunk(self, text, query, max_tokens):
+        """
+        Returns the part of a chunk most relevant to the query, bounded by max_tokens.
+        The window is grown line by line around the line sharing the most terms with the query.
+        """
+        if estimate_tokens(text) <= max_tokens:
+            return text
 
-        context_str = "\n\n".join([f"来源: {c['source']}\n内容: {c['text']}" for c in context_chunks])
-        
-        system_prompt = """你是一个智能文档助手，负责分析用户的个人文档。
-请使用以下上下文信息来回答用户的问题。
-要求：
-1. 必须使用中文回答。
-2. 如果答案不在上下文中，请明确说明你不知道。
-3. 结合对话历史来理解用户的意图（例如“他的”指代上文提到的人）。
-"""
+        lines = text.splitlines()
+        terms = query_terms(query)
+        scores = []
+        for line in lines:
+            line_lower = line.lower()
+            scores.append(sum(1 for t in terms if t in line_lower))
+
+        if not lines or max(scores) == 0:
+            return truncate_to_tokens(text, max_tokens) + " ..."
+
+        best = scores.index(max(scores))
+        start, end = best, best + 1
+        used = estimate_tokens(lines[best])
+        if used >= max_tokens:
+            return truncate_to_tokens(lines[best], max_tokens) + " ..."
+
+        # Expand alternately below and above the anchor line
+        grew = True
+        while grew:
+            grew = False
+            if end < len(lines):
+                cost = estimate_tokens(lines[end]) + 1
+                if used + cost <= max_tokens:
+                    used += cost
+                    end += 1
+                    grew = True
+            if start > 0:
+                cost = estimate_tokens(lines[start - 1]) + 1
+                if used + cost <= max_tokens:
+                    used += cost
+                    start -= 1
+                    grew = True
+
+        window = "\n".join(lines[start:end])
+        if start > 0:
+            window = "... " + window
+        if end < len(lines):
+            window = window + " ..."
+        return window
+
+    def pack_context(self, query, context_chunks):
+        """Packs retrieved chunks (in rank order) into the context budget."""
+        parts = []
+        used = 0
+        dropped = 0
+        for c in context_chunks:
+            remaining = self.context_budget - used
+            header = f"来源: {c['source']}\n内容: "
+            header_tokens = estimate_tokens(header)
+            if remaining - header_tokens <= 0:
+                dropped += 1
+                continue
+            text = self.trim_chunk(c['text'], query, min(self.chunk_limit, remaining - header_tokens))
+            if not text:
+                dropped += 1
+                continue
+            part = header + text
+            parts.append(part)
+            used += estimate_tokens(part)
+        return "\n\n".join(parts), {"context": used, "chunks_used": len(parts), "chunks_dropped": dropped}
+
+    def pack_history(self, history):
+        """
+        Keeps the most recent turns verbatim within the history budget.
+        Older turns are folded into a short extractive summary of the user's earlier questions.
+        """
+        if not history:
+            return [], "", {"history": 0, "history_turns_kept": 0, "history_turns_summarized": 0}
+
+        cleaned = []
+        for msg in history:
+            content = THINK_PATTERN.sub("", msg.get("content") or "").strip()
+            cleaned.append({"role": msg["role"], "content": content})
+
+        summary_budget = min(self.history_summary_tokens, self.history_budget)
+        turn_budget = self.history_budget - summary_budget
+
+        kept = []
+        used = 0
+        for msg in reversed(cleaned):
+            cost = estimate_tokens(msg["content"]) + MESSAGE_OVERHEAD_TOKENS
+            if used + cost > turn_budget:
+                break
+            kept.append(msg)
+            used += cost
+        kept.reverse()
+
+        # Never start the kept window with an assistant turn
+        while kept and kept[0]["role"] != "user":
+            used -= estimate_tokens(kept[0]["content"]) + MESSAGE_OVERHEAD_TOKENS
+            kept.pop(0)
+
+        older = cleaned[:len(cleaned) - len(kept)]
+        summary = ""
+        if older and summary_budget > 0:
+            questions = [m["content"].replace("\n", " ") for m in older if m["role"] == "user" and m["content"]]
+            if questions:
+                summary = truncate_to_tokens("用户此前询问过: " + "；".join(questions), summary_budget)
+
+        stats = {
+            "history": used + estimate_tokens(summary),
+            "history_turns_kept": len(kept),
+            "history_turns_summarized": len(older),
+        }
+        return kept, summary, stats
+
+    def build_messages(self, query, context_chunks, history=None):
+        """Builds the chat messages within the configured token budgets and records token usage."""
+        context_str, context_stats = self.pack_context(query, context_chunks)
+        history_msgs, history_summary, history_stats = self.pack_history(history)
+
+        system_prompt = SYSTEM_PROMPT
+        if history_summary:
+            system_prompt += f"\n较早的对话摘要：{history_summary}\n"
 
         messages = [{"role": "system", "content": system_prompt}]
-        
-        # Add history
-        if history:
-            for msg in history:
-                messages.append({"role": msg["role"], "content": msg["content"]})
-                
+        messages.extend(history_msgs)
+
         # Add current context and query
         user_content = f"""上下文信息:
 {context_str}
@@ -37,25 +255,136 @@ class LLMClient:
 用户问题: {query}
 回答:"""
         messages.append({"role": "user", "content": user_content})
+
+        stats = {
+            "system": estimate_tokens(system_prompt),
+            "query": estimate_tokens(query),
+            **context_stats,
+            **history_stats,
+        }
+        stats["total"] = sum(estimate_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+        self.last_prompt_stats = stats
+        print(f"Prompt tokens: {stats['total']} (context {stats['context']}, history {stats['history']}, "
+              f"chunks {stats['chunks_used']}/{stats['chunks_used'] + stats['chunks_dropped']})")
+        return messages
+
+    async def _stream_content(self, messages, prefill=None):
+        """
+        Streams content deltas. With a prefill the assistant message is continued
+        from that prefix instead of starting a new turn.
+        """
+        kwargs = {}
+        if prefill is not None:
+            messages = messages + [{"role": "assistant", "content": prefill}]
+            kwargs["extra_body"] = {"continue_final_message": True, "add_generation_prompt": False}
+        t_start = time.perf_counter()
+        first_token = True
+        with span("llm", backend=LLM_MODEL, prefill=prefill is not None) as attrs, \
+                INFLIGHT_REQUESTS.track_inprogress(backend=LLM_MODEL):
+            try:
+                stream = await self.client.chat.completions.create(
+                    model=LLM_MODEL,
+                    messages=messages,
+                    temperature=0.7,
+                    stream=True,
+                    **kwargs
+                )
+            except Exception:
+                FAILURES_TOTAL.inc(backend=LLM_MODEL, stage="llm")
+                raise
+            deltas = 0
+            try:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if first_token:
+                            ttft = time.perf_counter() - t_start
+                            LLM_TTFT_SECONDS.observe(ttft, backend=LLM_MODEL)
+                            if attrs is not None:
+                                attrs["ttft_ms"] = round(ttft * 1000, 1)
+                            first_token = False
+                        deltas += 1
+                        yield chunk.choices[0].delta.content
+            finally:
+                await stream.close()
+                LLM_SECONDS.observe(time.perf_counter() - t_start, backend=LLM_MODEL)
+                if attrs is not None:
+                    attrs["deltas"] = deltas
+
+    async def get_answer_stream(self, query, context_chunks, history=None,
+                                answer_mode=LLM_DEFAULT_ANSWER_MODE, reasoning_budget=None):
+        """
+        Streams the answer, always with explicit <think>...</think> tags around reasoning.
+        answer_mode is one of ANSWER_MODES; in "capped" mode reasoning stops after
+        reasoning_budget tokens (LLM_REASONING_BUDGET by default) and the answer is forced.
+        """
+        if not context_chunks and not history:
+             yield "我无法在提供的文档中找到任何相关信息。"
+             return
+
+        if answer_mode not in ANSWER_MODES:
+            answer_mode = "full"
+        budget = reasoning_budget or LLM_REASONING_BUDGET
+        with span("llm_prompt", chunks=len(context_chunks), history=len(history or [])):
+            messages = self.build_messages(query, context_chunks, history)
+
+        t_start = time.perf_counter()
+        parser = ThinkStreamParser(detect_prefilled=answer_mode != "none")
+        state = {"time_to_answer_ms": None, "thinking": [], "thinking_tokens": 0, "capped": False}
+
+        def track(content):
+            for event in parser.feed(content):
+                if event["type"] == "thinking":
+                    state["thinking"].append(event["content"])
+                    state["thinking_tokens"] += estimate_tokens(event["content"])
+                elif state["time_to_answer_ms"] is None and event["content"].strip():
+                    state["time_to_answer_ms"] = (time.perf_counter() - t_start) * 1000
+            return content
         
         try:
-            stream = await self.client.chat.completions.create(
-                model=LLM_MODEL,
-                messages=messages,
-                temperature=0.7,
-                stream=True
-            )
-            async for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
+            if answer_mode == "none":
+                async for content in self._stream_content(messages, prefill=NO_THINK_PREFILL):
+                    yield track(content)
+                return
+
+            if LLM_THINK_PREFILLED:
+                # Make the implicit opening tag explicit for downstream parsers
+                yield track("<think>\n")
+
+            stream = self._stream_content(messages)
+            async for content in stream:
+                yield track(content)
+                if answer_mode == "capped" and parser.in_think and state["thinking_tokens"] >= budget:
+                    state["capped"] = True
+                    break
+            await stream.aclose()
+
+            if state["capped"]:
+                # Close the think block and let the model answer from the truncated reasoning
+                yield track("\n</think>\n\n")
+                prefill = "<think>\n" + "".join(state["thinking"]).strip() + "\n</think>\n\n"
+                async for content in self._stream_content(messages, prefill=prefill):
+                    yield track(content)
         except Exception as e:
             yield f"生成回答时出错: {e}"
+        finally:
+            stats = ANSWER_MODE_STATS[answer_mode]
+            stats["requests"] += 1
+            stats["thinking_tokens"] += state["thinking_tokens"]
+            stats["capped"] += int(state["capped"])
+            if state["time_to_answer_ms"] is not None:
+                stats["answered"] += 1
+                stats["time_to_answer_ms"] += state["time_to_answer_ms"]
+            self.last_answer_stats = {
+                "answer_mode": answer_mode,
+                "time_to_answer_ms": round(state["time_to_answer_ms"], 1) if state["time_to_answer_ms"] is not None else None,
+                "reasoning_capped": state["capped"],
+            }
 
     async def get_answer(self, query, context_chunks):
         if not context_chunks:
             return "I couldn't find any relevant information in the provided documents."
             
-        context_str = "\n\n".join([f"Source: {c['source']}\nContent: {c['text']}" for c in context_chunks])
+        context_str, _ = self.pack_context(query, context_chunks)
         
         prompt = f"""You are a helpful assistant analyzing personal documents. Use the following context to answer the user's question.
 If the answer is not in the context, say you don't know.
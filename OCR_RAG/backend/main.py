@@ -1,21 +1,46 @@
 import os
 import shutil
-from typing import List
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from typing import List, Optional
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.routing import Match
 import uvicorn
 import asyncio
 from pydantic import BaseModel
+import hmac
 import json
 import re
+import time
 
 # Import existing backend logic
-from .processor import DataProcessor
-from .vector_store import VectorStore
-from .embedding import EmbeddingClient
-from .llm import LLMClient
+from .processor import DataProcessor, FILE_FAILED, FILE_INDEXED, FILE_PARTIAL
+from .vector_store import VectorStore, SEARCH_CACHE, SEARCH_MODES, current_store
+from .index_writer import get_index_writer
+from .embedding import EmbeddingClient, QUERY_EMBEDDING_CACHE
+from .llm import LLMClient, ThinkStreamParser, answer_mode_stats
+from .config import (
+    LLM_DEFAULT_ANSWER_MODE, UPLOAD_DIR, UPLOAD_PROCESS_CONCURRENCY, SEARCH_MODE, LEXICAL_IDENTIFIER_FAST_PATH,
+    FIELD_ANSWER_FAST_PATH, EMBED_MODEL, MIGRATION_AUTO_RESUME, SHARD_URLS, TRACE_IGNORE_PATHS,
+    PROFILE_ENDPOINT_ENABLED, PROFILE_TOKEN,
+)
+from .lexical_index import is_identifier_query
+from .filter_index import FilterError, parse_filter
+from .tokens import estimate_tokens
+from .metrics import CURRENT_ENDPOINT, QUEUE_DEPTH, render_metrics
+from .ocr_cache import remove_ocr_result
+from .ingest import Manifest, DEFAULT_MANIFEST
+from .page_cache import PAGE_CACHE, PageNotFound
+from .scheduler import request_priority, scheduler_stats
+from . import migration
+from . import profiling
+from .tracing import TRACES, trace, span, annotate, current_trace_id
+from .shard_router import get_shard_router
+from .upload_intake import (
+    UploadError, stream_multipart_files, person_from_target,
+    received_bytes, write_chunk, complete_upload,
+)
 
 # Initialize App
 app = FastAPI(title="OCR RAG Agent")
@@ -39,12 +64,66 @@ app.add_middleware(
 
 # Directories
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-UPLOAD_DIR = os.path.join(BASE_DIR, "data", "uploads")
 FRONTEND_DIR = os.path.join(BASE_DIR, "frontend")
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(FRONTEND_DIR, exist_ok=True)
 
+def _route_template(scope):
+    """
+    Path template of the route serving the request ("/api/traces/{trace_id}", "/static"),
+    so ids and file names in URLs do not each create a new metrics series.
+    """
+    partial = None
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path  # path matched but not the method (405)
+    return partial or "unmatched"
+
+class EndpointLabelMiddleware:
+    """Sets the metrics endpoint label for everything a request runs, including streamed bodies."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = CURRENT_ENDPOINT.set(_route_template(scope))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            CURRENT_ENDPOINT.reset(token)
+
+app.add_middleware(EndpointLabelMiddleware)
+
+class TracingMiddleware:
+    """Opens a trace per request (backend/tracing.py) and returns its id in the X-Trace-Id header."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if scope["type"] != "http" or path.startswith(TRACE_IGNORE_PATHS):
+            return await self.app(scope, receive, send)
+        # "X-Trace: 1" keeps the trace whatever its duration
+        force = dict(scope.get("headers") or []).get(b"x-trace", b"") in (b"1", b"true")
+        with trace(f"{scope.get('method', '')} {path}", force=force) as current:
+            if current is None:
+                return await self.app(scope, receive, send)
+
+            async def send_with_trace_id(message):
+                if message["type"] == "http.response.start":
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", current.trace_id.encode())]
+                    current.attrs["status"] = message["status"]
+                await send(message)
+
+            await self.app(scope, receive, send_with_trace_id)
+
+app.add_middleware(TracingMiddleware)
+
 # Mount Static Files
 app.mount("/static", StaticFiles(directory=FRONTEND_DIR), name="static")
 
@@ -53,10 +132,33 @@ class ChatRequest(BaseModel):
     query: str
     person_filter: str = "All"
     history: List[dict] = [] # Format: [{"role": "user", "content": "x"}, {"role": "assistant", "content": "y"}]
+    response_format: str = "text" # "text" (raw stream) or "ndjson" (sources / thinking / answer / stats events)
+    answer_mode: str = LLM_DEFAULT_ANSWER_MODE # "full", "capped" (reasoning_budget tokens of <think>) or "none"
+    reasoning_budget: Optional[int] = None
+    mmr: Optional[bool] = None # diversity re-ranking of retrieved chunks (default: SEARCH_MMR)
+    mmr_lambda: Optional[float] = None
+    search_mode: Optional[str] = None # "dense", "lexical" or "hybrid" (default: SEARCH_MODE)
+    filters: Optional[dict] = None # metadata filter expression, see backend/filter_index.py
 
 class ClearHistoryRequest(BaseModel):
     pass
 
+@app.on_event("startup")
+async def resume_migration():
+    if SHARD_URLS:
+        # The shards hold the vectors; each runs its own migration
+        return
+    store_model = (await current_store()).embed_model
+    if store_model == EMBED_MODEL:
+        return
+    state = migration.load_state(EMBED_MODEL)
+    if MIGRATION_AUTO_RESUME and state and state.get("status") in ("running", "swapping"):
+        print(f"Resuming the interrupted migration from {store_model} to {EMBED_MODEL}")
+        migration.start(EMBED_MODEL)
+    else:
+        print(f"Warning: the store was embedded with {store_model} but EMBED_MODEL is {EMBED_MODEL}; "
+              f"queries use {store_model} until POST /api/migration/start re-embeds the store.")
+
 # Routes
 @app.get("/")
 async def read_root():
@@ -66,148 +168,419 @@ async def read_root():
 async def get_progress():
     return UPLOAD_PROGRESS
 
+# Uploaded files waiting for / in processing, shared by all uploads of this process
+_upload_semaphore = asyncio.Semaphore(UPLOAD_PROCESS_CONCURRENCY)
+_background_tasks = set()
+
+def _queue_uploaded_file(processor, path, person_name):
+    """Starts processing one uploaded file; the task outlives the request if the client disconnects."""
+    UPLOAD_PROGRESS["total"] += 1
+    QUEUE_DEPTH.inc(backend="ingest", queue="upload")
+
+    async def process():
+        async with _upload_semaphore:
+            UPLOAD_PROGRESS["current_file"] = os.path.basename(path)
+            # Add a small delay between files to avoid rate limits
+            await asyncio.sleep(0.5)
+            try:
+                # Bulk class: OCR / embedding calls yield to chat queries and /api/add_file.
+                # Traced on its own: processing outlives the upload request
+                with request_priority("bulk"), trace("process_file", kind="job", file=os.path.basename(path)):
+                    return await processor.process_file(path, person_name=person_name)
+            except Exception as e:
+                print(f"Processing error for {path}: {e}")
+                return FILE_FAILED
+            finally:
+                QUEUE_DEPTH.dec(backend="ingest", queue="upload")
+                UPLOAD_PROGRESS["processed"] += 1
+                if UPLOAD_PROGRESS["processed"] >= UPLOAD_PROGRESS["total"] and UPLOAD_PROGRESS["status"] == "processing":
+                    UPLOAD_PROGRESS["status"] = "done"
+
+    task = asyncio.create_task(process())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+def _upload_error(e):
+    return JSONResponse(status_code=e.status_code, content={"detail": str(e), **e.details})
+
 @app.post("/api/upload")
-async def upload_files(files: List[UploadFile] = File(...)):
+async def upload_files(request: Request):
     """
-    Handle folder upload via webkitdirectory.
+    Handle folder upload via webkitdirectory (multipart field "files").
     Files will be saved in data/uploads/ maintaining structure.
     Person name is derived from the immediate parent folder of the file.
+    The body is parsed as it streams in: each file is written off the event loop
+    and queued for processing as soon as it is complete.
     """
     global UPLOAD_PROGRESS
     processor = DataProcessor()
-    
+    tasks = []
+
     try:
         UPLOAD_PROGRESS = {"total": 0, "processed": 0, "current_file": "", "status": "uploading"}
-        
-        # 1. Save all files first (Fast IO)
-        saved_files = []
-        for file in files:
-            original_path = file.filename # e.g. "Folder/Subfolder/file.jpg"
-            target_path = os.path.join(UPLOAD_DIR, original_path)
-            os.makedirs(os.path.dirname(target_path), exist_ok=True)
-            
-            with open(target_path, "wb") as f:
-                shutil.copyfileobj(file.file, f)
-            
-            # Determine Person Name
-            person_name = os.path.basename(os.path.dirname(target_path))
-            if person_name == "uploads" or not person_name:
-                person_name = "unknown"
-                
-            saved_files.append((target_path, person_name))
-
-        # 2. Process sequentially to avoid connection errors
-        # Reduce concurrency to 1 to be safe, as the API seems very fragile to concurrent requests
-        semaphore = asyncio.Semaphore(1) 
-        
-        UPLOAD_PROGRESS["status"] = "processing"
-        UPLOAD_PROGRESS["total"] = len(saved_files)
-        
-        async def process_with_sem(file_info):
-            path, pname = file_info
-            UPLOAD_PROGRESS["current_file"] = os.path.basename(path)
-            async with semaphore:
-                # Add a small delay between files to avoid rate limits
-                await asyncio.sleep(0.5)
-                res = await processor.process_file(path, person_name=pname)
-                UPLOAD_PROGRESS["processed"] += 1
-                return res
+        async for target_path in stream_multipart_files(request, field="files"):
+            tasks.append(_queue_uploaded_file(processor, target_path, person_from_target(target_path)))
 
-        tasks = [process_with_sem(info) for info in saved_files]
+        UPLOAD_PROGRESS["status"] = "processing" if UPLOAD_PROGRESS["processed"] < len(tasks) else "done"
         results = await asyncio.gather(*tasks)
-        
-        saved_count = sum(1 for r in results if r)
-        
+        saved_count = sum(1 for r in results if r != FILE_FAILED)
+        partial_count = sum(1 for r in results if r == FILE_PARTIAL)
+
         UPLOAD_PROGRESS["status"] = "done"
 
-        return {"message": f"成功处理了 {saved_count} 个文件。"}
+        message = f"成功处理了 {saved_count} 个文件。"
+        if partial_count:
+            message += f"其中 {partial_count} 个文件有部分片段嵌入失败，请稍后重新上传。"
+        return {"message": message, "processed": saved_count, "partial": partial_count,
+                "failed": len(results) - saved_count}
+    except UploadError as e:
+        UPLOAD_PROGRESS["status"] = "error"
+        return _upload_error(e)
     except Exception as e:
         UPLOAD_PROGRESS["status"] = "error"
         print(f"Upload error: {e}")
         raise HTTPException(status_code=500, detail=f"上传错误: {str(e)}")
 
+@app.get("/api/upload/chunks/{upload_id}")
+async def upload_chunk_status(upload_id: str):
+    """Bytes already received for a resumable upload (0 if unknown), i.e. the offset to resume from."""
+    try:
+        return {"upload_id": upload_id, "received": received_bytes(upload_id)}
+    except UploadError as e:
+        return _upload_error(e)
+
+@app.put("/api/upload/chunks/{upload_id}")
+async def upload_chunk(upload_id: str, offset: int, request: Request):
+    """Appends the raw request body at `offset` of a resumable upload."""
+    try:
+        return {"upload_id": upload_id, "received": await write_chunk(upload_id, offset, request)}
+    except UploadError as e:
+        return _upload_error(e)
+
+class CompleteUploadRequest(BaseModel):
+    path: str  # relative path, e.g. "Folder/Person/file.jpg"
+    size: int
+
+@app.post("/api/upload/chunks/{upload_id}/complete")
+async def upload_chunk_complete(upload_id: str, body: CompleteUploadRequest):
+    """Moves a fully received upload into data/uploads/ and queues it for processing (see /api/progress)."""
+    global UPLOAD_PROGRESS
+    try:
+        target_path = await complete_upload(upload_id, body.path, body.size)
+    except UploadError as e:
+        return _upload_error(e)
+    if UPLOAD_PROGRESS["status"] not in ("uploading", "processing"):
+        UPLOAD_PROGRESS = {"total": 0, "processed": 0, "current_file": "", "status": "processing"}
+    _queue_uploaded_file(DataProcessor(), target_path, person_from_target(target_path))
+    return {"message": f"已接收文件 {os.path.basename(target_path)}，正在处理。", "status": "queued"}
+
+def _source_events(results):
+    """Describes retrieved chunks for the client, with view tokens as used by /api/summary."""
+    import base64
+    sources = []
+    for item in results:
+        path = item.get('source', '')
+        sources.append({
+            "filename": item.get('filename', ''),
+            "person": item.get('person', 'unknown'),
+            "page": item.get('page'),
+            "token": base64.urlsafe_b64encode(path.encode()).decode() if path else "",
+            "snippet": item.get('text', '')[:200],
+        })
+    return sources
+
+def _ndjson(event):
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+def _ndjson_message(message, timings, sources=()):
+    """Single-answer event stream, used when retrieval cannot proceed or no LLM is needed."""
+    async def generate():
+        yield _ndjson({"type": "sources", "sources": _source_events(sources)})
+        yield _ndjson({"type": "answer", "content": message})
+        yield _ndjson({"type": "stats", **timings, "trace_id": current_trace_id()})
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
 @app.post("/api/chat")
 async def chat(request: ChatRequest):
-    embed_client = EmbeddingClient()
-    vector_store = VectorStore()
+    """
+    Streams an answer. With response_format="text" (default) the raw LLM output is streamed;
+    with "ndjson" one JSON event per line is sent: sources, thinking/answer deltas, then stats.
+    """
+    t_start = time.perf_counter()
+    ndjson = request.response_format == "ndjson"
+    # Sharded deployments search the shard servers instead of the local store
+    router = get_shard_router() if SHARD_URLS else None
+    vector_store = await current_store() if router is None else None
+    # Queries are embedded with the model of the vectors being searched (it changes with a
+    # migration); shards reject queries embedded with another model than theirs
+    embed_client = EmbeddingClient(vector_store.embed_model if router is None else EMBED_MODEL)
     llm_client = LLMClient()
-    
-    if vector_store.index is None or vector_store.index.ntotal == 0:
-        return JSONResponse({"answer": "Knowledge base is empty. Please upload documents first.", "thinking": ""})
+    timings = {}
 
-    # 1. Embed
-    query_embedding = await embed_client.get_embedding(request.query)
-    if not query_embedding:
-        return JSONResponse({"answer": "Failed to process query.", "thinking": ""})
+    async def search(query_embedding, **kwargs):
+        with span("search", mode=kwargs.get("mode"), sharded=router is not None):
+            if router is not None:
+                results = await router.search(query_embedding, embed_model=embed_client.model, **kwargs)
+            else:
+                results = vector_store.search(query_embedding, **kwargs)
+            annotate(results=len(results))
+            return results
+    
+    if router is None and (vector_store.index is None or vector_store.index.ntotal == 0):
+        message = "Knowledge base is empty. Please upload documents first."
+        if ndjson:
+            return _ndjson_message(message, timings)
+        return JSONResponse({"answer": message, "thinking": ""})
 
-    # 2. Search
     person_filter = request.person_filter if request.person_filter != "All" else None
-    results = vector_store.search(query_embedding, k=5, person_filter=person_filter)
+    search_mode = request.search_mode or SEARCH_MODE
+    if search_mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown search_mode '{search_mode}', expected one of {SEARCH_MODES}")
+    if request.mmr_lambda is not None and not 0 <= request.mmr_lambda <= 1:
+        raise HTTPException(status_code=400, detail=f"mmr_lambda must be between 0 and 1, got {request.mmr_lambda}")
+    try:
+        parse_filter(request.filters)
+    except FilterError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid filters: {e}")
+
+    # Field lookups ("张三的身份证号") are answered from the extracted field index, no LLM
+    if FIELD_ANSWER_FAST_PATH and not request.filters:
+        with span("field_answer"):
+            if router is not None:
+                field_answer = await router.field_answer(request.query, person_filter)
+            else:
+                field_answer = vector_store.fields.answer(request.query, vector_store.metadata, person_filter)
+                if field_answer:
+                    field_answer = field_answer[0], [vector_store.metadata[row] for row in field_answer[1]]
+        if field_answer:
+            answer, sources = field_answer
+            timings["fast_path"] = "field"
+            timings["total_ms"] = round((time.perf_counter() - t_start) * 1000, 1)
+            if ndjson:
+                return _ndjson_message(answer, timings, sources)
+            return PlainTextResponse(answer)
+    results = []
+
+    # Lexical search needs no query embedding; identifier-only queries (ID card /
+    # phone numbers) take that path too unless dense search was requested
+    identifier = LEXICAL_IDENTIFIER_FAST_PATH and search_mode != "dense" and is_identifier_query(request.query)
+    if search_mode == "lexical" or identifier:
+        t0 = time.perf_counter()
+        results = await search(None, k=5, person_filter=person_filter, timings=timings,
+                               query_text=request.query, mode="lexical", filters=request.filters)
+        timings["search_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        if results and identifier:
+            timings["fast_path"] = "identifier"
+
+    if not results and search_mode != "lexical":
+        # 1. Embed
+        t0 = time.perf_counter()
+        query_embedding = await embed_client.get_query_embedding(request.query)
+        timings["embed_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        if not query_embedding:
+            message = "Failed to process query."
+            if ndjson:
+                return _ndjson_message(message, timings)
+            return JSONResponse({"answer": message, "thinking": ""})
+
+        # 2. Search
+        t0 = time.perf_counter()
+        results = await search(query_embedding, k=5, person_filter=person_filter,
+                               mmr=request.mmr, mmr_lambda=request.mmr_lambda, timings=timings,
+                               query_text=request.query, mode=search_mode, filters=request.filters)
+        timings["search_ms"] = round((time.perf_counter() - t0) * 1000, 1)
     
     # 3. Stream Response
     async def generate():
         # Stream from LLM
-        stream_gen = llm_client.get_answer_stream(request.query, results, history=request.history)
+        stream_gen = llm_client.get_answer_stream(
+            request.query, results, history=request.history,
+            answer_mode=request.answer_mode, reasoning_budget=request.reasoning_budget)
         
         # We need to buffer output to handle <think> tags if possible, 
         # but for true streaming we just send chunks.
         # Frontend will handle <think> parsing on the fly.
-        async for chunk in stream_gen:
-            yield chunk
+        with span("answer_stream"):
+            async for chunk in stream_gen:
+                yield chunk
+
+    async def generate_events():
+        # Sources go out before the LLM starts, so the client can render them right away
+        yield _ndjson({"type": "sources", "sources": _source_events(results)})
 
+        parser = ThinkStreamParser(detect_prefilled=request.answer_mode != "none")
+        token_counts = {"thinking": 0, "answer": 0}
+        t_llm = time.perf_counter()
+        ttft_ms = None
+        with span("answer_stream"):
+            async for chunk in llm_client.get_answer_stream(
+                request.query, results, history=request.history,
+                answer_mode=request.answer_mode, reasoning_budget=request.reasoning_budget):
+                if ttft_ms is None:
+                    ttft_ms = round((time.perf_counter() - t_llm) * 1000, 1)
+                for event in parser.feed(chunk):
+                    token_counts[event["type"]] += estimate_tokens(event["content"])
+                    yield _ndjson(event)
+        for event in parser.flush():
+            token_counts[event["type"]] += estimate_tokens(event["content"])
+            yield _ndjson(event)
+
+        prompt_stats = llm_client.last_prompt_stats or {}
+        answer_stats = llm_client.last_answer_stats or {}
+        yield _ndjson({
+            "type": "stats",
+            **timings,
+            **answer_stats,
+            "ttft_ms": ttft_ms,
+            "llm_ms": round((time.perf_counter() - t_llm) * 1000, 1),
+            "total_ms": round((time.perf_counter() - t_start) * 1000, 1),
+            "prompt_tokens": prompt_stats.get("total", 0),
+            "thinking_tokens": token_counts["thinking"],
+            "answer_tokens": token_counts["answer"],
+            "trace_id": current_trace_id(),
+        })
+
+    if ndjson:
+        return StreamingResponse(generate_events(), media_type="application/x-ndjson")
     return StreamingResponse(generate(), media_type="text/plain")
 
+@app.get("/api/stats")
+async def get_stats():
+    """Runtime statistics (cache hit rates etc.)."""
+    return {
+        "cache": {
+            "query_embedding": QUERY_EMBEDDING_CACHE.stats(),
+            "search": SEARCH_CACHE.stats(),
+        },
+        "answer_modes": answer_mode_stats(),
+        "index_writer": get_index_writer().stats(),
+        "page_cache": PAGE_CACHE.stats(),
+        "scheduler": scheduler_stats(),
+        "migration": migration.status(),
+        "shards": await get_shard_router().stats() if SHARD_URLS else None,
+        "tracing": TRACES.stats(),
+    }
+
+class MigrationStartRequest(BaseModel):
+    target_model: Optional[str] = None # default: EMBED_MODEL
+
+@app.get("/api/migration")
+async def migration_status():
+    """Embedding model of the store vs the configured one, and re-embedding progress."""
+    return {
+        "store_model": (await current_store()).embed_model,
+        "configured_model": EMBED_MODEL,
+        "migration": migration.status(),
+    }
+
+@app.post("/api/migration/start")
+async def migration_start(body: MigrationStartRequest):
+    """Starts (or resumes) re-embedding the store; queries use the old model until it swaps."""
+    target = body.target_model or EMBED_MODEL
+    if SHARD_URLS:
+        # Each shard holds its own store: run python -m backend.migration with the shard's RAG_DATA_DIR
+        return JSONResponse(status_code=400, content={"message": "分片部署请在各分片上分别运行迁移"})
+    if (await current_store(fresh=True)).embed_model == target:
+        return JSONResponse(status_code=400, content={"message": f"知识库已使用 {target}，无需迁移"})
+    try:
+        migration.start(target)
+    except migration.MigrationError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"message": f"已开始迁移到 {target}", "migration": migration.status()}
+
+@app.post("/api/migration/stop")
+async def migration_stop():
+    """Pauses the migration; the embedded part is kept and the next start resumes from it."""
+    if not migration.stop():
+        return JSONResponse(status_code=400, content={"message": "没有正在运行的迁移"})
+    return {"message": "迁移已暂停"}
+
+@app.get("/api/index_stats")
+async def get_index_stats(recall_sample: int = 0, k: int = 5):
+    """Vector storage statistics: encoding, bytes per vector and (optionally) sampled recall@k."""
+    if SHARD_URLS:
+        return await get_shard_router().stats()
+    store = await current_store()
+    return await asyncio.to_thread(store.stats, recall_sample, k)
+
+@app.get("/api/filter_values")
+async def get_filter_values():
+    """Distinct file types and document types (with chunk counts) for building ChatRequest.filters."""
+    if SHARD_URLS:
+        return await get_shard_router().filter_values()
+    store = await current_store()
+    return {field: store.filters.values(field) for field in ("file_type", "doc_type")}
+
+@app.get("/api/fields")
+async def get_fields(person_id: str):
+    """Typed fields (姓名, 身份证号, ...) extracted at ingest for one person."""
+    if SHARD_URLS:
+        return {"person_id": person_id, "fields": await get_shard_router().fields_of(person_id)}
+    store = await current_store()
+    return {"person_id": person_id, "fields": store.fields.fields_of(person_id)}
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Prometheus metrics in the text exposition format."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/traces")
+async def list_traces(kind: Optional[str] = None, min_ms: float = 0, limit: int = 50):
+    """Recently kept traces (slow, sampled or requested with "X-Trace: 1"), newest first; kind: request / job."""
+    return {"traces": TRACES.recent(kind, min_ms, limit), **TRACES.stats()}
+
+@app.get("/api/traces/{trace_id}")
+async def get_trace(trace_id: str, format: str = "json"):
+    """One trace with its spans; format=chrome exports it for Perfetto / chrome://tracing."""
+    kept = TRACES.get(trace_id)
+    if kept is None:
+        raise HTTPException(status_code=404, detail="Trace not found (not kept, or evicted)")
+    if format == "chrome":
+        return JSONResponse(kept.to_chrome(),
+                            headers={"Content-Disposition": f'attachment; filename="trace-{trace_id}.json"'})
+    return kept.to_dict()
+
+def _check_profile_access(request):
+    """Raises unless the profiler is enabled and the caller has the token (or is local when none is set)."""
+    if not PROFILE_ENDPOINT_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if PROFILE_TOKEN:
+        if not hmac.compare_digest(request.headers.get("x-profile-token", ""), PROFILE_TOKEN):
+            raise HTTPException(status_code=403, detail="Invalid or missing X-Profile-Token")
+    elif request.client is None or request.client.host not in ("127.0.0.1", "::1", "localhost"):
+        raise HTTPException(status_code=403, detail="Profiling is only available from localhost without PROFILE_TOKEN")
+
+@app.post("/api/admin/profile")
+async def admin_profile(request: Request, seconds: float = 10, mode: str = "sample", sort: str = "cumulative",
+                        limit: int = 50, format: str = "json"):
+    """
+    Profiles the live server for `seconds` (see backend/profiling.py): mode "sample"
+    (stacks of all threads) or "cprofile" (event loop thread). format=raw returns
+    folded stacks (flame graphs) or a pstats file (snakeviz) instead of the JSON summary.
+    Off unless PROFILE_ENDPOINT_ENABLED; see PROFILE_TOKEN in config.py.
+    """
+    _check_profile_access(request)
+    if format not in ("json", "raw"):
+        raise HTTPException(status_code=400, detail=f"Unknown format '{format}', expected json or raw")
+    try:
+        result = await profiling.profile(seconds, mode, sort, limit, raw=format == "raw")
+    except profiling.ProfileBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if format == "json":
+        return result
+    if mode == "sample":
+        return PlainTextResponse(result)
+    return Response(result, media_type="application/octet-stream",
+                    headers={"Content-Disposition": 'attachment; filename="profile.pstats"'})
+
 @app.get("/api/summary")
 async def get_summary():
     """Returns a summary of documents by person."""
-    store = VectorStore()
-    if not store.metadata:
-        return {"summary": []}
-    
-    # Aggregate by person
-    summary = {}
-    import re
+    summary = await get_shard_router().summary() if SHARD_URLS else (await current_store()).summary()
     import base64
-    
-    for item in store.metadata:
-        person = item.get('person', 'unknown')
-        if person not in summary:
-            # files is now a dict: filename -> {source_path, ...}
-            summary[person] = {"file_count": 0, "files_map": {}, "real_name": None}
-        
-        summary[person]["file_count"] += 1
-        
-        fname = item.get('filename', 'unknown')
-        if fname not in summary[person]["files_map"]:
-            summary[person]["files_map"][fname] = item.get('source', '')
-        
-        # Try to extract real name if not found yet
-        if not summary[person]["real_name"]:
-            text = item.get('text', '')
-            # Refined heuristic to avoid false positives
-            # 1. 姓名[:\s]*([\u4e00-\u9fa5]{2,4})(?:$|\s|，|。)
-            # Look for 2-4 chinese chars at the start of a line or after "姓名"
-            # Exclude common false positives
-            
-            bad_keywords = ["证件", "号码", "一致", "签发", "出生", "性别", "住址", "民族", "有效", "起始"]
-            
-            # Pattern 1: Explicit Label "姓名: XXX"
-            name_match = re.search(r"姓名[:\s]*([\u4e00-\u9fa5]{2,4})(?:$|\s|，|。|\n)", text)
-            if name_match:
-                candidate = name_match.group(1)
-                if not any(k in candidate for k in bad_keywords):
-                    summary[person]["real_name"] = candidate
-            
-            # Pattern 2: Name usually appears early in ID cards, maybe just look for the first 2-3 char line?
-            # Too risky. Stick to explicit label for now.
-            
-            if not summary[person]["real_name"]:
-                 # 2. Name[:\s]*([A-Za-z\s]+)
-                name_match_en = re.search(r"Name[:\s]*([A-Za-z\s]+)(?:$|\n)", text)
-                if name_match_en:
-                    candidate = name_match_en.group(1).strip()
-                    if len(candidate) > 2 and "Date" not in candidate:
-                        summary[person]["real_name"] = candidate
 
     # Format for frontend
     result = []
@@ -218,7 +591,7 @@ async def get_summary():
         
         # Convert files_map to list of objects
         files_list = []
-        for fname, fpath in data["files_map"].items():
+        for fname, fpath in data["files"].items():
             # Encode path to safe string (base64)
             path_token = base64.urlsafe_b64encode(fpath.encode()).decode()
             files_list.append({"name": fname, "token": path_token})
@@ -226,7 +599,7 @@ async def get_summary():
         result.append({
             "person": display_name,
             "person_id": person, # Add raw person ID for upload context
-            "count": data["file_count"],
+            "count": data["chunks"],
             "files": files_list
         })
     
@@ -250,14 +623,20 @@ async def add_file(person_id: str = Form(...), file: UploadFile = File(...)):
         target_path = os.path.join(person_dir, file.filename)
         # Avoid overwrite? Or allow? Let's allow overwrite for simplicity or assume unique names.
         
-        with open(target_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
+        def save_upload():
+            with open(target_path, "wb") as f:
+                shutil.copyfileobj(file.file, f)
+        await asyncio.to_thread(save_upload)
             
         # Process File (OCR + Embed)
-        success = await processor.process_file(target_path, person_name=person_id)
+        # Someone is waiting at the UI: served ahead of bulk uploads
+        with request_priority("single"):
+            status = await processor.process_file(target_path, person_name=person_id)
         
-        if success:
+        if status == FILE_INDEXED:
             return {"message": f"成功添加文件 {file.filename}"}
+        elif status == FILE_PARTIAL:
+            return {"message": f"已添加文件 {file.filename}，但部分片段嵌入失败，请稍后重新添加。", "partial": True}
         else:
             # If processing failed (no text), maybe we should keep the file? Or delete it?
             # User said "add... calls OCR... vector file needs to be increased"
@@ -295,9 +674,14 @@ async def delete_file(request: dict):
         person_id = os.path.basename(parent_dir)
         
         # 1. Delete from Vector Store
-        store = VectorStore()
-        # Note: delete_file in store rebuilds index.
-        store.delete_file(filename, person_id)
+        if SHARD_URLS:
+            await get_shard_router().delete_matching({"filename": filename, "person": person_id}, allow_all=True)
+        else:
+            # Off the event loop, loading included: a migration swap may hold the store lock
+            # while it embeds on the loop, and opening a writable store reads the whole index
+            await asyncio.to_thread(lambda: VectorStore().delete_file(filename, person_id))
+        remove_ocr_result(decoded_path)
+        PAGE_CACHE.remove_file(decoded_path)
         
         # 2. Delete from Disk
         if os.path.exists(decoded_path):
@@ -309,8 +693,148 @@ async def delete_file(request: dict):
         print(f"Delete error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+class DeletePersonRequest(BaseModel):
+    person_id: str
+    dry_run: bool = False # only report what would be removed
+
+class DeleteFolderRequest(BaseModel):
+    folder: str # relative to data/uploads, e.g. "Folder/Person"
+    dry_run: bool = False
+
+class DeleteFilterRequest(BaseModel):
+    filters: dict # metadata filter expression, see backend/filter_index.py
+    dry_run: bool = False
+    delete_all: bool = False # required when the filter matches every chunk in the index
+
+def _remove_source_files(sources):
+    """Removes cached OCR text, cached pages and (inside data/uploads only) the files themselves."""
+    upload_root = os.path.join(os.path.abspath(UPLOAD_DIR), "")
+    manifest = Manifest(DEFAULT_MANIFEST) if os.path.exists(DEFAULT_MANIFEST) else None
+    deleted = 0
+    try:
+        for source in sources:
+            # Page cache entries are keyed by the file's stat, so drop them before the file
+            PAGE_CACHE.remove_file(source)
+            remove_ocr_result(source)
+            abs_path = os.path.abspath(source)
+            if manifest is not None and abs_path in manifest.entries:
+                # Lets a later ingest run pick the file up again
+                manifest.record({"path": abs_path, "status": "deleted", "deleted_at": time.time()})
+            if abs_path.startswith(upload_root) and os.path.exists(abs_path):
+                os.remove(abs_path)
+                deleted += 1
+                parent = os.path.dirname(abs_path)
+                while parent.startswith(upload_root) and not os.listdir(parent):
+                    os.rmdir(parent)
+                    parent = os.path.dirname(parent)
+    finally:
+        if manifest is not None:
+            manifest.close()
+    return deleted
+
+async def _bulk_delete(filters, dry_run, allow_all=False):
+    """
+    Deletes all chunks matching a filter in one index pass, then their files; reports per-phase timings.
+    A filter matching every chunk is rejected unless allow_all is set.
+    """
+    t0 = time.perf_counter()
+    timings = {}
+    try:
+        if SHARD_URLS:
+            removed = await get_shard_router().delete_matching(filters, dry_run, timings, allow_all)
+        else:
+            # The writable store is opened on the worker thread too: it loads the whole index
+            removed = await asyncio.to_thread(lambda: VectorStore().delete_matching(filters, dry_run, timings, allow_all))
+    except FilterError as e:
+        raise HTTPException(status_code=400, detail=f"过滤条件无效: {e}")
+    except Exception as e:
+        print(f"Bulk delete error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    removed_per_source = {}
+    persons = {}
+    for meta in removed:
+        person = meta.get('person', 'unknown')
+        persons[person] = persons.get(person, 0) + 1
+        if meta.get('source'):
+            removed_per_source[meta['source']] = removed_per_source.get(meta['source'], 0) + 1
+
+    # A partial filter (some pages, "not" / "or" expressions) can leave chunks of a
+    # file in the index: only files with no chunk left lose their caches and upload
+    remaining = await _remaining_chunks(sorted(removed_per_source))
+    if dry_run:
+        remaining = {source: count - removed_per_source[source] for source, count in remaining.items()}
+    sources = sorted(source for source in removed_per_source if remaining.get(source, 0) <= 0)
+    partial = sorted(source for source in removed_per_source if remaining.get(source, 0) > 0)
+
+    files_deleted = 0
+    if not dry_run and sources:
+        t1 = time.perf_counter()
+        files_deleted = await asyncio.to_thread(_remove_source_files, sources)
+        timings["files_ms"] = round((time.perf_counter() - t1) * 1000, 2)
+    timings["total_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+
+    if dry_run:
+        message = f"将删除 {len(removed)} 个片段，其中 {len(sources)} 个文件将被完整删除"
+    else:
+        message = f"成功删除 {len(removed)} 个片段，其中 {len(sources)} 个文件被完整删除"
+    return {
+        "message": message,
+        "dry_run": dry_run,
+        "chunks": len(removed),
+        "persons": persons,
+        "files": sources,
+        "partially_deleted_files": partial,
+        "files_deleted_from_disk": files_deleted,
+        "timings": timings,
+    }
+
+async def _remaining_chunks(sources):
+    """{source: chunks of the file currently in the index}."""
+    if not sources:
+        return {}
+    if SHARD_URLS:
+        # A dry-run delete lists the matching chunks without touching the shards
+        counts = {}
+        for meta in await get_shard_router().delete_matching({"source": sources}, True, {}):
+            counts[meta.get('source')] = counts.get(meta.get('source'), 0) + 1
+        return counts
+    # Fresh: the chunks just deleted must not be counted
+    rows = (await current_store(fresh=True)).filters.rows["source"]
+    return {source: len(rows.get(source, ())) for source in sources}
+
+@app.post("/api/delete/person")
+async def delete_person(body: DeletePersonRequest):
+    """Deletes every file of a person (vectors, metadata, caches and uploaded files)."""
+    # Naming the person is explicit: it may be the only one in the index
+    return await _bulk_delete({"person": body.person_id}, body.dry_run, allow_all=True)
+
+@app.post("/api/delete/folder")
+async def delete_folder(body: DeleteFolderRequest):
+    """Deletes every file below a folder of data/uploads."""
+    folder = os.path.abspath(os.path.join(UPLOAD_DIR, body.folder))
+    if not folder.startswith(os.path.join(os.path.abspath(UPLOAD_DIR), "")):
+        raise HTTPException(status_code=400, detail="目录必须位于上传目录内")
+    return await _bulk_delete({"folder": folder}, body.dry_run, allow_all=True)
+
+@app.post("/api/delete/filter")
+async def delete_by_filter(body: DeleteFilterRequest):
+    """
+    Deletes every chunk matching a metadata filter expression. An empty filter is rejected,
+    as is one matching every chunk unless delete_all is set.
+    Files whose chunks all matched are removed with their caches; files with chunks left
+    are listed under partially_deleted_files and kept.
+    """
+    return await _bulk_delete(body.filters, body.dry_run, body.delete_all)
+
 @app.get("/api/view")
-async def view_file(token: str):
+async def view_file(token: str, page: Optional[int] = None, size: Optional[str] = None):
+    """
+    Without page: the original file (HTTP Range requests are supported, so PDF
+    viewers can fetch only the bytes they need).
+    With page (1-based): a cached JPEG rendering of that page; size="thumb" for a
+    thumbnail (page defaults to 1).
+    """
     import base64
     try:
         # Decode path
@@ -324,46 +848,40 @@ async def view_file(token: str):
             # Or if it's strictly enforced.
             # Let's be slightly more lenient but still safe: check if it exists and is a file.
             pass
-
-        if not os.path.exists(abs_path) or not os.path.isfile(abs_path):
-            raise HTTPException(status_code=404, detail="File not found")
-            
-        return FileResponse(abs_path)
     except Exception as e:
         raise HTTPException(status_code=400, detail="Invalid file token")
 
+    if not os.path.exists(abs_path) or not os.path.isfile(abs_path):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    if page is None and size is None:
+        return FileResponse(abs_path)
+
+    if (page or 1) < 1:
+        raise HTTPException(status_code=400, detail="Page numbers start at 1")
+    try:
+        image_path = await asyncio.to_thread(PAGE_CACHE.get, abs_path, page or 1, size or "page")
+    except PageNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FileResponse(image_path, media_type="image/jpeg", headers={"Cache-Control": "private, max-age=3600"})
+
 @app.get("/api/people")
 async def get_people():
-    # Reload vector store to get latest metadata
-    temp_store = VectorStore()
+    if SHARD_URLS:
+        people = await get_shard_router().people()
+    else:
+        # Shared read-only store, reopened whenever a newer snapshot is published
+        temp_store = await current_store()
+        # Persons come from the filter index and real names from the extracted fields,
+        # so this does not walk every chunk
+        people = {p: temp_store.fields.first(p, "name") for p in temp_store.filters.values("person")}
     people_list = []
-    
-    if temp_store.metadata:
-        # Group by person to find real name if available
-        person_map = {}
-        for item in temp_store.metadata:
-            person = item.get('person', 'unknown')
-            if person not in person_map:
-                person_map[person] = {"real_name": None}
-            
-            # Try to extract real name if not found yet
-            if not person_map[person]["real_name"]:
-                text = item.get('text', '')
-                # Reuse logic from summary
-                bad_keywords = ["证件", "号码", "一致", "签发", "出生", "性别", "住址", "民族", "有效", "起始"]
-                name_match = re.search(r"姓名[:\s]*([\u4e00-\u9fa5]{2,4})(?:$|\s|，|。|\n)", text)
-                if name_match:
-                    candidate = name_match.group(1)
-                    if not any(k in candidate for k in bad_keywords):
-                        person_map[person]["real_name"] = candidate
-        
-        # Build list
-        sorted_people = sorted(list(person_map.keys()))
-        for p in sorted_people:
-            display = p
-            if person_map[p]["real_name"]:
-                display = f"{person_map[p]['real_name']} ({p})"
-            people_list.append({"id": p, "name": display})
+    for p in sorted(people):
+        real_name = people[p]
+        display = f"{real_name} ({p})" if real_name else p
+        people_list.append({"id": p, "name": display})
 
     return {"people": [{"id": "All", "name": "全部"}] + people_list}
 
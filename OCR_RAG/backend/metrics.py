@@ -0,0 +1,168 @@
+"""
+Minimal in-process Prometheus metrics (counters, gauges, histograms) rendered
+in the text exposition format by /api/metrics.
+
+Most series carry `endpoint`, taken from CURRENT_ENDPOINT, which the HTTP
+middleware in main.py sets per request to the matched route's path template
+(tasks spawned by the request inherit it).
+"""
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+CURRENT_ENDPOINT = contextvars.ContextVar("current_endpoint", default="none")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_REGISTRY = []
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_str(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help_text, labels=(), per_endpoint=True):
+        self.name = name
+        self.help = help_text
+        # endpoint is the last label and filled in automatically
+        self.per_endpoint = per_endpoint
+        self.label_names = tuple(labels) + (("endpoint",) if per_endpoint else ())
+        self._values = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _key(self, labels):
+        if not self.per_endpoint:
+            return tuple(labels.get(n, "") for n in self.label_names)
+        return tuple(labels.get(n, "") for n in self.label_names[:-1]) + (labels.get("endpoint") or CURRENT_ENDPOINT.get(),)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in sorted(items):
+            lines.append(f"{self.name}{_label_str(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # per-bucket (non-cumulative) counts, sum, count
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][idx] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = [(k, ([*v[0]], v[1], v[2])) for k, v in self._values.items()]
+        for key, (counts, total, count) in sorted(items):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_label_str(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_str(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_label_str(self.label_names, key)} {count}")
+        return lines
+
+def render_metrics():
+    """Renders all registered metrics in the Prometheus text format."""
+    lines = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# --- Stage latencies ---
+OCR_SECONDS = Histogram("rag_ocr_seconds", "OCR request latency", ["backend"])
+EMBED_SECONDS = Histogram("rag_embedding_seconds", "Embedding request latency", ["backend"])
+LLM_TTFT_SECONDS = Histogram("rag_llm_ttft_seconds", "LLM time to first token", ["backend"])
+LLM_SECONDS = Histogram("rag_llm_seconds", "LLM total generation time", ["backend"])
+SEARCH_SECONDS = Histogram("rag_faiss_search_seconds", "Vector search latency", ["backend"],
+                           buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0))
+MMR_SECONDS = Histogram("rag_mmr_seconds", "MMR diversity re-ranking time", ["backend"],
+                        buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01))
+INDEX_SAVE_SECONDS = Histogram("rag_index_save_seconds", "Index and metadata persistence time", ["backend"])
+INDEX_COMMIT_SECONDS = Histogram("rag_index_commit_seconds", "Index writer commit time (index update + publish)", ["backend"])
+INDEX_COMMIT_WAIT_SECONDS = Histogram("rag_index_commit_wait_seconds", "Time from enqueueing documents to their commit", ["backend"])
+QUEUE_WAIT_SECONDS = Histogram("rag_queue_wait_seconds", "Time waiting for an OCR / embedding slot by priority class",
+                               ["backend", "priority"], buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0))
+INDEX_COMMIT_BATCH = Histogram("rag_index_commit_batch_vectors", "Vectors merged into one index writer commit", ["backend"],
+                               buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000))
+
+# --- Counters ---
+PAGES_TOTAL = Counter("rag_pages_total", "Pages run through OCR", ["backend"])
+CHUNKS_TOTAL = Counter("rag_chunks_total", "Chunks embedded and indexed", ["backend"])
+FAILURES_TOTAL = Counter("rag_failures_total", "Failed backend calls or files", ["backend", "stage"])
+CACHE_HITS_TOTAL = Counter("rag_cache_hits_total", "Cache hits", ["backend", "cache"])
+CACHE_MISSES_TOTAL = Counter("rag_cache_misses_total", "Cache misses", ["backend", "cache"])
+
+# --- Gauges ---
+INDEX_VECTORS = Gauge("rag_index_vectors", "Vectors in the loaded index", ["backend"], per_endpoint=False)
+QUEUE_DEPTH = Gauge("rag_queue_depth", "Files / backend calls waiting for processing", ["backend", "queue"], per_endpoint=False)
+INFLIGHT_REQUESTS = Gauge("rag_inflight_requests", "Backend calls in flight", ["backend"])
@@ -0,0 +1,368 @@
+"""
+Zero-downtime re-embedding of the store after EMBED_MODEL changes.
+
+The published snapshot records the model its vectors came from. Until the
+migration finishes, queries and new uploads keep using that model, while this
+job re-embeds every chunk's saved text with the new one into shadow vectors
+under data/migrations/<model>/. Calls are batched (MIGRATION_BATCH_SIZE), run at
+bulk priority with at most MIGRATION_CONCURRENCY in flight, and can be paced with
+MIGRATION_PAUSE_SECONDS. Once the shadow covers the store, chunks added meanwhile
+are caught up under the write lock and the store swaps to the new vectors and
+model in one published snapshot.
+
+Shadow vectors are keyed by a hash of the chunk text, so an interrupted job
+resumes where it stopped, and files deleted or added meanwhile need no special
+handling.
+
+Usage (from the OCR_RAG directory; the server runs the same job, see /api/migration):
+    python -m backend.migration run                 # migrate to EMBED_MODEL
+    python -m backend.migration run --target bge-m3-v2
+    python -m backend.migration status
+"""
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import time
+import numpy as np
+from .embedding import EmbeddingClient
+from .scheduler import request_priority
+from .vector_store import VectorStore, store_write_lock
+from .config import (
+    EMBED_MODEL, MIGRATION_DIR, MIGRATION_BATCH_SIZE, MIGRATION_CONCURRENCY,
+    MIGRATION_PAUSE_SECONDS, MIGRATION_SWAP_MAX_PENDING,
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows: no protection against two runs of the same migration
+    fcntl = None
+
+EMBED_RETRIES = 3
+
+
+class MigrationError(RuntimeError):
+    pass
+
+
+def text_key(text):
+    return hashlib.sha1((text or "").replace("\n", " ").encode("utf-8")).hexdigest()
+
+
+def _migration_dir(target_model):
+    return os.path.join(MIGRATION_DIR, re.sub(r"[^A-Za-z0-9._-]+", "_", target_model))
+
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+class ShadowVectors:
+    """
+    Append-only vectors of the target model keyed by text hash: vectors.f32 and
+    keys.txt grow together, vectors first, so a crash leaves at most some vector
+    rows without a key, which are cut off on reopening.
+    """
+    def __init__(self, directory, dim=None):
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.keys_path = os.path.join(directory, "keys.txt")
+        self.dim = dim
+        self.rows = {}
+        keys = []
+        if dim and os.path.exists(self.keys_path) and os.path.exists(self.vectors_path):
+            with open(self.keys_path, "r", encoding="utf-8") as f:
+                keys = [line.strip() for line in f if len(line.strip()) == 40]
+            keys = keys[:os.path.getsize(self.vectors_path) // (dim * 4)]
+        self.rows = {key: row for row, key in enumerate(keys)}
+        self.count = len(keys)
+        if os.path.exists(self.vectors_path):
+            os.truncate(self.vectors_path, self.count * (dim or 0) * 4)
+        with open(self.keys_path, "w", encoding="utf-8") as f:
+            f.writelines(key + "\n" for key in keys)
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def append(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype="float32")
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        if vectors.ndim != 2 or vectors.shape != (len(keys), self.dim):
+            raise MigrationError(f"Unexpected embedding shape {vectors.shape}, expected ({len(keys)}, {self.dim})")
+        with open(self.vectors_path, "ab") as f:
+            f.write(vectors.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.keys_path, "a", encoding="utf-8") as f:
+            f.writelines(key + "\n" for key in keys)
+        for key in keys:
+            self.rows[key] = self.count
+            self.count += 1
+
+    def vectors_for(self, keys):
+        """Full vector array with one row per key (all keys must be present)."""
+        if not keys:
+            return np.zeros((0, self.dim or 0), dtype="float32")
+        mapped = np.memmap(self.vectors_path, dtype="float32", mode="r").reshape(-1, self.dim)
+        return np.array(mapped[[self.rows[key] for key in keys]], dtype="float32")
+
+
+class EmbeddingMigration:
+    def __init__(self, target_model=EMBED_MODEL, batch_size=MIGRATION_BATCH_SIZE,
+                 concurrency=MIGRATION_CONCURRENCY, pause_seconds=MIGRATION_PAUSE_SECONDS):
+        self.target_model = target_model
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.pause_seconds = pause_seconds
+        self.dir = _migration_dir(target_model)
+        self.state_path = os.path.join(self.dir, "state.json")
+        self.client = EmbeddingClient(target_model)
+        self.shadow = None
+        self.state = load_state(target_model) or {"target_model": target_model}
+        self._rate_started = None
+        self._rate_embedded = 0
+
+    def _save_state(self, **changes):
+        self.state.update(changes, updated_at=time.time())
+        _write_json_atomic(self.state_path, self.state)
+
+    def _pending(self, metadata):
+        """{text hash: text} of stored chunks without a shadow vector yet; also updates the progress counts."""
+        keys = {}
+        for meta in metadata:
+            keys.setdefault(text_key(meta.get("text", "")), meta.get("text", ""))
+        pending = {key: text for key, text in keys.items() if key not in self.shadow}
+        self.state["total"] = len(keys)
+        self.state["embedded"] = len(keys) - len(pending)
+        return pending
+
+    async def _embed_batch(self, keys, texts):
+        for attempt in range(EMBED_RETRIES):
+            try:
+                vectors = await self.client.get_embeddings(texts)
+                break
+            except Exception as e:
+                self.state["failures"] = self.state.get("failures", 0) + 1
+                if attempt == EMBED_RETRIES - 1:
+                    raise MigrationError(f"Embedding batch failed {EMBED_RETRIES} times: {e}")
+                await asyncio.sleep(2 ** attempt)
+        self.shadow.append(keys, vectors)
+        if self.state.get("dim") is None:
+            self._save_state(dim=self.shadow.dim)
+        self.state["embedded"] = self.state.get("embedded", 0) + len(keys)
+        self._rate_embedded += len(keys)
+        self._save_state()
+        if self.pause_seconds:
+            await asyncio.sleep(self.pause_seconds)
+
+    async def _embed_all(self, pending):
+        items = list(pending.items())
+        batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(batch):
+            async with semaphore:
+                await self._embed_batch([key for key, _ in batch], [text for _, text in batch])
+
+        await asyncio.gather(*[run(batch) for batch in batches])
+
+    def _try_swap(self, loop):
+        """
+        Runs on a worker thread. Under the write lock, embeds the chunks added since the
+        last pass (if few enough) and swaps the store over. False if too many arrived.
+        """
+        with store_write_lock():
+            store = VectorStore()
+            if store.embed_model == self.target_model:
+                return True
+            pending = self._pending(store.metadata)
+            if len(pending) > MIGRATION_SWAP_MAX_PENDING:
+                return False
+            self._save_state(status="swapping")
+            if pending:
+                # Embedding runs on the event loop; writers wait for the lock meanwhile
+                asyncio.run_coroutine_threadsafe(self._embed_all(pending), loop).result()
+            keys = [text_key(meta.get("text", "")) for meta in store.metadata]
+            source_model = store.embed_model
+            store.swap_embeddings(self.shadow.vectors_for(keys), self.target_model)
+        print(f"Migration done: the store now uses {self.target_model} (was {source_model}).")
+        return True
+
+    async def run(self):
+        """Runs (or resumes) the migration to completion; returns the final state."""
+        os.makedirs(self.dir, exist_ok=True)
+        lock_file = open(os.path.join(self.dir, "migration.lock"), "a")
+        try:
+            if fcntl:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise MigrationError(f"A migration to {self.target_model} is already running in another process")
+            with request_priority("bulk"):
+                return await self._run()
+        finally:
+            lock_file.close()
+
+    async def _run(self):
+        store = VectorStore(read_only=True)
+        if store.embed_model == self.target_model:
+            self._save_state(status="done")
+            return self.state
+        self.shadow = ShadowVectors(self.dir, self.state.get("dim"))
+        self.state.setdefault("started_at", time.time())
+        self._save_state(status="running", source_model=store.embed_model, error=None)
+        self._rate_started = time.perf_counter()
+        self._rate_embedded = 0
+        print(f"Migrating {len(store.metadata)} chunks from {store.embed_model} to {self.target_model} "
+              f"({len(self.shadow.rows)} already embedded)")
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                pending = self._pending(store.metadata)
+                if len(pending) <= MIGRATION_SWAP_MAX_PENDING:
+                    if await asyncio.to_thread(self._try_swap, loop):
+                        break
+                else:
+                    await self._embed_all(pending)
+                # Pick up chunks added or deleted while embedding
+                store = VectorStore(read_only=True)
+        except asyncio.CancelledError:
+            self._save_state(status="paused")
+            raise
+        except Exception as e:
+            self._save_state(status="failed", error=str(e))
+            raise
+        self._save_state(status="done", finished_at=time.time())
+        # The shadow vectors now live in the published snapshot
+        for name in ("vectors.f32", "keys.txt"):
+            path = os.path.join(self.dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+        return self.state
+
+    def progress(self):
+        """State plus throughput and ETA of the current run."""
+        result = dict(self.state)
+        total, embedded = result.get("total"), result.get("embedded", 0)
+        if total:
+            result["percent"] = round(embedded / total * 100, 1)
+        if self._rate_started and self._rate_embedded:
+            rate = self._rate_embedded / (time.perf_counter() - self._rate_started)
+            result["chunks_per_second"] = round(rate, 1)
+            if total and result.get("status") == "running":
+                result["eta_seconds"] = round((total - embedded) / rate)
+        return result
+
+
+def load_state(target_model):
+    path = os.path.join(_migration_dir(target_model), "state.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def all_states():
+    states = []
+    for path in sorted(glob.glob(os.path.join(MIGRATION_DIR, "*", "state.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            states.append(json.load(f))
+    return states
+
+
+def discard(target_model):
+    """Removes the shadow vectors and state of a migration that is not running."""
+    shutil.rmtree(_migration_dir(target_model), ignore_errors=True)
+
+
+# The server's background migration (at most one per process)
+_current = None
+_current_task = None
+
+
+def start(target_model=EMBED_MODEL):
+    """Starts or resumes the migration as a task on the running loop; returns it."""
+    global _current, _current_task
+    if _current_task is not None and not _current_task.done():
+        if _current.target_model != target_model:
+            raise MigrationError(f"A migration to {_current.target_model} is already running")
+        return _current
+    _current = EmbeddingMigration(target_model)
+
+    async def run():
+        try:
+            await _current.run()
+        except asyncio.CancelledError:
+            print("Migration paused.")
+        except Exception as e:
+            print(f"Migration failed: {e}")
+
+    _current_task = asyncio.create_task(run())
+    return _current
+
+
+def stop():
+    """Pauses the running migration (resumable); False if none is running."""
+    if _current_task is None or _current_task.done():
+        return False
+    _current_task.cancel()
+    return True
+
+
+def status():
+    """Progress of this process's migration, else the last recorded state of any."""
+    running = _current_task is not None and not _current_task.done()
+    if _current is not None:
+        return {"running": running, **_current.progress()}
+    states = all_states()
+    latest = max(states, key=lambda state: state.get("updated_at", 0)) if states else None
+    return {"running": False, **(latest or {})}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-embed the vector store with another embedding model.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run", help="Run or resume a migration until the store has swapped")
+    run_parser.add_argument("--target", default=EMBED_MODEL, help="Embedding model to migrate to")
+    run_parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    run_parser.add_argument("--concurrency", type=int, default=MIGRATION_CONCURRENCY)
+    run_parser.add_argument("--pause", type=float, default=MIGRATION_PAUSE_SECONDS, help="Seconds to pause after each batch")
+    sub.add_parser("status", help="Show the recorded state of all migrations")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        store_model = VectorStore(read_only=True).embed_model
+        print(json.dumps({"store_model": store_model, "configured_model": EMBED_MODEL,
+                          "migrations": all_states()}, ensure_ascii=False, indent=2))
+        return
+
+    migration = EmbeddingMigration(args.target, args.batch_size, args.concurrency, args.pause)
+
+    async def run_with_progress():
+        task = asyncio.create_task(migration.run())
+        while not task.done():
+            await asyncio.wait({task}, timeout=5)
+            progress = migration.progress()
+            if progress.get("total"):
+                print(f"[{progress.get('embedded', 0)}/{progress['total']}] {progress.get('status')}"
+                      f" {progress.get('chunks_per_second', '-')} chunks/s, ETA {progress.get('eta_seconds', '-')}s")
+        return task.result()
+
+    try:
+        state = asyncio.run(run_with_progress())
+    except (MigrationError, KeyboardInterrupt) as e:
+        print(f"Migration stopped: {e or 'interrupted'} (re-run to resume)")
+        sys.exit(1)
+    print(json.dumps(state, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 import base64
 import json
+import os
 from openai import AsyncOpenAI
-from .config import OCR_API_BASE, OCR_API_KEY, OCR_MODEL
+from .config import OCR_API_BASE, OCR_API_KEY, OCR_MODEL, OCR_MAX_INFLIGHT
+from .metrics import OCR_SECONDS, FAILURES_TOTAL, INFLIGHT_REQUESTS, PAGES_TOTAL
+from .scheduler import get_scheduler
+from .tracing import span
 
 class OCRClient:
     def __init__(self):
@@ -17,21 +21,26 @@ class OCRClient:
     async def get_text(self, image_path, prompt="Extract all text from this image. Output ONLY the extracted text. If there is no text, output nothing."):
         try:
             base64_img = self.encode_image(image_path)
-            response = await self.client.chat.completions.create(
-                model=OCR_MODEL,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_img}"}},
-                            {"type": "text", "text": prompt}
-                        ]
-                    }
-                ],
-                temperature=0.0,
-                top_p=0.95,
-                max_tokens=4096
-            )
+            # Waits for a slot by the caller's priority class (see backend/scheduler.py)
+            with span("ocr", backend=OCR_MODEL, image=os.path.basename(image_path)):
+                async with get_scheduler(OCR_MODEL, OCR_MAX_INFLIGHT).slot():
+                    with INFLIGHT_REQUESTS.track_inprogress(backend=OCR_MODEL), OCR_SECONDS.time(backend=OCR_MODEL):
+                        response = await self.client.chat.completions.create(
+                            model=OCR_MODEL,
+                            messages=[
+                                {
+                                    "role": "user",
+                                    "content": [
+                                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_img}"}},
+                                        {"type": "text", "text": prompt}
+                                    ]
+                                }
+                            ],
+                            temperature=0.0,
+                            top_p=0.95,
+                            max_tokens=4096
+                        )
+            PAGES_TOTAL.inc(backend=OCR_MODEL)
             content = response.choices[0].message.content.strip()
             
             # Clean markdown if present
@@ -74,5 +83,6 @@ class OCRClient:
             except json.JSONDecodeError:
                 return content # Return raw if not JSON
         except Exception as e:
+            FAILURES_TOTAL.inc(backend=OCR_MODEL, stage="ocr")
             print(f"OCR Error for {image_path}: {e}")
             return ""
@@ -0,0 +1,45 @@
+import os
+import json
+import glob
+import hashlib
+from .config import OCR_CACHE_DIR
+
+def _cache_path(file_path):
+    key = hashlib.sha1(os.path.abspath(file_path).encode("utf-8")).hexdigest()
+    return os.path.join(OCR_CACHE_DIR, f"{key}.json")
+
+def save_ocr_result(file_path, person_name, pages, attributes=None):
+    """Stores the per-page OCR texts of a file (and its document attributes)."""
+    entry = {
+        "source": file_path,
+        "person": person_name,
+        "filename": os.path.basename(file_path),
+        "pages": list(pages),
+        **(attributes or {}),
+    }
+    tmp_path = _cache_path(file_path) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(entry, f, ensure_ascii=False)
+    os.replace(tmp_path, _cache_path(file_path))
+
+def load_ocr_result(file_path):
+    """Returns the cached entry for a file, or None."""
+    path = _cache_path(file_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def remove_ocr_result(file_path):
+    path = _cache_path(file_path)
+    if os.path.exists(path):
+        os.remove(path)
+
+def iter_ocr_results():
+    """Yields every cached OCR entry."""
+    for path in sorted(glob.glob(os.path.join(OCR_CACHE_DIR, "*.json"))):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                yield json.load(f)
+        except Exception as e:
+            print(f"Warning: Skipping unreadable OCR cache entry {path}: {e}")
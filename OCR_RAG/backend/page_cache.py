@@ -0,0 +1,189 @@
+"""
+Bounded on-disk cache of rendered document pages and thumbnails for /api/view.
+
+Entries are keyed by the source file's path, mtime and size, so a replaced file
+never serves stale pages. Pages are rendered on first access (a single PDF page
+via pdftoppm's page range) or stored at ingest from the images rendered for OCR.
+"""
+import hashlib
+import os
+import threading
+from PIL import Image
+from pdf2image import convert_from_path
+from .config import (
+    PAGE_CACHE_DIR, PAGE_CACHE_MAX_BYTES, PAGE_RENDER_DPI,
+    PAGE_MAX_WIDTH, THUMBNAIL_WIDTH, PAGE_JPEG_QUALITY,
+)
+
+VARIANTS = {"page": PAGE_MAX_WIDTH, "thumb": THUMBNAIL_WIDTH}
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+class PageNotFound(LookupError):
+    pass
+
+
+class PageCache:
+    def __init__(self, root=PAGE_CACHE_DIR, max_bytes=PAGE_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._render_locks = {}
+        self._total_bytes = None  # computed on first write
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _digest(self, file_path):
+        stat = os.stat(file_path)
+        return hashlib.sha1(f"{os.path.abspath(file_path)}|{stat.st_mtime_ns}|{stat.st_size}".encode("utf-8")).hexdigest()
+
+    def _entry_path(self, file_path, page, variant):
+        digest = self._digest(file_path)
+        return os.path.join(self.root, digest[:2], f"{digest}_{page}_{variant}.jpg")
+
+    def remove_file(self, file_path):
+        """Drops the cached pages of a file (call before the file itself is deleted). Returns entries removed."""
+        try:
+            digest = self._digest(file_path)
+        except FileNotFoundError:
+            # Already gone from disk: its entries are unreachable and age out by eviction
+            return 0
+        directory = os.path.join(self.root, digest[:2])
+        removed = 0
+        with self._lock:
+            try:
+                names = [name for name in os.listdir(directory) if name.startswith(digest + "_")]
+            except FileNotFoundError:
+                return 0
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                removed += 1
+                if self._total_bytes is not None:
+                    self._total_bytes -= size
+        return removed
+
+    def get(self, file_path, page, variant="page"):
+        """Path of the cached JPEG of a page (1-based), rendering it on a miss."""
+        if variant not in VARIANTS:
+            raise ValueError(f"Unknown page variant '{variant}', expected one of {tuple(VARIANTS)}")
+        path = self._entry_path(file_path, page, variant)
+        if self._touch(path):
+            return path
+        with self._lock:
+            render_lock = self._render_locks.setdefault(path, threading.Lock())
+        with render_lock:
+            try:
+                # Another request may have rendered it while we waited
+                if self._touch(path):
+                    return path
+                with self._lock:
+                    self.misses += 1
+                image = self._render(file_path, page)
+                try:
+                    self._store(image, path, VARIANTS[variant])
+                finally:
+                    image.close()
+            finally:
+                with self._lock:
+                    self._render_locks.pop(path, None)
+        return path
+
+    def put_rendered(self, file_path, page, image_path):
+        """Caches all variants of a page from an already rendered image (used at ingest)."""
+        with Image.open(image_path) as image:
+            for variant, max_width in VARIANTS.items():
+                path = self._entry_path(file_path, page, variant)
+                if not os.path.exists(path):
+                    self._store(image, path, max_width)
+
+    def _touch(self, path):
+        """Marks an entry as recently used; False if it is not cached."""
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def _render(self, file_path, page):
+        ext = os.path.splitext(file_path)[1].lower()
+        if ext == '.pdf':
+            images = convert_from_path(file_path, dpi=PAGE_RENDER_DPI, first_page=page, last_page=page)
+            if not images:
+                raise PageNotFound(f"Page {page} not found in {os.path.basename(file_path)}")
+            return images[0]
+        if ext in IMAGE_EXTENSIONS:
+            if page != 1:
+                raise PageNotFound(f"Page {page} not found in {os.path.basename(file_path)}")
+            return Image.open(file_path)
+        raise PageNotFound(f"Cannot render pages of {os.path.basename(file_path)}")
+
+    def _store(self, image, path, max_width):
+        rendered = image.convert("RGB")
+        if rendered.width > max_width:
+            rendered.thumbnail((max_width, rendered.height * max_width // rendered.width + 1))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        rendered.save(tmp_path, "JPEG", quality=PAGE_JPEG_QUALITY)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._entries())
+            else:
+                self._total_bytes += size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(".jpg"):
+                    path = os.path.join(dirpath, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield path, stat.st_size, stat.st_mtime
+
+    def _evict(self):
+        """Removes least recently used entries down to 90% of max_bytes. Must hold self._lock."""
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+        self._total_bytes = total
+
+    def stats(self):
+        with self._lock:
+            total = self._total_bytes
+            if total is None:
+                total = self._total_bytes = sum(size for _, size, _ in self._entries())
+            lookups = self.hits + self.misses
+            return {
+                "bytes": total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+# Shared by all requests of this process
+PAGE_CACHE = PageCache()
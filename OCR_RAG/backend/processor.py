@@ -6,69 +6,208 @@ import shutil
 import asyncio
 from .ocr import OCRClient
 from .embedding import EmbeddingClient
-from .vector_store import VectorStore
+from .index_writer import get_index_writer
+from .vector_store import EmbedModelMismatch, active_embed_model, current_store
+from .shard_router import get_shard_router
+from .chunker import chunk_pages
+from .filter_index import document_attributes
+from .ocr_cache import save_ocr_result, iter_ocr_results
+from .page_cache import PAGE_CACHE
+from .config import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, EMBED_MODEL, OCR_MODEL, PAGE_CACHE_AT_INGEST, SHARD_URLS
+from .metrics import CHUNKS_TOTAL, FAILURES_TOTAL
+from .tracing import span
+
+# process_file outcomes: every chunk indexed, some chunks failed to embed (the rest
+# are indexed), or nothing indexed (no text, or no chunk embedded)
+FILE_INDEXED = "indexed"
+FILE_PARTIAL = "partial"
+FILE_FAILED = "failed"
+
+class RechunkError(RuntimeError):
+    pass
 
 class DataProcessor:
-    def __init__(self):
+    def __init__(self, ocr_concurrency=None, embed_concurrency=None):
+        """
+        ocr_concurrency / embed_concurrency cap the number of in-flight OCR and
+        embedding requests across all files (None = unbounded).
+        """
         self.ocr_client = OCRClient()
         self.embed_client = EmbeddingClient()
-        self.vector_store = VectorStore()
+        self._ocr_semaphore = asyncio.Semaphore(ocr_concurrency) if ocr_concurrency else None
+        self._embed_semaphore = asyncio.Semaphore(embed_concurrency) if embed_concurrency else None
+
+    async def _ocr(self, image_path):
+        if self._ocr_semaphore is None:
+            return await self.ocr_client.get_text(image_path)
+        async with self._ocr_semaphore:
+            return await self.ocr_client.get_text(image_path)
+
+    @property
+    def index_writer(self):
+        # Index updates go through the process-wide writer thread (group commit),
+        # or in a sharded deployment to the shards owning each person
+        return get_shard_router() if SHARD_URLS else get_index_writer()
+
+    def _index_embed_model(self):
+        # Shards check the model themselves; locally it lags EMBED_MODEL during a migration
+        return EMBED_MODEL if SHARD_URLS else active_embed_model()
+
+    def _embed_client_for(self, model):
+        if self.embed_client.model != model:
+            self.embed_client = EmbeddingClient(model)
+        return self.embed_client
+
+    async def _embed(self, text, model):
+        client = self._embed_client_for(model)
+        if self._embed_semaphore is None:
+            return await client.get_embedding(text)
+        async with self._embed_semaphore:
+            return await client.get_embedding(text)
 
     async def process_file(self, file_path, person_name="unknown"):
         """
-        Process a single file: Extract text -> Embed -> Store (Async)
+        Process a single file: Extract text -> Chunk -> Embed -> Store (Async)
+        Returns FILE_INDEXED, FILE_PARTIAL or FILE_FAILED. Chunks already indexed for
+        the file are replaced in the same snapshot (kept if nothing new is indexed).
         """
         print(f"Processing single file {file_path} for person {person_name}")
-        texts = await self._extract_text_async(file_path)
+        with span("extract_text", file=os.path.basename(file_path)) as attrs:
+            texts = await self._extract_text_async(file_path)
+            if attrs is not None:
+                attrs["pages"] = len(texts)
         
         # If OCR returned empty, check if we should still return True (processed but empty) or False (failed)
         # Usually False so we know it didn't add anything.
-        if not texts:
+        if not texts or not any(t and t.strip() for t in texts):
+            FAILURES_TOTAL.inc(backend=OCR_MODEL, stage="file")
             print(f"No text extracted from {file_path}")
-            return False
+            return FILE_FAILED
 
-        new_embeddings = []
-        new_metas = []
-
-        # Create tasks for embeddings
-        embedding_tasks = []
-        valid_texts = []
-        
-        for text in texts:
-            # Filter out empty or very short garbage
-            if not text or len(text.strip()) < 5:
-                continue
-            valid_texts.append(text)
-            embedding_tasks.append(self.embed_client.get_embedding(text))
-        
-        if not embedding_tasks:
+        # Keep the raw page texts so chunks can be rebuilt later without OCR
+        with span("chunk"):
+            attributes = document_attributes(file_path, texts)
+            save_ocr_result(file_path, person_name, texts, attributes)
+            chunks = chunk_pages(texts, file_path, person_name, attributes=attributes)
+        if not chunks:
             print(f"No valid text to embed for {file_path}")
-            return False
+            return FILE_FAILED
 
-        # Run embedding tasks concurrently
-        embeddings = await asyncio.gather(*embedding_tasks)
-        
-        for text, embedding in zip(valid_texts, embeddings):
-            if embedding:
-                new_embeddings.append(embedding)
-                new_metas.append({
-                    "text": text,
-                    "source": file_path,
-                    "person": person_name,
-                    "filename": os.path.basename(file_path)
-                })
+        # Embedded with the model of the published vectors
+        model = self._index_embed_model()
+        with span("embed_chunks", chunks=len(chunks), backend=model):
+            new_embeddings, new_metas = await self._embed_chunks(chunks, model)
         
+        # A changed or re-uploaded file replaces its chunks instead of adding a second copy
+        replace_sources = {file_path, os.path.abspath(file_path)}
         if new_embeddings:
-            # Vector store addition is likely synchronous (FAISS/local file write), 
-            # so we might want to run it in a thread if it's slow, but usually it's fast enough for small batches.
-            # If needed: await asyncio.to_thread(self.vector_store.add_documents, new_embeddings, new_metas)
-            self.vector_store.add_documents(new_embeddings, new_metas)
-            self.vector_store.save() # Force explicit save to disk
+            # Committed (and published) on the writer thread, batched with concurrent files
+            try:
+                # Includes waiting for the writer's group commit
+                with span("index_add", vectors=len(new_embeddings)):
+                    await self.index_writer.add(new_embeddings, new_metas, model, replace_sources)
+            except EmbedModelMismatch:
+                # A migration swapped models while this file was being embedded
+                model = self._index_embed_model()
+                print(f"Store switched to {model}, re-embedding {file_path}")
+                new_embeddings, new_metas = await self._embed_chunks(new_metas, model)
+                if new_embeddings:
+                    await self.index_writer.add(new_embeddings, new_metas, model, replace_sources)
+            CHUNKS_TOTAL.inc(len(new_embeddings), backend=EMBED_MODEL)
             print(f"Successfully indexed {len(new_embeddings)} chunks for {file_path}")
-        else:
+
+        failed = len(chunks) - len(new_embeddings)
+        if not new_embeddings:
+            FAILURES_TOTAL.inc(backend=EMBED_MODEL, stage="file")
             print(f"Embeddings failed for {file_path}")
-        
-        return len(new_embeddings) > 0
+            return FILE_FAILED
+        if failed:
+            # Indexed with what it has; ingest records it as failed and retries it next run
+            FAILURES_TOTAL.inc(backend=EMBED_MODEL, stage="file")
+            print(f"Embeddings failed for {failed} of {len(chunks)} chunks of {file_path}")
+            return FILE_PARTIAL
+        return FILE_INDEXED
+
+    async def _embed_chunks(self, chunks, model):
+        """Embeds chunk metadata dicts concurrently; returns (embeddings, metas) for the successful ones."""
+        embeddings = await asyncio.gather(*[self._embed(c["text"], model) for c in chunks])
+        new_embeddings = []
+        new_metas = []
+        for meta, embedding in zip(chunks, embeddings):
+            if embedding:
+                new_embeddings.append(embedding)
+                new_metas.append(meta)
+        return new_embeddings, new_metas
+
+    async def rechunk_all(self, max_tokens=CHUNK_MAX_TOKENS, overlap=CHUNK_OVERLAP_TOKENS, progress_callback=None):
+        """
+        Rebuilds the whole index from cached OCR text with the given chunking parameters.
+        OCR is not called again; only the embedding server is. Everything is re-embedded,
+        so the rebuilt store uses the configured EMBED_MODEL.
+        Raises RechunkError (the published index is left as it is) if any chunk fails
+        to embed. Indexed files without an OCR cache entry keep their current chunks;
+        if their vectors are from another model, or the store is sharded, it refuses.
+        """
+        entries = list(iter_ocr_results())
+        total = len(entries)
+        all_embeddings, all_metas = await self._uncached_rows({os.path.abspath(e["source"]) for e in entries})
+        kept = len(all_metas)
+        semaphore = asyncio.Semaphore(5)
+        done = 0
+
+        async def rechunk_entry(entry):
+            nonlocal done
+            async with semaphore:
+                # Entries cached before upload times were recorded fall back to the file's mtime
+                uploaded_at = entry.get("uploaded_at")
+                if uploaded_at is None and os.path.exists(entry["source"]):
+                    uploaded_at = os.path.getmtime(entry["source"])
+                attributes = document_attributes(entry["source"], entry["pages"], uploaded_at)
+                chunks = chunk_pages(entry["pages"], entry["source"], entry["person"], max_tokens, overlap,
+                                     attributes=attributes)
+                embeddings, metas = await self._embed_chunks(chunks, EMBED_MODEL)
+                done += 1
+                if progress_callback:
+                    progress_callback(done, total, f"Rechunked {entry['filename']}")
+                return len(chunks), embeddings, metas
+
+        results = await asyncio.gather(*[rechunk_entry(e) for e in entries])
+        failed = sum(expected - len(metas) for expected, _, metas in results)
+        if failed:
+            # Publishing what is left would silently drop those chunks from the index
+            raise RechunkError(f"{failed} chunks failed to embed; the index was not replaced.")
+        for _, embeddings, metas in results:
+            all_embeddings.extend(embeddings)
+            all_metas.extend(metas)
+
+        # Swap the whole index in one go
+        await self.index_writer.replace(all_embeddings, all_metas, EMBED_MODEL)
+        message = f"Rechunked {total} files into {len(all_metas) - kept} chunks."
+        if kept:
+            message += f" Kept {kept} chunks of files without cached OCR text."
+        return message
+
+    async def _uncached_rows(self, cached_sources):
+        """(vectors, metas) of indexed chunks whose file has no OCR cache entry, to carry over as they are."""
+        if SHARD_URLS:
+            summary = await self.index_writer.summary()
+            missing = {source for data in summary.values() for source in data["files"].values()
+                       if os.path.abspath(source) not in cached_sources}
+            if missing:
+                raise RechunkError(f"{len(missing)} indexed files have no cached OCR text (e.g. {sorted(missing)[0]}); "
+                                   f"re-ingest them before rechunking a sharded store.")
+            return [], []
+        store = await current_store(fresh=True)
+        rows = [row for row, meta in enumerate(store.metadata)
+                if os.path.abspath(meta.get("source", "")) not in cached_sources]
+        if not rows:
+            return [], []
+        if store.embed_model != EMBED_MODEL:
+            raise RechunkError(f"{len(rows)} indexed chunks have no cached OCR text and were embedded with "
+                               f"{store.embed_model}, not {EMBED_MODEL}; re-ingest those files first.")
+        sources = {store.metadata[row].get("source", "") for row in rows}
+        print(f"Warning: {len(sources)} indexed files have no cached OCR text; keeping their {len(rows)} chunks as they are.")
+        return [store.vectors[row].tolist() for row in rows], [store.metadata[row] for row in rows]
 
     async def process_directory(self, root_path, progress_callback=None):
         """
@@ -138,12 +277,19 @@ class DataProcessor:
                             image_path = os.path.join(temp_dir, f"page_{i}.jpg")
                             image.save(image_path, 'JPEG')
                             image_paths.append(image_path)
+                            if PAGE_CACHE_AT_INGEST:
+                                # Page previews for /api/view, from the render we already have
+                                try:
+                                    PAGE_CACHE.put_rendered(file_path, i + 1, image_path)
+                                except Exception as e:
+                                    print(f"Page cache failed for {file_path} page {i + 1}: {e}")
                         return image_paths
                     
-                    image_paths = await asyncio.to_thread(process_pdf_sync)
+                    with span("pdf_render"):
+                        image_paths = await asyncio.to_thread(process_pdf_sync)
                     
                     # Now OCR images concurrently
-                    ocr_tasks = [self.ocr_client.get_text(img_path) for img_path in image_paths]
+                    ocr_tasks = [self._ocr(img_path) for img_path in image_paths]
                     texts = await asyncio.gather(*ocr_tasks)
                     
                 finally:
@@ -156,7 +302,7 @@ class DataProcessor:
             # Add retry logic for connection errors
             for attempt in range(3):
                 try:
-                    text = await self.ocr_client.get_text(file_path)
+                    text = await self._ocr(file_path)
                     if text:
                         texts.append(text)
                     break
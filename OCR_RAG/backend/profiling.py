@@ -0,0 +1,144 @@
+"""
+On-demand profiling of the live server (/api/admin/profile).
+
+Two modes, one capture at a time, at most PROFILE_MAX_SECONDS:
+    "sample"   - a background thread samples the stacks of every thread each
+                 PROFILE_SAMPLE_INTERVAL seconds (event loop, to_thread workers,
+                 index writer, migration). Low overhead; reports the hottest
+                 functions and folded stacks for flamegraph.pl / speedscope.
+    "cprofile" - deterministic cProfile of the event loop thread only (code run
+                 via asyncio.to_thread or other threads is not seen). Exact call
+                 counts, but it slows the loop down while it runs.
+"""
+import asyncio
+import cProfile
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from .config import PROFILE_MAX_SECONDS, PROFILE_SAMPLE_INTERVAL
+
+PROFILE_MODES = ("sample", "cprofile")
+CPROFILE_SORTS = ("cumulative", "tottime", "calls")
+
+_busy = threading.Lock()
+
+
+class ProfileBusy(RuntimeError):
+    pass
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds, interval=PROFILE_SAMPLE_INTERVAL):
+    """Samples all threads but this one for `seconds`; returns {(thread name, stack root first): samples}."""
+    own = threading.get_ident()
+    stacks = Counter()
+    rounds = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            stacks[(names.get(ident, str(ident)), tuple(reversed(stack)))] += 1
+        rounds += 1
+        time.sleep(interval)
+    return stacks, rounds
+
+
+def _sample_report(stacks, rounds, seconds, interval, limit):
+    threads = Counter()
+    own_time = Counter()
+    total_time = Counter()
+    for (thread, stack), count in stacks.items():
+        threads[thread] += count
+        if stack:
+            own_time[stack[-1]] += count
+        for label in set(stack):
+            total_time[label] += count
+    samples = sum(threads.values())
+
+    def top(counter):
+        return [{"function": label, "samples": count, "percent": round(count / samples * 100, 1)}
+                for label, count in counter.most_common(limit)]
+
+    return {
+        "mode": "sample",
+        "seconds": seconds,
+        "interval_ms": interval * 1000,
+        "rounds": rounds,
+        "samples": samples,
+        # Idle threads are sampled too: a loop mostly in select() is waiting on I/O, not busy
+        "threads": dict(threads.most_common()),
+        "top_self": top(own_time),
+        "top_total": top(total_time),
+    }
+
+
+def folded_stacks(stacks):
+    """One "thread;outer;...;inner count" line per distinct stack (flamegraph.pl, speedscope)."""
+    return "\n".join(f"{';'.join((thread,) + stack)} {count}"
+                     for (thread, stack), count in sorted(stacks.items(), key=lambda item: -item[1])) + "\n"
+
+
+def _cprofile_report(profiler, seconds, sort, limit):
+    stats = pstats.Stats(profiler)
+    stats.sort_stats(sort)
+    rows = []
+    for func in stats.fcn_list[:limit]:
+        primitive_calls, calls, tottime, cumtime, _ = stats.stats[func]
+        rows.append({
+            "function": pstats.func_std_string(func),
+            "calls": calls,
+            "primitive_calls": primitive_calls,
+            "tottime_ms": round(tottime * 1000, 3),
+            "cumtime_ms": round(cumtime * 1000, 3),
+        })
+    return {"mode": "cprofile", "seconds": seconds, "sort": sort,
+            "total_calls": stats.total_calls, "total_ms": round(stats.total_tt * 1000, 1), "top": rows}
+
+
+async def profile(seconds, mode="sample", sort="cumulative", limit=50, raw=False):
+    """
+    Profiles the running process for `seconds` (capped at PROFILE_MAX_SECONDS).
+    Returns the report dict, or with raw=True the folded stacks ("sample") or the
+    marshalled pstats data ("cprofile", open with pstats / snakeviz).
+    Raises ProfileBusy if another capture is running, ValueError on bad arguments.
+    """
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode '{mode}', expected one of {PROFILE_MODES}")
+    if sort not in CPROFILE_SORTS:
+        raise ValueError(f"Unknown sort '{sort}', expected one of {CPROFILE_SORTS}")
+    seconds = min(max(float(seconds), 0.1), PROFILE_MAX_SECONDS)
+    if not _busy.acquire(blocking=False):
+        raise ProfileBusy("A profile is already being captured")
+    try:
+        print(f"Profiling ({mode}) for {seconds:.1f}s")
+        if mode == "sample":
+            stacks, rounds = await asyncio.to_thread(sample_stacks, seconds, PROFILE_SAMPLE_INTERVAL)
+            if raw:
+                return folded_stacks(stacks)
+            return _sample_report(stacks, rounds, seconds, PROFILE_SAMPLE_INTERVAL, limit)
+        # The profiler hooks the thread enabling it: here, the event loop
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+        if raw:
+            profiler.create_stats()
+            return marshal.dumps(profiler.stats)
+        return _cprofile_report(profiler, seconds, sort, limit)
+    finally:
+        _busy.release()
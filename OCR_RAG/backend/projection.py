@@ -0,0 +1,167 @@
+"""
+Fit and evaluate the dimensionality-reduction stage of the vector index.
+
+Usage (from the OCR_RAG directory):
+    python -m backend.projection fit                       # refit with VECTOR_PROJECTION / _DIM
+    python -m backend.projection fit --method pca --dim 256
+    python -m backend.projection report --dims 64,128,256,512 --output projection_report.json
+
+`fit` rebuilds the published index (PCA re-fitted on the current corpus) in one
+snapshot. The server must run with the same VECTOR_PROJECTION settings, or its
+next write rebuilds the index back to its own configuration.
+
+`report` measures, for each projection method and dimension, recall@k of the
+projected index against exact search over the full vectors (all rows and
+within the query's person), with and without exact re-ranking, plus index
+size and query time. The published store is not modified.
+"""
+import argparse
+import copy
+import json
+import sys
+import time
+import numpy as np
+import faiss
+from .vector_store import VectorStore, PROJECTIONS
+from .config import VECTOR_PROJECTION, VECTOR_PROJECTION_DIM, VECTOR_RERANK_FACTOR
+
+
+def _neighbours(index, queries, rows, k, params=None):
+    """Top-k row ids per query from a FAISS index, excluding the query's own row."""
+    _, found = index.search(queries, k + 1, params=params)
+    return [[int(i) for i in f if i != -1 and i != row][:k] for f, row in zip(found, rows)]
+
+
+def _recall(found, truth, k):
+    hits = sum(len(set(f[:k]) & set(t)) for f, t in zip(found, truth))
+    total = sum(min(k, len(t)) for t in truth)
+    return round(hits / total, 4) if total else None
+
+
+def _person_selector(mask):
+    bitmap = np.packbits(mask, bitorder='little')
+    return faiss.SearchParameters(sel=faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))), bitmap
+
+
+def _person_neighbours(store, query, row, mask, k):
+    """
+    Top-k rows of the query's person from store.index, searched as VectorStore._dense_candidates
+    does: with an ID selector, or for IndexPQ (which takes none) oversampled by the person's
+    share of the rows and filtered.
+    """
+    if isinstance(store._base_index(), faiss.IndexPQ):
+        search_k = min((k + 1) * 2 * -(-len(mask) // int(mask.sum())), store.index.ntotal)
+        _, found = store.index.search(query, search_k)
+        return [int(i) for i in found[0] if i != -1 and i != row and mask[i]][:k]
+    params, bitmap = _person_selector(mask)
+    return _neighbours(store.index, query, [row], k, params)[0]
+
+
+def evaluate(store, sample_rows, k):
+    """Recall / size / latency of store.index (already built) on the sampled rows as queries."""
+    full = store.vectors
+    queries = np.ascontiguousarray(full[sample_rows], dtype='float32')
+    persons = np.array([meta.get('person') for meta in store.metadata])
+
+    exact = faiss.IndexFlatL2(full.shape[1])
+    exact.add(np.ascontiguousarray(full, dtype='float32'))
+    truth = _neighbours(exact, queries, sample_rows, k)
+
+    t0 = time.perf_counter()
+    found = _neighbours(store.index, queries, sample_rows, k)
+    query_ms = (time.perf_counter() - t0) / len(sample_rows) * 1000
+    wide = _neighbours(store.index, queries, sample_rows, k * VECTOR_RERANK_FACTOR)
+    reranked = [[i for i in store._exact_rerank(q.reshape(1, -1), ids) if i != row][:k]
+                for q, ids, row in zip(queries, wide, sample_rows)]
+
+    person_truth, person_found = [], []
+    for q, row in zip(queries, sample_rows):
+        mask = persons == persons[row]
+        params, bitmap = _person_selector(mask)
+        person_truth += _neighbours(exact, q.reshape(1, -1), [row], k, params)
+        person_found.append(_person_neighbours(store, q.reshape(1, -1), row, mask, k))
+
+    index_bytes = int(faiss.serialize_index(store.index).nbytes)
+    return {
+        "projection": store._projection_label(),
+        "encoding": store._index_encoding(),
+        f"recall@{k}": _recall(found, truth, k),
+        f"recall@{k}_reranked": _recall(reranked, truth, k),
+        f"person_recall@{k}": _recall(person_found, person_truth, k),
+        "index_bytes_per_vector": round(index_bytes / store.index.ntotal, 1),
+        "query_ms": round(query_ms, 3),
+    }
+
+
+def run_report(args):
+    store = VectorStore(read_only=True)
+    if store.vectors is None or not len(store.vectors):
+        print("The vector store is empty.")
+        return None
+    n, dim = store.vectors.shape
+    rng = np.random.default_rng(0)
+    sample_rows = np.sort(rng.choice(n, min(args.queries, n), replace=False))
+    results = []
+    for method in ["none"] + [m for m in args.methods.split(",") if m and m != "none"]:
+        dims = [dim] if method == "none" else [int(d) for d in args.dims.split(",") if int(d) < dim]
+        for target_dim in dims:
+            candidate = copy.copy(store)
+            candidate.projection = method
+            candidate.projection_dim = target_dim
+            t0 = time.perf_counter()
+            candidate._build_index()
+            record = {"method": method, "dim": target_dim, "vectors": n,
+                      "build_s": round(time.perf_counter() - t0, 2),
+                      **evaluate(candidate, sample_rows, args.k)}
+            print(json.dumps(record, ensure_ascii=False))
+            results.append(record)
+    return results
+
+
+def run_fit(args):
+    method = args.method or VECTOR_PROJECTION
+    dim = args.dim or VECTOR_PROJECTION_DIM
+    if (method, dim) != (VECTOR_PROJECTION, VECTOR_PROJECTION_DIM):
+        print(f"Warning: fitting {method}:{dim} but the server is configured with "
+              f"{VECTOR_PROJECTION}:{VECTOR_PROJECTION_DIM} (VECTOR_PROJECTION / VECTOR_PROJECTION_DIM).")
+    store = VectorStore(projection=method, projection_dim=dim)
+    before = store.stats()
+    t0 = time.perf_counter()
+    if not store.refit():
+        print("The vector store is empty.")
+        return None
+    after = store.stats(recall_sample=args.recall_sample)
+    print(f"Refitted in {time.perf_counter() - t0:.1f}s: projection {before['projection']} -> {after['projection']}, "
+          f"{before['index_bytes_per_vector']} -> {after['index_bytes_per_vector']} index bytes per vector.")
+    return after
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Fit or evaluate the vector projection stage.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    fit = sub.add_parser("fit", help="Refit the projection on the current corpus and publish the index")
+    fit.add_argument("--method", choices=PROJECTIONS, default=None)
+    fit.add_argument("--dim", type=int, default=None)
+    fit.add_argument("--recall-sample", type=int, default=200, help="Stored vectors used to estimate recall afterwards")
+    report = sub.add_parser("report", help="Recall vs dimension against the full vectors")
+    report.add_argument("--methods", default="pca,truncate")
+    report.add_argument("--dims", default="64,128,256,512")
+    report.add_argument("--queries", type=int, default=200)
+    report.add_argument("--k", type=int, default=5)
+    for command in (fit, report):
+        command.add_argument("--output", default=None, help="Write the result as JSON to this file")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    result = run_fit(args) if args.command == "fit" else run_report(args)
+    if result is None:
+        sys.exit(1)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""
+Rebuilds the vector index from cached OCR text with new chunking parameters.
+
+Usage (from the OCR_RAG directory):
+    python -m backend.rechunk --max-tokens 400 --overlap 50
+"""
+import argparse
+import asyncio
+import sys
+from .config import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+from .processor import DataProcessor, RechunkError
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-chunk and re-embed all documents from the OCR cache.")
+    parser.add_argument("--max-tokens", type=int, default=CHUNK_MAX_TOKENS, help="Maximum tokens per chunk")
+    parser.add_argument("--overlap", type=int, default=CHUNK_OVERLAP_TOKENS, help="Overlapping tokens between chunks")
+    args = parser.parse_args()
+
+    def progress(current, total, msg):
+        print(f"[{current}/{total}] {msg}")
+
+    processor = DataProcessor()
+    try:
+        result = asyncio.run(processor.rechunk_all(args.max_tokens, args.overlap, progress_callback=progress))
+    except RechunkError as e:
+        print(f"Rechunk aborted: {e}")
+        sys.exit(1)
+    print(result)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import numpy as np
+
+
+def mmr_select(query, vectors, k, lambda_=0.5):
+    """
+    Maximal marginal relevance over candidate vectors (cosine similarity): greedily
+    picks k rows that are relevant to the query but unlike the rows already picked.
+    lambda_=1 is pure relevance, 0 pure diversity. Returns row indices in pick order.
+
+    The pairwise similarities are one matrix product; each pick is then three
+    vector operations over the candidates, so k=50 of 100 candidates stays well
+    under a millisecond.
+    """
+    n = len(vectors)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    vectors = np.asarray(vectors, dtype='float32')
+    query = np.asarray(query, dtype='float32').reshape(-1)
+    vectors = vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12)
+    query = query / (np.linalg.norm(query) + 1e-12)
+
+    relevance = vectors @ query
+    if lambda_ >= 1:
+        return [int(i) for i in np.argsort(-relevance)[:k]]
+
+    gain = lambda_ * relevance
+    penalty = vectors @ vectors.T
+    penalty *= (1 - lambda_)
+
+    i = int(np.argmax(relevance))
+    selected = [i]
+    # Highest similarity penalty of each candidate to anything selected so far
+    worst = penalty[i].copy()
+    gain[i] = -np.inf  # picked rows can never win again
+    scores = np.empty_like(gain)
+    for _ in range(k - 1):
+        np.subtract(gain, worst, out=scores)
+        i = int(scores.argmax())
+        selected.append(i)
+        gain[i] = -np.inf
+        np.maximum(worst, penalty[i], out=worst)
+    return selected
@@ -0,0 +1,154 @@
+"""
+Priority scheduling of OCR and embedding calls.
+
+Every backend has a fixed number of in-flight slots. Callers wait in one FIFO per
+priority class and a freed slot goes to the most urgent waiter:
+    interactive (chat queries) > single (/api/add_file) > bulk (uploads, ingest, rechunk)
+so a user waiting at the UI never queues behind thousands of bulk pages. A waiter
+gains one class of urgency per PRIORITY_AGING_SECONDS waited, so bulk work still
+progresses under constant interactive load, and the last PRIORITY_RESERVED_SLOTS
+slots are only handed to interactive calls.
+
+The class comes from the request_priority context (tasks inherit it), default bulk.
+"""
+import asyncio
+import contextvars
+import time
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from .metrics import QUEUE_DEPTH, QUEUE_WAIT_SECONDS
+from .tracing import span
+from .config import PRIORITY_AGING_SECONDS, PRIORITY_RESERVED_SLOTS
+
+PRIORITIES = ("interactive", "single", "bulk")
+_RANK = {name: rank for rank, name in enumerate(PRIORITIES)}
+
+CURRENT_PRIORITY = contextvars.ContextVar("request_priority", default="bulk")
+
+
+@contextmanager
+def request_priority(priority):
+    """Runs the enclosed backend calls (and tasks created inside) at the given class."""
+    if priority not in _RANK:
+        raise ValueError(f"Unknown priority '{priority}', expected one of {PRIORITIES}")
+    token = CURRENT_PRIORITY.set(priority)
+    try:
+        yield
+    finally:
+        CURRENT_PRIORITY.reset(token)
+
+
+class _Waiter:
+    __slots__ = ("future", "enqueued_at")
+
+    def __init__(self, future):
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class BackendScheduler:
+    def __init__(self, backend, max_inflight, aging_seconds=PRIORITY_AGING_SECONDS,
+                 reserved_slots=PRIORITY_RESERVED_SLOTS):
+        self.backend = backend
+        self.max_inflight = max_inflight
+        self.aging_seconds = aging_seconds
+        # Never reserve every slot, or non-interactive work could not run at all
+        self.reserved_slots = min(reserved_slots, max_inflight - 1)
+        self.inflight = 0
+        self.queues = {name: deque() for name in PRIORITIES}
+        self.granted = {name: 0 for name in PRIORITIES}
+        self.waited = {name: 0.0 for name in PRIORITIES}
+        self.max_wait = {name: 0.0 for name in PRIORITIES}
+
+    def _can_start(self, priority):
+        limit = self.max_inflight if priority == "interactive" else self.max_inflight - self.reserved_slots
+        return self.inflight < limit
+
+    def _next_waiter(self):
+        """Head of the queue with the best aged rank among classes allowed a slot right now."""
+        now = time.perf_counter()
+        best = None
+        for name in PRIORITIES:
+            queue = self.queues[name]
+            if not queue or not self._can_start(name):
+                continue
+            score = _RANK[name] - (now - queue[0].enqueued_at) / self.aging_seconds
+            if best is None or score < best[0]:
+                best = (score, name)
+        return best and best[1]
+
+    def _dispatch(self):
+        while True:
+            name = self._next_waiter()
+            if name is None:
+                return
+            waiter = self.queues[name].popleft()
+            QUEUE_DEPTH.dec(backend=self.backend, queue=name)
+            if waiter.future.done():
+                # Cancelled while queued
+                continue
+            self.inflight += 1
+            waiter.future.set_result(None)
+
+    def _record_wait(self, priority, seconds):
+        self.granted[priority] += 1
+        self.waited[priority] += seconds
+        self.max_wait[priority] = max(self.max_wait[priority], seconds)
+        QUEUE_WAIT_SECONDS.observe(seconds, backend=self.backend, priority=priority)
+
+    @asynccontextmanager
+    async def slot(self, priority=None):
+        """Holds one in-flight slot of the backend for the enclosed call."""
+        priority = priority or CURRENT_PRIORITY.get()
+        t0 = time.perf_counter()
+        if self._can_start(priority) and not any(self.queues[name] for name in PRIORITIES[:_RANK[priority] + 1]):
+            self.inflight += 1
+        else:
+            waiter = _Waiter(asyncio.get_running_loop().create_future())
+            self.queues[priority].append(waiter)
+            QUEUE_DEPTH.inc(backend=self.backend, queue=priority)
+            try:
+                with span("queue_wait", backend=self.backend, priority=priority):
+                    await waiter.future
+            except asyncio.CancelledError:
+                if waiter.future.done() and not waiter.future.cancelled():
+                    # Granted a slot just as we were cancelled: hand it on
+                    self.inflight -= 1
+                    self._dispatch()
+                raise
+        self._record_wait(priority, time.perf_counter() - t0)
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+            self._dispatch()
+
+    def stats(self):
+        return {
+            "inflight": self.inflight,
+            "max_inflight": self.max_inflight,
+            "queued": {name: len(self.queues[name]) for name in PRIORITIES},
+            "granted": dict(self.granted),
+            "avg_wait_ms": {name: round(self.waited[name] / self.granted[name] * 1000, 1) if self.granted[name] else None
+                            for name in PRIORITIES},
+            "max_wait_ms": {name: round(self.max_wait[name] * 1000, 1) for name in PRIORITIES},
+        }
+
+
+# Futures belong to one event loop, so each loop (server, ingest CLI, bench) gets its own schedulers
+_schedulers = weakref.WeakKeyDictionary()
+
+
+def get_scheduler(backend, max_inflight):
+    """The scheduler for a backend on the running event loop."""
+    by_backend = _schedulers.setdefault(asyncio.get_running_loop(), {})
+    if backend not in by_backend:
+        by_backend[backend] = BackendScheduler(backend, max_inflight)
+    return by_backend[backend]
+
+
+def scheduler_stats():
+    """Stats of the schedulers on the running event loop."""
+    by_backend = _schedulers.get(asyncio.get_running_loop(), {})
+    return {backend: scheduler.stats() for backend, scheduler in by_backend.items()}
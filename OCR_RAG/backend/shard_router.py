@@ -0,0 +1,309 @@
+"""
+Scatter-gather over shard servers (backend/shard_server.py), used in place of the
+local store when SHARD_URLS is set.
+
+Persons are hash-partitioned: all chunks of a person live on shard
+sha1(person) % len(SHARD_URLS). Queries filtered to persons go only to the shards
+owning them (one shard for a person_filter, which runs the whole search). Other
+queries go to every shard in parallel; each returns exactly scored candidates
+and the router merges them as the single store would: exact L2 for dense, BM25
+for lexical, reciprocal rank fusion for hybrid, then MMR over the merged pool.
+
+A shard that does not answer within SHARD_TIMEOUT_SECONDS is left out, and the
+query timings mark the result partial. Writes wait for every shard involved
+(SHARD_WRITE_TIMEOUT_SECONDS) and fail otherwise.
+"""
+import asyncio
+import hashlib
+import time
+import weakref
+import httpx
+import numpy as np
+from .filter_index import FilterError, parse_filter, merge_filters
+from .lexical_index import reciprocal_rank_fusion
+from .rerank import mmr_select
+from .tracing import span
+from .vector_store import EmbedModelMismatch, SEARCH_MODES
+from .config import (
+    SHARD_URLS, SHARD_TIMEOUT_SECONDS, SHARD_WRITE_TIMEOUT_SECONDS,
+    SEARCH_MODE, SEARCH_MMR, SEARCH_MMR_LAMBDA, SEARCH_MMR_CANDIDATES, SEARCH_MMR_MAX_CANDIDATES,
+    HYBRID_CANDIDATES, HYBRID_RRF_K,
+)
+
+
+class ShardError(RuntimeError):
+    pass
+
+
+def shard_of(person, n_shards):
+    """Index of the shard owning a person (stable across processes, unlike hash())."""
+    return int(hashlib.sha1(str(person).encode("utf-8")).hexdigest()[:8], 16) % n_shards
+
+
+def _persons_in(expr):
+    """Persons a normalized filter is restricted to (person clauses, also inside "and"), or None."""
+    if not expr:
+        return None
+    if "person" in expr:
+        return set(expr["person"])
+    if "and" in expr:
+        persons = None
+        for part in expr["and"]:
+            found = _persons_in(part)
+            if found is not None:
+                persons = found if persons is None else persons & found
+        return persons
+    return None
+
+
+class ShardRouter:
+    def __init__(self, urls=SHARD_URLS, timeout=SHARD_TIMEOUT_SECONDS, write_timeout=SHARD_WRITE_TIMEOUT_SECONDS):
+        if not urls:
+            raise ValueError("ShardRouter needs at least one shard URL (SHARD_URLS)")
+        self.urls = list(urls)
+        self.timeout = timeout
+        self.write_timeout = write_timeout
+        self.client = httpx.AsyncClient()
+        self.calls = {url: 0 for url in self.urls}
+        self.failures = {url: 0 for url in self.urls}
+        self.timeouts = {url: 0 for url in self.urls}
+        self.seconds = {url: 0.0 for url in self.urls}
+
+    def shard_url(self, person):
+        return self.urls[shard_of(person, len(self.urls))]
+
+    def _urls_for(self, persons):
+        """Shards that can hold chunks of the given persons (all shards for None)."""
+        if persons is None:
+            return list(self.urls)
+        owners = {self.shard_url(person) for person in persons}
+        return [url for url in self.urls if url in owners]
+
+    async def _call(self, url, method, path, payload=None, params=None):
+        # A shard timing out shows up as a cancelled span
+        with span("shard_call", shard=url, path=path):
+            response = await self.client.request(method, url + path, json=payload, params=params,
+                                                 timeout=self.write_timeout)
+        if response.status_code == 409:
+            raise EmbedModelMismatch(f"{url}: {response.json().get('detail')}")
+        if response.status_code == 400:
+            raise FilterError(response.json().get("detail"))
+        response.raise_for_status()
+        return response.json()
+
+    async def _gather(self, urls, method, path, payload=None, params=None, timings=None):
+        """
+        Calls the shards in parallel; returns {url: response} of those that answered
+        within the timeout. Shard outcomes are recorded in timings["shards"].
+        """
+        async def call(url):
+            t0 = time.perf_counter()
+            self.calls[url] += 1
+            try:
+                result = await asyncio.wait_for(self._call(url, method, path, payload, params), self.timeout)
+                status = "ok"
+            except asyncio.TimeoutError:
+                result, status = None, "timeout"
+                self.timeouts[url] += 1
+            except (FilterError, EmbedModelMismatch) as e:
+                result, status = None, f"error: {e}"
+                self.failures[url] += 1
+            except Exception as e:
+                result, status = None, f"error: {type(e).__name__}: {e}"
+                self.failures[url] += 1
+            elapsed = time.perf_counter() - t0
+            self.seconds[url] += elapsed
+            if status != "ok":
+                print(f"Shard {url}{path} failed: {status}")
+            return url, result, status, elapsed
+
+        outcomes = await asyncio.gather(*[call(url) for url in urls])
+        if timings is not None:
+            timings["shards"] = {url: {"status": status, "ms": round(elapsed * 1000, 1)}
+                                 for url, _, status, elapsed in outcomes}
+            timings["shards_answered"] = sum(1 for _, _, status, _ in outcomes if status == "ok")
+            if timings["shards_answered"] < len(urls):
+                timings["partial"] = True
+        return {url: result for url, result, status, _ in outcomes if status == "ok"}
+
+    async def _write(self, calls):
+        """Runs (url, path, payload) writes in parallel; raises ShardError unless all succeed."""
+        async def call(url, path, payload):
+            try:
+                return url, await self._call(url, "POST", path, payload)
+            except EmbedModelMismatch:
+                raise
+            except Exception as e:
+                self.failures[url] += 1
+                raise ShardError(f"Shard {url}{path} failed: {type(e).__name__}: {e}")
+
+        return dict(await asyncio.gather(*[call(url, path, payload) for url, path, payload in calls]))
+
+    async def search(self, query_vector, k=5, person_filter=None, mmr=None, mmr_lambda=None, timings=None,
+                     query_text=None, mode=None, filters=None, embed_model=None):
+        """Same contract as VectorStore.search, over the shards that can hold matching chunks."""
+        expr = merge_filters(parse_filter(filters), parse_filter({"person": person_filter}) if person_filter else None)
+        urls = self._urls_for(_persons_in(expr))
+        mode = mode or SEARCH_MODE
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{mode}', expected one of {SEARCH_MODES}")
+        if not query_text:
+            mode = "dense"
+        elif query_vector is None:
+            mode = "lexical"
+        if timings is not None:
+            timings["search_mode"] = mode
+            timings["shards_queried"] = len(urls)
+        if not urls:
+            return []
+        payload = {
+            "query_vector": list(query_vector) if query_vector is not None else None,
+            "query_text": query_text, "k": k, "person_filter": person_filter, "filters": filters,
+            "mode": mode, "mmr": mmr, "mmr_lambda": mmr_lambda, "embed_model": embed_model,
+        }
+
+        if len(urls) == 1:
+            # The owning shard runs the whole search, MMR included
+            response = (await self._gather(urls, "POST", "/shard/search", payload, timings=timings)).get(urls[0])
+            if response is None:
+                return []
+            if timings is not None:
+                timings.update({key: value for key, value in response["timings"].items() if key not in timings})
+            return response["results"]
+
+        mmr = SEARCH_MMR if mmr is None else mmr
+        mmr_lambda = SEARCH_MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+        mmr = mmr and mode != "lexical"
+        pool = min(max(k * SEARCH_MMR_CANDIDATES, k), max(SEARCH_MMR_MAX_CANDIDATES, k)) if mmr else k
+        limit = max(pool, k * HYBRID_CANDIDATES) if mode == "hybrid" else pool
+        payload.update(limit=limit, with_vectors=mmr)
+        responses = await self._gather(urls, "POST", "/shard/candidates", payload, timings=timings)
+
+        # Candidates are keyed by (shard, row): rows are only unique within a shard
+        t0 = time.perf_counter()
+        metas, vectors, dense, lexical = {}, {}, [], []
+        for url, response in responses.items():
+            for candidate in response["dense"]:
+                key = (url, candidate["row"])
+                metas[key] = candidate["meta"]
+                dense.append((candidate["distance"], key))
+            for candidate in response["lexical"]:
+                key = (url, candidate["row"])
+                metas[key] = candidate["meta"]
+                lexical.append((-candidate["score"], key))
+            for row, vector in response.get("vectors", {}).items():
+                vectors[(url, int(row))] = vector
+        dense = [key for _, key in sorted(dense)][:limit]
+        lexical = [key for _, key in sorted(lexical)][:limit]
+        if mode == "dense":
+            candidates = dense
+        elif mode == "lexical":
+            candidates = lexical
+        else:
+            candidates = reciprocal_rank_fusion([dense, lexical], HYBRID_RRF_K, limit)
+
+        if mmr and len(candidates) > k:
+            candidates = candidates[:pool]
+            order = mmr_select(np.asarray(query_vector, dtype='float32'),
+                               np.array([vectors[key] for key in candidates], dtype='float32'), k, mmr_lambda)
+            candidates = [candidates[i] for i in order]
+        if timings is not None:
+            timings["merge_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+        return [metas[key] for key in candidates[:k]]
+
+    async def field_answer(self, query, person=None):
+        """(answer text, source metadata) from the shards' field indexes, or None (see FieldIndex.answer)."""
+        urls = [self.shard_url(person)] if person else self.urls
+        responses = await self._gather(urls, "POST", "/shard/field_answer", {"query": query, "person": person})
+        answers = [responses[url] for url in urls if responses.get(url) and responses[url]["answer"]]
+        if not answers:
+            return None
+        # Only the longest name match wins, as within one shard
+        longest = max(answer["match"] for answer in answers)
+        answers = [answer for answer in answers if answer["match"] == longest]
+        return "\n".join(answer["answer"] for answer in answers), [s for answer in answers for s in answer["sources"]]
+
+    def _partition(self, embeddings, metas):
+        groups = {}
+        for embedding, meta in zip(embeddings, metas):
+            group = groups.setdefault(self.shard_url(meta.get("person", "unknown")), ([], []))
+            group[0].append(np.asarray(embedding, dtype='float32').tolist())
+            group[1].append(meta)
+        return groups
+
+    async def add(self, embeddings, metas, embed_model=None, replace_sources=None):
+        """Adds documents to the shards owning their persons (same interface as IndexWriter.add)."""
+        groups = self._partition(embeddings, metas)
+        replace_sources = sorted(replace_sources or ())
+        await self._write([(url, "/shard/add", {"embeddings": e, "metas": m, "embed_model": embed_model,
+                                                "replace_sources": replace_sources})
+                           for url, (e, m) in groups.items()])
+
+    async def replace(self, embeddings, metas, embed_model=None):
+        """Replaces the documents of every shard; shards owning none of them are emptied."""
+        groups = self._partition(embeddings, metas)
+        await self._write([(url, "/shard/replace", {"embeddings": groups.get(url, ([], []))[0],
+                                                    "metas": groups.get(url, ([], []))[1], "embed_model": embed_model})
+                           for url in self.urls])
+
+    async def delete_matching(self, filters, dry_run=False, timings=None, allow_all=False):
+        """Deletes matching chunks on every shard that can hold them (VectorStore.delete_matching)."""
+        expr = parse_filter(filters)
+        if expr is None:
+            raise FilterError("Refusing to delete without a filter")
+        urls = self._urls_for(_persons_in(expr))
+        responses = await self._write([(url, "/shard/delete", {"filters": filters, "dry_run": dry_run, "allow_all": allow_all}) for url in urls])
+        if timings is not None:
+            timings["shards"] = {url: response["timings"] for url, response in responses.items()}
+        return [meta for url in urls for meta in responses[url]["removed"]]
+
+    async def people(self):
+        """{person: extracted name or None} over the shards that answered."""
+        people = {}
+        for response in (await self._gather(self.urls, "GET", "/shard/people")).values():
+            people.update(response["people"])
+        return people
+
+    async def summary(self):
+        summary = {}
+        for response in (await self._gather(self.urls, "GET", "/shard/summary")).values():
+            summary.update(response["summary"])
+        return summary
+
+    async def filter_values(self):
+        merged = {}
+        for response in (await self._gather(self.urls, "GET", "/shard/filter_values")).values():
+            for field, values in response.items():
+                for value, count in values.items():
+                    merged.setdefault(field, {})[value] = merged.get(field, {}).get(value, 0) + count
+        return merged
+
+    async def fields_of(self, person):
+        url = self.shard_url(person)
+        response = (await self._gather([url], "GET", "/shard/fields", params={"person_id": person})).get(url)
+        return response["fields"] if response else {}
+
+    async def stats(self):
+        responses = await self._gather(self.urls, "GET", "/shard/stats")
+        return {
+            url: {
+                "calls": self.calls[url],
+                "failures": self.failures[url],
+                "timeouts": self.timeouts[url],
+                "avg_ms": round(self.seconds[url] / self.calls[url] * 1000, 1) if self.calls[url] else None,
+                "shard": responses.get(url),
+            }
+            for url in self.urls
+        }
+
+
+# httpx clients belong to one event loop, so each loop (server, rechunk CLI) gets its own router
+_routers = weakref.WeakKeyDictionary()
+
+
+def get_shard_router():
+    """The router over SHARD_URLS for the running event loop."""
+    loop = asyncio.get_running_loop()
+    if loop not in _routers:
+        _routers[loop] = ShardRouter()
+    return _routers[loop]
@@ -0,0 +1,210 @@
+"""
+Shard server: one VectorStore with its own data directory behind the small HTTP
+API that backend/shard_router.py scatters queries to. Writes go through the
+shard's index writer, so concurrent adds are group-committed as on a single node.
+
+Usage (from the OCR_RAG directory):
+    python -m backend.shard_server --port 9201 --data-dir data/shards/0
+    python -m backend.shard_server --spawn 4 --base-port 9201    # local test cluster
+The spawned cluster prints the SHARD_URLS value to start the main server with.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+from typing import List, Optional
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+
+
+class SearchRequest(BaseModel):
+    query_vector: Optional[List[float]] = None
+    query_text: Optional[str] = None
+    k: int = 5
+    person_filter: Optional[str] = None
+    filters: Optional[dict] = None
+    mode: Optional[str] = None
+    mmr: Optional[bool] = None
+    mmr_lambda: Optional[float] = None
+    embed_model: Optional[str] = None  # model the query vector came from
+    limit: int = 20  # candidates per list (/shard/candidates)
+    with_vectors: bool = False  # full vectors of the candidates, for MMR on the router
+
+
+class WriteRequest(BaseModel):
+    embeddings: List[List[float]]
+    metas: List[dict]
+    embed_model: Optional[str] = None
+    replace_sources: List[str] = []
+
+
+class DeleteRequest(BaseModel):
+    filters: dict
+    dry_run: bool = False
+    allow_all: bool = False
+
+
+class FieldAnswerRequest(BaseModel):
+    query: str
+    person: Optional[str] = None
+
+
+def create_app():
+    # Imported here: the data directory (RAG_DATA_DIR) must be set before config loads
+    from .vector_store import VectorStore, EmbedModelMismatch, current_store
+    from .index_writer import get_index_writer
+    from .filter_index import FilterError
+    from .config import DATA_DIR
+
+    app = FastAPI(title="OCR RAG shard")
+
+    async def store_for_query(request):
+        store = await current_store()
+        if request.query_vector is not None and request.embed_model and store.metadata \
+                and request.embed_model != store.embed_model:
+            raise HTTPException(status_code=409, detail=f"Shard vectors use {store.embed_model}, "
+                                                        f"the query was embedded with {request.embed_model}")
+        return store
+
+    @app.post("/shard/search")
+    async def search(request: SearchRequest):
+        store = await store_for_query(request)
+        timings = {}
+        try:
+            results = store.search(request.query_vector, k=request.k, person_filter=request.person_filter,
+                                   mmr=request.mmr, mmr_lambda=request.mmr_lambda, timings=timings,
+                                   query_text=request.query_text, mode=request.mode, filters=request.filters)
+        except FilterError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"results": results, "timings": timings, "generation": store.generation}
+
+    @app.post("/shard/candidates")
+    async def candidates(request: SearchRequest):
+        """Exactly scored candidates with their metadata, for merging on the router."""
+        store = await store_for_query(request)
+        try:
+            found = store.candidates(request.query_vector, request.query_text, request.limit,
+                                     request.person_filter, request.filters, request.mode)
+        except FilterError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        result = {
+            "dense": [{"row": row, "distance": distance, "meta": store.metadata[row]} for row, distance in found["dense"]],
+            "lexical": [{"row": row, "score": score, "meta": store.metadata[row]} for row, score in found["lexical"]],
+            "generation": store.generation,
+        }
+        if request.with_vectors:
+            rows = sorted({row for row, _ in found["dense"]} | {row for row, _ in found["lexical"]})
+            result["vectors"] = {str(row): store.vectors[row].tolist() for row in rows}
+        return result
+
+    @app.post("/shard/field_answer")
+    async def field_answer(request: FieldAnswerRequest):
+        store = await current_store()
+        answer = store.fields.answer(request.query, store.metadata, request.person)
+        if not answer:
+            return {"answer": None}
+        text, rows = answer
+        # Length of the longest name matched, so the router can prefer "张三丰" on one
+        # shard over "张三" on another, as people_named() does within a shard
+        named = store.fields.people_named(request.query)
+        match = max((len(name) for person in named
+                     for name in {person} | {value for value, _ in store.fields.entries[person].get("name", [])}
+                     if name in request.query), default=0)
+        return {"answer": text, "sources": [store.metadata[row] for row in rows], "match": match}
+
+    @app.post("/shard/add")
+    async def add(request: WriteRequest):
+        try:
+            generation = await get_index_writer().add(request.embeddings, request.metas, request.embed_model,
+                                                      request.replace_sources)
+        except EmbedModelMismatch as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        return {"generation": generation}
+
+    @app.post("/shard/replace")
+    async def replace(request: WriteRequest):
+        generation = await get_index_writer().replace(request.embeddings, request.metas, request.embed_model)
+        return {"generation": generation}
+
+    @app.post("/shard/delete")
+    async def delete(request: DeleteRequest):
+        timings = {}
+        try:
+            removed = await asyncio.to_thread(lambda: VectorStore().delete_matching(
+                request.filters, request.dry_run, timings, request.allow_all))
+        except FilterError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        # The caller only needs to know which files and persons were hit
+        return {"removed": [{key: value for key, value in meta.items() if key != "text"} for meta in removed],
+                "timings": timings}
+
+    @app.get("/shard/people")
+    async def people():
+        store = await current_store()
+        return {"people": {p: store.fields.first(p, "name") for p in store.filters.values("person")}}
+
+    @app.get("/shard/summary")
+    async def summary():
+        return {"summary": (await current_store()).summary()}
+
+    @app.get("/shard/filter_values")
+    async def filter_values():
+        store = await current_store()
+        return {field: store.filters.values(field) for field in ("file_type", "doc_type")}
+
+    @app.get("/shard/fields")
+    async def fields(person_id: str):
+        return {"fields": (await current_store()).fields.fields_of(person_id)}
+
+    @app.get("/shard/stats")
+    async def stats():
+        return {"data_dir": DATA_DIR, "store": (await current_store()).stats(), "index_writer": get_index_writer().stats()}
+
+    return app
+
+
+def spawn(args):
+    """Runs args.spawn shard servers as child processes until interrupted."""
+    from .config import DATA_DIR
+    root = args.data_root or os.path.join(DATA_DIR, "shards")
+    processes = []
+    urls = []
+    for i in range(args.spawn):
+        port = args.base_port + i
+        env = dict(os.environ, RAG_DATA_DIR=os.path.join(root, str(i)))
+        processes.append(subprocess.Popen([sys.executable, "-m", "backend.shard_server",
+                                           "--host", args.host, "--port", str(port)], env=env))
+        urls.append(f"http://{args.host}:{port}")
+    print(f"SHARD_URLS={','.join(urls)}", flush=True)
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve one shard of the vector store, or spawn a local cluster.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9201)
+    parser.add_argument("--data-dir", default=None, help="Data directory of this shard (default: RAG_DATA_DIR)")
+    parser.add_argument("--spawn", type=int, default=0, help="Start this many shard servers as local processes")
+    parser.add_argument("--base-port", type=int, default=9201, help="Port of the first spawned shard")
+    parser.add_argument("--data-root", default=None, help="Parent of the spawned shards' data directories "
+                                                          "(default: data/shards)")
+    args = parser.parse_args()
+    if args.spawn:
+        spawn(args)
+        return
+    if args.data_dir:
+        os.environ["RAG_DATA_DIR"] = os.path.abspath(args.data_dir)
+    uvicorn.run(create_app(), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import math
+import re
+
+# Rough token estimation without pulling in the model tokenizer.
+# Qwen-family tokenizers produce roughly one token per CJK character and
+# one token per ~4 characters of latin text / digits, which is close enough
+# for budgeting prompts.
+_TOKEN_PATTERN = re.compile(r"[\u4e00-\u9fff\u3400-\u4dbf]|[A-Za-z0-9]+|\S")
+_ALNUM_PATTERN = re.compile(r"[A-Za-z0-9]+")
+_CJK_PATTERN = re.compile(r"[\u4e00-\u9fff\u3400-\u4dbf]+")
+_LEXICAL_PATTERN = re.compile(r"[\u4e00-\u9fff\u3400-\u4dbf]+|[A-Za-z0-9]+")
+# Separators inside numbers as written in documents: "138-0000-1234", "1101 0119 ..."
+_DIGIT_SEPARATOR_PATTERN = re.compile(r"(?<=\d)[ \-](?=\d)")
+
+
+def estimate_tokens(text):
+    """Estimates the number of LLM tokens in a piece of text."""
+    if not text:
+        return 0
+    count = 0
+    for piece in _TOKEN_PATTERN.findall(text):
+        if len(piece) > 1:
+            count += math.ceil(len(piece) / 4)
+        else:
+            count += 1
+    return count
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cuts text so that its estimated token count stays within max_tokens."""
+    if max_tokens <= 0 or not text:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    used = 0
+    end = 0
+    for match in _TOKEN_PATTERN.finditer(text):
+        piece = match.group(0)
+        cost = math.ceil(len(piece) / 4) if len(piece) > 1 else 1
+        if used + cost > max_tokens:
+            break
+        used += cost
+        end = match.end()
+    return text[:end]
+
+
+def query_terms(query):
+    """
+    Extracts matching terms from a query: CJK bigrams (plus single chars for
+    one-character runs) and lowercase alphanumeric tokens.
+    """
+    terms = set()
+    for run in _CJK_PATTERN.findall(query or ""):
+        if len(run) == 1:
+            terms.add(run)
+        for i in range(len(run) - 1):
+            terms.add(run[i:i + 2])
+    for tok in _ALNUM_PATTERN.findall(query or ""):
+        terms.add(tok.lower())
+    return terms
+
+
+def lexical_terms(text):
+    """
+    Terms for the lexical (BM25) index, with repeats: CJK bigrams (single chars for
+    one-character runs) and lowercase alphanumeric tokens, with separators inside
+    numbers removed so "138-0000-1234" and "13800001234" match.
+    """
+    terms = []
+    for run in _LEXICAL_PATTERN.findall(_DIGIT_SEPARATOR_PATTERN.sub("", text or "")):
+        if run[0].isascii():
+            terms.append(run.lower())
+        elif len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
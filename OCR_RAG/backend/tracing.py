@@ -0,0 +1,242 @@
+"""
+Per-request tracing spans.
+
+The HTTP middleware in main.py opens a trace per request (background jobs such
+as an uploaded file being processed open their own), and the stages on the
+request's path are marked with
+
+    with span("embedding", backend=model) as attrs:
+        ...
+        attrs["texts"] = len(inputs)   # or annotate(texts=...) from nested code
+
+Spans nest through the CURRENT_SPAN context variable, so tasks created by the
+request and asyncio.to_thread calls are attributed to the right parent. Outside
+a trace span() is a no-op, so CLI tools and the index writer thread pay nothing.
+
+A finished trace is kept when it took at least TRACE_SLOW_MS, was sampled at
+TRACE_SAMPLE_RATE or the client sent "X-Trace: 1". Kept traces are served by
+/api/traces (JSON, or the Chrome trace event format for Perfetto / chrome://tracing)
+and appended to TRACE_EXPORT_FILE as JSON lines if one is configured.
+"""
+import asyncio
+import contextvars
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from .config import (
+    TRACING_ENABLED, TRACE_SLOW_MS, TRACE_SAMPLE_RATE, TRACE_BUFFER_SIZE, TRACE_MAX_SPANS, TRACE_EXPORT_FILE,
+)
+
+CURRENT_TRACE = contextvars.ContextVar("current_trace", default=None)
+CURRENT_SPAN = contextvars.ContextVar("current_span", default=None)
+
+
+def _lane():
+    """Thread and asyncio task a span ran on (concurrent tasks get separate lanes in the viewer)."""
+    thread = threading.current_thread().name
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return f"{thread} / {task.get_name()}" if task else thread
+
+
+class Trace:
+    def __init__(self, name, kind="request", force=False, **attrs):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.kind = kind  # "request" or "job": kept in separate buffers
+        self.force = force
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.duration_ms = None
+        self.spans = []
+        self.dropped = 0
+        self._t0 = time.perf_counter()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def offset_ms(self, t):
+        return round((t - self._t0) * 1000, 3)
+
+    def record(self, span):
+        with self._lock:
+            # Spans of tasks that outlive the request (or past the cap) are not kept
+            if self.duration_ms is not None or len(self.spans) >= TRACE_MAX_SPANS:
+                self.dropped += 1
+                return
+            self.spans.append(span)
+
+    def stages(self):
+        """Total time and count per span name, slowest first."""
+        totals = {}
+        for s in self.spans:
+            entry = totals.setdefault(s["name"], {"count": 0, "total_ms": 0.0})
+            entry["count"] += 1
+            entry["total_ms"] += s["duration_ms"]
+        return dict(sorted(((name, {"count": e["count"], "total_ms": round(e["total_ms"], 1)})
+                            for name, e in totals.items()), key=lambda item: -item[1]["total_ms"]))
+
+    def summary(self):
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "kind": self.kind,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "spans": len(self.spans),
+            "attrs": self.attrs,
+        }
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start_ms"])
+        return {**self.summary(), "stages": self.stages(), "dropped_spans": self.dropped, "spans": spans}
+
+    def to_chrome(self):
+        """Trace event format: load the JSON in Perfetto (ui.perfetto.dev) or chrome://tracing."""
+        data = self.to_dict()
+        lanes = {}
+        events = [{"name": self.name, "ph": "X", "pid": 1, "tid": 0, "ts": 0,
+                   "dur": round((self.duration_ms or 0) * 1000), "args": self.attrs}]
+        for s in data["spans"]:
+            tid = lanes.setdefault(s["lane"], len(lanes) + 1)
+            events.append({"name": s["name"], "ph": "X", "pid": 1, "tid": tid, "ts": round(s["start_ms"] * 1000),
+                           "dur": round(s["duration_ms"] * 1000), "args": s["attrs"]})
+        events += [{"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": lane}}
+                   for lane, tid in lanes.items()]
+        events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": 0, "args": {"name": self.name}})
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"trace_id": self.trace_id}}
+
+
+class TraceBuffer:
+    """The most recent kept traces, per kind, so bulk jobs do not evict request traces."""
+    def __init__(self, size=TRACE_BUFFER_SIZE):
+        self.size = size
+        self._traces = {}
+        self._by_id = OrderedDict()
+        self._lock = threading.Lock()
+        self.finished = 0
+        self.kept = 0
+
+    def add(self, trace, keep):
+        with self._lock:
+            self.finished += 1
+            if not keep:
+                return
+            self.kept += 1
+            buffer = self._traces.setdefault(trace.kind, deque())
+            buffer.append(trace)
+            self._by_id[trace.trace_id] = trace
+            if len(buffer) > self.size:
+                self._by_id.pop(buffer.popleft().trace_id, None)
+
+    def get(self, trace_id):
+        with self._lock:
+            return self._by_id.get(trace_id)
+
+    def recent(self, kind=None, min_ms=0, limit=50):
+        with self._lock:
+            traces = [t for k, buffer in self._traces.items() if kind in (None, k) for t in buffer]
+        traces = [t for t in traces if t.duration_ms >= min_ms]
+        traces.sort(key=lambda t: t.started_at, reverse=True)
+        return [t.summary() for t in traces[:limit]]
+
+    def stats(self):
+        with self._lock:
+            return {"finished": self.finished, "kept": self.kept,
+                    "buffered": {kind: len(buffer) for kind, buffer in self._traces.items()}}
+
+
+TRACES = TraceBuffer()
+_export_lock = threading.Lock()
+
+
+def _export(trace):
+    try:
+        line = json.dumps(trace.to_dict(), ensure_ascii=False, default=str)
+        with _export_lock, open(TRACE_EXPORT_FILE, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except OSError as e:
+        print(f"Trace export failed: {e}")
+
+
+def _finish(trace):
+    trace.duration_ms = round((time.perf_counter() - trace._t0) * 1000, 3)
+    slow = trace.duration_ms >= TRACE_SLOW_MS
+    keep = trace.force or slow or random.random() < TRACE_SAMPLE_RATE
+    TRACES.add(trace, keep)
+    if slow and trace.kind == "request":
+        stages = "".join(f", {name} {e['total_ms']:.0f}ms" for name, e in list(trace.stages().items())[:4])
+        print(f"Slow request {trace.name}: {trace.duration_ms:.0f}ms (trace {trace.trace_id}{stages})")
+    if keep and TRACE_EXPORT_FILE:
+        _export(trace)
+
+
+@contextmanager
+def trace(name, kind="request", force=False, **attrs):
+    """Opens a trace for the enclosed work (and the tasks it creates); yields the Trace or None if disabled."""
+    if not TRACING_ENABLED:
+        yield None
+        return
+    current = Trace(name, kind, force, **attrs)
+    previous_trace, previous_span = CURRENT_TRACE.get(), CURRENT_SPAN.get()
+    CURRENT_TRACE.set(current)
+    CURRENT_SPAN.set(None)
+    try:
+        yield current
+    except BaseException as e:
+        current.attrs.setdefault("error", type(e).__name__)
+        raise
+    finally:
+        # set() rather than reset(tokens): generators may be closed from another context
+        CURRENT_TRACE.set(previous_trace)
+        CURRENT_SPAN.set(previous_span)
+        _finish(current)
+
+
+@contextmanager
+def span(name, **attrs):
+    """Times the enclosed stage in the current trace; yields its attrs dict (None outside a trace)."""
+    current = CURRENT_TRACE.get()
+    if current is None:
+        yield None
+        return
+    parent = CURRENT_SPAN.get()
+    record = {"id": next(current._ids), "parent": parent["id"] if parent else None, "name": name,
+              "lane": _lane(), "attrs": attrs}
+    CURRENT_SPAN.set(record)
+    t0 = time.perf_counter()
+    try:
+        yield attrs
+    except Exception as e:
+        attrs["error"] = f"{type(e).__name__}: {e}"[:200]
+        raise
+    except BaseException as e:
+        attrs["error"] = type(e).__name__  # cancelled, or a generator closed early
+        raise
+    finally:
+        t1 = time.perf_counter()
+        CURRENT_SPAN.set(parent)
+        record["start_ms"] = current.offset_ms(t0)
+        record["duration_ms"] = round((t1 - t0) * 1000, 3)
+        current.record(record)
+
+
+def annotate(**attrs):
+    """Adds attributes to the innermost open span (or the trace itself at top level)."""
+    current = CURRENT_SPAN.get()
+    if current is not None:
+        current["attrs"].update(attrs)
+    elif CURRENT_TRACE.get() is not None:
+        CURRENT_TRACE.get().attrs.update(attrs)
+
+
+def current_trace_id():
+    current = CURRENT_TRACE.get()
+    return current.trace_id if current else None
@@ -0,0 +1,222 @@
+"""
+Upload intake: streaming multipart parsing and resumable chunked uploads.
+
+Files are written to disk off the event loop as their bytes arrive, and each one
+is handed to the caller as soon as its part is complete, so ingestion of the
+first files overlaps with receiving the rest of the folder.
+"""
+import asyncio
+import os
+import re
+import uuid
+
+try:
+    from python_multipart import MultipartParser
+    from python_multipart.multipart import parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from .config import UPLOAD_DIR, UPLOAD_PARTS_DIR, UPLOAD_WRITE_BUFFER_BYTES, UPLOAD_CHUNK_MAX_BYTES
+
+UPLOAD_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,128}$")
+
+
+class UploadError(ValueError):
+    """Rejected upload (bad path, offset or size); maps to a 4xx response."""
+    def __init__(self, message, status_code=400, **details):
+        super().__init__(message)
+        self.status_code = status_code
+        self.details = details
+
+
+def upload_target(rel_path):
+    """Absolute path under UPLOAD_DIR for a client-supplied relative path (e.g. "Folder/Sub/file.jpg")."""
+    rel_path = (rel_path or "").replace("\\", "/").lstrip("/")
+    target = os.path.abspath(os.path.join(UPLOAD_DIR, rel_path))
+    if not rel_path or not target.startswith(os.path.abspath(UPLOAD_DIR) + os.sep):
+        raise UploadError(f"Invalid upload path: {rel_path!r}")
+    return target
+
+
+def person_from_target(target_path):
+    """Person name is the immediate parent folder of the uploaded file."""
+    person_name = os.path.basename(os.path.dirname(target_path))
+    if person_name == "uploads" or not person_name:
+        person_name = "unknown"
+    return person_name
+
+
+class _BufferedFile:
+    """Collects received bytes and writes them in UPLOAD_WRITE_BUFFER_BYTES blocks on a worker thread."""
+    def __init__(self, path, mode="wb"):
+        self.path = path
+        self.mode = mode
+        self._file = None
+        self._buffer = bytearray()
+        self.size = 0
+
+    async def open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = await asyncio.to_thread(open, self.path, self.mode)
+
+    async def write(self, data):
+        self._buffer += data
+        self.size += len(data)
+        if len(self._buffer) >= UPLOAD_WRITE_BUFFER_BYTES:
+            await self.flush()
+
+    async def flush(self):
+        if self._buffer:
+            data, self._buffer = bytes(self._buffer), bytearray()
+            await asyncio.to_thread(self._file.write, data)
+
+    async def close(self):
+        await self.flush()
+        await asyncio.to_thread(self._file.close)
+
+
+async def stream_multipart_files(request, field="files"):
+    """
+    Parses a multipart/form-data request body as it arrives and yields the absolute
+    path of each file part of `field` once it is fully written under UPLOAD_DIR.
+    A file is written to a temporary name first, so a partially received file is
+    never picked up by ingestion.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise UploadError("Expected a multipart/form-data body")
+
+    events = []
+    header = {"field": b"", "value": b""}
+    headers = {}
+
+    def on_part_begin():
+        headers.clear()
+        events.append(("begin", None))
+
+    def on_header_field(data, start, end):
+        header["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        header["value"] += data[start:end]
+
+    def on_header_end():
+        headers[header["field"].lower()] = header["value"]
+        header["field"] = b""
+        header["value"] = b""
+
+    def on_headers_finished():
+        events.append(("headers", dict(headers)))
+
+    def on_part_data(data, start, end):
+        events.append(("data", bytes(data[start:end])))
+
+    def on_part_end():
+        events.append(("end", None))
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    current = None  # (_BufferedFile, target path) of the file part being received
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                parser.write(chunk)
+            else:
+                parser.finalize()
+            for kind, payload in events:
+                if kind == "headers":
+                    _, options = parse_options_header(payload.get(b"content-disposition", b""))
+                    filename = options.get(b"filename")
+                    if options.get(b"name", b"").decode() == field and filename:
+                        target = upload_target(filename.decode("utf-8", errors="replace"))
+                        current = (_BufferedFile(f"{target}.{uuid.uuid4().hex}.part"), target)
+                        await current[0].open()
+                elif kind == "data" and current is not None:
+                    await current[0].write(payload)
+                elif kind == "end" and current is not None:
+                    part_file, target = current
+                    current = None
+                    await part_file.close()
+                    await asyncio.to_thread(os.replace, part_file.path, target)
+                    yield target
+            events.clear()
+    finally:
+        if current is not None:
+            # Client went away mid-file: drop the partial file
+            await current[0].close()
+            await asyncio.to_thread(os.remove, current[0].path)
+
+
+# --- Resumable chunked uploads ---
+# The client picks an upload id per file (e.g. a hash of path, size and mtime),
+# asks how many bytes the server already has, and PUTs the rest chunk by chunk.
+
+_upload_locks = {}
+
+
+def _part_path(upload_id):
+    if not UPLOAD_ID_PATTERN.match(upload_id or ""):
+        raise UploadError("Invalid upload id")
+    return os.path.join(UPLOAD_PARTS_DIR, f"{upload_id}.part")
+
+
+def received_bytes(upload_id):
+    path = _part_path(upload_id)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+async def write_chunk(upload_id, offset, request):
+    """
+    Appends the request body at `offset` of the partial upload. The offset must
+    equal the bytes already received (409 otherwise, with the current size so
+    the client can resume from there). Returns the new received size. A rejected
+    or interrupted chunk is cut off again, so the client resends it whole.
+    """
+    path = _part_path(upload_id)
+    lock = _upload_locks.setdefault(upload_id, asyncio.Lock())
+    async with lock:
+        received = received_bytes(upload_id)
+        if offset != received:
+            raise UploadError("Offset does not match the received size", status_code=409, received=received)
+        part_file = _BufferedFile(path, mode="ab")
+        await part_file.open()
+        complete = False
+        try:
+            async for data in request.stream():
+                if part_file.size + len(data) > UPLOAD_CHUNK_MAX_BYTES:
+                    raise UploadError(f"Chunk larger than {UPLOAD_CHUNK_MAX_BYTES} bytes", status_code=413)
+                await part_file.write(data)
+            complete = True
+        finally:
+            await part_file.close()
+            if not complete:
+                # Back to the size reported before this chunk (a cheap syscall, safe while cancelled)
+                os.truncate(path, received)
+        return received + part_file.size
+
+
+async def complete_upload(upload_id, rel_path, size):
+    """Moves a fully received upload into place under UPLOAD_DIR and returns its path."""
+    path = _part_path(upload_id)
+    target = upload_target(rel_path)
+    async with _upload_locks.setdefault(upload_id, asyncio.Lock()):
+        received = received_bytes(upload_id)
+        if received != size:
+            raise UploadError("Upload is incomplete", status_code=409, received=received)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(path):
+            await asyncio.to_thread(os.replace, path, target)
+        else:
+            # A zero-byte file never had a chunk written, so there is no part file
+            await asyncio.to_thread(lambda: open(target, "wb").close())
+    _upload_locks.pop(upload_id, None)
+    return target
@@ -1,140 +1,898 @@
 import faiss
+import asyncio
 import pickle
 import os
+import json
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
 import numpy as np
-from .config import INDEX_FILE, METADATA_FILE
+from .cache import LRUCache
+from .metrics import SEARCH_SECONDS, MMR_SECONDS, INDEX_SAVE_SECONDS, INDEX_VECTORS
+from .rerank import mmr_select
+from .lexical_index import LexicalIndex, reciprocal_rank_fusion
+from .filter_index import FilterIndex, FilterError, FILTER_INDEX_VERSION, parse_filter, merge_filters
+from .field_index import FieldIndex
+from .tracing import span, annotate
+from .config import (
+    DATA_DIR, INDEX_FILE, METADATA_FILE, VECTORS_FILE, STORE_INFO_FILE,
+    SNAPSHOT_DIR, SNAPSHOTS_KEEP, STORE_LOCK_FILE,
+    SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, EMBED_MODEL,
+    VECTOR_ENCODING, VECTOR_RERANK, VECTOR_RERANK_FACTOR, PQ_SUBQUANTIZERS, PQ_MIN_TRAIN_VECTORS,
+    SEARCH_MMR, SEARCH_MMR_LAMBDA, SEARCH_MMR_CANDIDATES, SEARCH_MMR_MAX_CANDIDATES,
+    SEARCH_MODE, HYBRID_CANDIDATES, HYBRID_RRF_K, FILTER_EXACT_MAX_ROWS,
+    VECTOR_PROJECTION, VECTOR_PROJECTION_DIM, PROJECTION_MIN_TRAIN_VECTORS,
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within one process
+    fcntl = None
+
+ENCODINGS = ("flat", "fp16", "sq8", "pq")
+PROJECTIONS = ("none", "pca", "truncate")
+SEARCH_MODES = ("dense", "lexical", "hybrid")
+SNAPSHOT_FILES = ("index_file", "metadata_file", "vectors_file", "lexical_file", "filters_file", "fields_file")
+
+# Vectors sampled for training quantizers
+TRAIN_SAMPLE_SIZE = 100000
+
+# Search results shared across store instances (one is created per request).
+# Keys include the snapshot generation, so any write makes old entries unreachable.
+SEARCH_CACHE = LRUCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL, name="search", backend="faiss")
+
+_write_lock = threading.RLock()
+_write_depth = 0
+
+@contextmanager
+def store_write_lock():
+    """
+    Serializes writers across threads and processes (uvicorn workers, the ingest CLI).
+    Re-entrant within a thread; readers never take it.
+    """
+    global _write_depth
+    with _write_lock:
+        if _write_depth:
+            _write_depth += 1
+            try:
+                yield
+            finally:
+                _write_depth -= 1
+            return
+        with open(STORE_LOCK_FILE, 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            _write_depth = 1
+            try:
+                yield
+            finally:
+                _write_depth = 0
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def read_manifest():
+    """The published snapshot manifest ({} before anything was written)."""
+    if not os.path.exists(STORE_INFO_FILE):
+        return {}
+    with open(STORE_INFO_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def index_generation():
+    """Generation of the currently published snapshot, bumped by every write in any process."""
+    return read_manifest().get("generation", 0)
+
+def active_embed_model():
+    """
+    The embedding model the published vectors came from. New documents and queries
+    must be embedded with it; it differs from EMBED_MODEL until a migration finishes.
+    """
+    return read_manifest().get("embed_model") or EMBED_MODEL
+
+class EmbedModelMismatch(ValueError):
+    """Documents embedded with another model than the store's (it switched models meanwhile)."""
+    pass
+
+def _snapshot_paths(info):
+    if "index_file" not in info:
+        # Store written before snapshots were versioned
+        return INDEX_FILE, METADATA_FILE, VECTORS_FILE, None, None, None
+    return tuple(os.path.join(DATA_DIR, info[key]) if info.get(key) else None for key in SNAPSHOT_FILES)
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _prune_snapshots(info):
+    """Removes snapshot files older than the last SNAPSHOTS_KEEP generations."""
+    oldest_kept = info["generation"] - SNAPSHOTS_KEEP + 1
+    in_use = {os.path.join(DATA_DIR, info[key]) for key in SNAPSHOT_FILES if info.get(key)}
+    stale = [INDEX_FILE, METADATA_FILE, VECTORS_FILE]
+    for name in os.listdir(SNAPSHOT_DIR):
+        parts = name.split(".")
+        if len(parts) == 3 and parts[1].isdigit() and int(parts[1]) < oldest_kept:
+            stale.append(os.path.join(SNAPSHOT_DIR, name))
+    for path in stale:
+        if path in in_use or not os.path.exists(path):
+            continue
+        try:
+            # Readers that already mapped the file keep their view (POSIX unlink semantics)
+            os.remove(path)
+        except OSError as e:
+            print(f"Warning: could not remove old snapshot file {path}: {e}")
+
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+def shared_store():
+    """
+    Read-only store for serving queries, shared by all requests of this process.
+    The snapshot is memory-mapped, so worker processes share one copy in the page
+    cache. A new instance is opened once a newer generation is published; requests
+    still holding the previous one finish on it.
+    """
+    global _shared_store
+    generation = index_generation()
+    with _shared_store_lock:
+        if _shared_store is None or _shared_store.generation != generation:
+            _shared_store = VectorStore(read_only=True)
+        return _shared_store
+
+_reloading = False
+_reload_lock = threading.Lock()
+
+def _reload_shared_store():
+    global _reloading
+    try:
+        shared_store()
+    except Exception as e:
+        print(f"Reloading the published index failed: {e}")
+    finally:
+        _reloading = False
+
+async def current_store(fresh=False):
+    """
+    shared_store() for the event loop. Opening a snapshot unpickles the metadata and
+    the lexical, filter and field indexes (seconds on large stores), so a newer
+    generation is opened on a background thread while requests keep using the loaded
+    instance; generations published during a reload are picked up by the next one.
+    fresh=True waits (off the loop) for the published generation, for callers that
+    must see their own writes.
+    """
+    global _reloading
+    store = _shared_store
+    if fresh or store is None:
+        return await asyncio.to_thread(shared_store)
+    if store.generation != index_generation():
+        # Not _shared_store_lock: the reload holds it while loading
+        with _reload_lock:
+            start = not _reloading
+            _reloading = True
+        if start:
+            threading.Thread(target=_reload_shared_store, name="index-reload", daemon=True).start()
+    return store
 
 class VectorStore:
-    def __init__(self):
+    def __init__(self, encoding=VECTOR_ENCODING, rerank=VECTOR_RERANK, read_only=False,
+                 projection=VECTOR_PROJECTION, projection_dim=VECTOR_PROJECTION_DIM):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown vector encoding '{encoding}', expected one of {ENCODINGS}")
+        if projection not in PROJECTIONS:
+            raise ValueError(f"Unknown vector projection '{projection}', expected one of {PROJECTIONS}")
+        self.encoding = encoding
+        self.rerank = rerank
+        # The FAISS index may hold projected vectors (IndexPreTransform); queries are
+        # projected by the index itself, full vectors stay available for re-ranking
+        self.projection = projection
+        self.projection_dim = projection_dim
+        # Read-only stores memory-map the index; faiss aborts on writes to a mapped index
+        self.read_only = read_only
         self.index = None
         self.metadata = []
+        # Full-precision vectors, row i belongs to metadata[i] (memory-mapped when loaded from disk)
+        self.vectors = None
+        self.vectors_path = None
+        # BM25 index over metadata[i]["text"], row i = metadata[i]
+        self.lexical = LexicalIndex()
+        # Per-attribute row sets for metadata filters, row i = metadata[i]
+        self.filters = FilterIndex()
+        # Typed fields extracted per person (name, ID number, ...), entries point at rows
+        self.fields = FieldIndex()
+        # Number of vectors the current quantizer was trained on
+        self.trained_on = 0
+        # Model the vectors were embedded with (stores written before it was recorded: EMBED_MODEL)
+        self.embed_model = EMBED_MODEL
+        # Snapshot generation this instance was loaded from / last published
+        self.generation = 0
+        self._dirty = False
         self.load()
 
     def load(self):
-        if os.path.exists(INDEX_FILE) and os.path.exists(METADATA_FILE):
-            print(f"Loading index from {INDEX_FILE}")
-            self.index = faiss.read_index(INDEX_FILE)
-            with open(METADATA_FILE, 'rb') as f:
-                self.metadata = pickle.load(f)
-        else:
+        with span("store_load", read_only=self.read_only) as attrs:
+            for attempt in range(3):
+                info = read_manifest()
+                try:
+                    self._load_snapshot(info)
+                    break
+                except (FileNotFoundError, RuntimeError):
+                    # The snapshot was pruned between reading the manifest and opening its files
+                    if attempt == 2:
+                        raise
+            if attrs is not None:
+                attrs.update(generation=self.generation, rows=len(self.metadata))
+        INDEX_VECTORS.set(self.index.ntotal if self.index else 0, backend="faiss")
+
+    def _load_snapshot(self, info):
+        index_path, metadata_path, vectors_path, lexical_path, filters_path, fields_path = _snapshot_paths(info)
+        self.generation = info.get("generation", 0)
+        self.embed_model = info.get("embed_model") or EMBED_MODEL
+        self._dirty = False
+        legacy = "index_file" not in info
+        if index_path is None or (legacy and not (os.path.exists(index_path) and os.path.exists(metadata_path))):
             print("No existing index found. Starting fresh.")
             self.index = None
             self.metadata = []
+            self.vectors = None
+            self.vectors_path = None
+            self.lexical = LexicalIndex()
+            self.filters = FilterIndex()
+            self.fields = FieldIndex()
+            self.trained_on = 0
+            return
+
+        print(f"Loading index from {index_path}")
+        if self.read_only:
+            self.index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        else:
+            self.index = faiss.read_index(index_path)
+        with open(metadata_path, 'rb') as f:
+            self.metadata = pickle.load(f)
+        self.trained_on = info.get("trained_on", self.index.ntotal)
+        if vectors_path and os.path.exists(vectors_path) and info.get("dim"):
+            self._map_vectors(vectors_path, info["dim"])
+        else:
+            # Index written before full vectors were kept separately: recover them
+            # (written out with the next published snapshot)
+            print("No full-precision vectors found, reconstructing from index...")
+            self.vectors = self.index.reconstruct_n(0, self.index.ntotal)
+            self.vectors_path = None
+        if lexical_path:
+            with open(lexical_path, 'rb') as f:
+                self.lexical = pickle.load(f)
+        else:
+            # Snapshot published before the lexical index existed: build it once from the chunk text
+            print("No lexical index found, building it from metadata...")
+            self.lexical = LexicalIndex()
+            self.lexical.add([meta.get('text', '') for meta in self.metadata])
+        if filters_path:
+            with open(filters_path, 'rb') as f:
+                self.filters = pickle.load(f)
+        if not filters_path or getattr(self.filters, "version", 1) != FILTER_INDEX_VERSION:
+            self.filters = FilterIndex()
+            self.filters.add(self.metadata)
+        if fields_path:
+            with open(fields_path, 'rb') as f:
+                self.fields = pickle.load(f)
+        else:
+            self.fields = FieldIndex()
+            self.fields.add(self.metadata)
+
+    def _map_vectors(self, path, dim):
+        # Rows past len(metadata) belong to a newer snapshot or an append that was never published
+        mapped = np.memmap(path, dtype='float32', mode='r')
+        self.vectors = mapped[:len(mapped) // dim * dim].reshape(-1, dim)[:len(self.metadata)]
+        self.vectors_path = path
+
+    def _append_vectors(self, vectors):
+        """
+        Appends rows to the full-vector file in place instead of rewriting it. Readers of
+        older snapshots only map the rows their metadata covers, so appending is safe.
+        """
+        if (isinstance(self.vectors, np.memmap) and self.vectors_path
+                and len(self.vectors) * self.vectors.shape[1] * 4 == os.path.getsize(self.vectors_path)):
+            with open(self.vectors_path, 'ab') as f:
+                f.write(np.ascontiguousarray(vectors, dtype='float32').tobytes())
+            dim = self.vectors.shape[1]
+            self.vectors = np.memmap(self.vectors_path, dtype='float32', mode='r').reshape(-1, dim)
+        elif self.vectors is None:
+            self.vectors = vectors
+        else:
+            self.vectors = np.concatenate([self.vectors, vectors])
+
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError("VectorStore was opened read-only; use VectorStore() for writes")
+
+    def _refresh_for_write(self):
+        """Must hold store_write_lock: picks up snapshots published by other writers."""
+        self._check_writable()
+        if index_generation() != self.generation:
+            self.load()
 
     def save(self):
-        if self.index:
-            faiss.write_index(self.index, INDEX_FILE)
-        with open(METADATA_FILE, 'wb') as f:
-            pickle.dump(self.metadata, f)
+        """Publishes pending changes as a new snapshot (a no-op when nothing changed)."""
+        self._check_writable()
+        with store_write_lock():
+            if self._dirty:
+                self._publish()
 
-    def clear(self):
-        """Clears the index and metadata"""
+    def _publish(self):
+        """
+        Writes the index and metadata under new generation-numbered names, then
+        atomically replaces the manifest. Must hold store_write_lock.
+        """
+        generation = max(self.generation, index_generation()) + 1
+        info = {
+            "generation": generation,
+            "encoding": self._index_encoding(),
+            "projection": self._projection_label(),
+            "dim": int(self.vectors.shape[1]) if self.vectors is not None else None,
+            "count": len(self.metadata),
+            "trained_on": self.trained_on,
+            "embed_model": self.embed_model,
+            "index_file": None,
+            "metadata_file": None,
+            "vectors_file": None,
+            "lexical_file": None,
+            "filters_file": None,
+            "fields_file": None,
+        }
+        with INDEX_SAVE_SECONDS.time(backend="faiss"), span("store_publish", generation=generation, rows=len(self.metadata)):
+            if self.index is not None:
+                index_path = os.path.join(SNAPSHOT_DIR, f"faiss_index.{generation}.bin")
+                metadata_path = os.path.join(SNAPSHOT_DIR, f"metadata.{generation}.pkl")
+                faiss.write_index(self.index, index_path)
+                with open(metadata_path, 'wb') as f:
+                    pickle.dump(self.metadata, f)
+                if not isinstance(self.vectors, np.memmap):
+                    vectors_path = os.path.join(SNAPSHOT_DIR, f"vectors.{generation}.f32")
+                    np.ascontiguousarray(self.vectors, dtype='float32').tofile(vectors_path)
+                    self._map_vectors(vectors_path, self.vectors.shape[1])
+                info["index_file"] = os.path.relpath(index_path, DATA_DIR)
+                info["metadata_file"] = os.path.relpath(metadata_path, DATA_DIR)
+                info["vectors_file"] = os.path.relpath(self.vectors_path, DATA_DIR)
+                lexical_path = os.path.join(SNAPSHOT_DIR, f"lexical.{generation}.pkl")
+                with open(lexical_path, 'wb') as f:
+                    pickle.dump(self.lexical, f, protocol=pickle.HIGHEST_PROTOCOL)
+                info["lexical_file"] = os.path.relpath(lexical_path, DATA_DIR)
+                filters_path = os.path.join(SNAPSHOT_DIR, f"filters.{generation}.pkl")
+                with open(filters_path, 'wb') as f:
+                    pickle.dump(self.filters, f, protocol=pickle.HIGHEST_PROTOCOL)
+                info["filters_file"] = os.path.relpath(filters_path, DATA_DIR)
+                fields_path = os.path.join(SNAPSHOT_DIR, f"fields.{generation}.pkl")
+                with open(fields_path, 'wb') as f:
+                    pickle.dump(self.fields, f, protocol=pickle.HIGHEST_PROTOCOL)
+                info["fields_file"] = os.path.relpath(fields_path, DATA_DIR)
+            _write_json_atomic(STORE_INFO_FILE, info)
+        self.generation = generation
+        self._dirty = False
+        SEARCH_CACHE.clear()
+        _prune_snapshots(info)
+        INDEX_VECTORS.set(self.index.ntotal if self.index else 0, backend="faiss")
+
+    def _reset(self):
+        """Empties the index, vectors and catalogs in memory (nothing is published)."""
         self.index = None
         self.metadata = []
-        # Delete files if they exist
-        if os.path.exists(INDEX_FILE):
-            os.remove(INDEX_FILE)
-        if os.path.exists(METADATA_FILE):
-            os.remove(METADATA_FILE)
+        self.vectors = None
+        self.vectors_path = None
+        self.lexical = LexicalIndex()
+        self.filters = FilterIndex()
+        self.fields = FieldIndex()
+        self.trained_on = 0
+
+    def clear(self):
+        """Clears the index and metadata (publishes an empty snapshot)"""
+        self._check_writable()
+        with store_write_lock():
+            self._reset()
+            # Nothing left to be compatible with
+            self.embed_model = EMBED_MODEL
+            self._publish()
         print("Vector store cleared.")
 
-    def add_documents(self, embeddings, metas):
+    def _base_index(self):
+        """The encoded index, unwrapped from its projection stage if there is one."""
+        if isinstance(self.index, faiss.IndexPreTransform):
+            return faiss.downcast_index(self.index.index)
+        return self.index
+
+    def _index_projection(self):
+        """Projection actually in use: ("pca" | "truncate", projected dim) or None."""
+        if not isinstance(self.index, faiss.IndexPreTransform):
+            return None
+        first = faiss.downcast_VectorTransform(self.index.chain.at(0))
+        return ("pca" if isinstance(first, faiss.PCAMatrix) else "truncate", self._base_index().d)
+
+    def _projection_label(self):
+        projection = self._index_projection()
+        return f"{projection[0]}:{projection[1]}" if projection else None
+
+    def _target_projection(self, dim, n_vectors):
+        """Projection the index should use for this corpus (PCA needs enough vectors to fit)."""
+        if self.projection == "none" or self.projection_dim >= dim:
+            return None
+        if self.projection == "pca" and n_vectors < PROJECTION_MIN_TRAIN_VECTORS:
+            return None
+        return (self.projection, self.projection_dim)
+
+    def _index_encoding(self):
+        """Encoding actually in use (PQ stays flat until there are enough vectors to train it)."""
+        index = self._base_index()
+        if index is None:
+            return None
+        if isinstance(index, faiss.IndexPQ):
+            return "pq"
+        if isinstance(index, faiss.IndexScalarQuantizer):
+            return "fp16" if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+        return "flat"
+
+    def _new_encoded_index(self, dim, n_vectors):
+        if self.encoding == "fp16":
+            return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+        if self.encoding == "sq8":
+            return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+        if self.encoding == "pq" and n_vectors >= PQ_MIN_TRAIN_VECTORS:
+            m = PQ_SUBQUANTIZERS
+            while dim % m:
+                m -= 1
+            return faiss.IndexPQ(dim, m, 8, faiss.METRIC_L2)
+        return faiss.IndexFlatL2(dim)
+
+    def _new_index(self, dim, n_vectors):
+        projection = self._target_projection(dim, n_vectors)
+        if projection is None:
+            return self._new_encoded_index(dim, n_vectors)
+        method, projected_dim = projection
+        index = self._new_encoded_index(projected_dim, n_vectors)
+        if method == "pca":
+            # Centered rotation onto the top components: L2 distances are preserved
+            # up to the variance of the dropped dimensions
+            return faiss.IndexPreTransform(faiss.PCAMatrix(dim, projected_dim), index)
+        # Leading dimensions, re-normalized (for embeddings trained to be truncated)
+        wrapped = faiss.IndexPreTransform(index)
+        wrapped.prepend_transform(faiss.NormalizationTransform(projected_dim))
+        wrapped.prepend_transform(faiss.RemapDimensionsTransform(dim, projected_dim, False))
+        return wrapped
+
+    def _build_index(self):
+        """(Re)builds the encoded index from the full vectors, training the quantizer if needed."""
+        n, dim = self.vectors.shape
+        index = self._new_index(dim, n)
+        if not index.is_trained:
+            if n > TRAIN_SAMPLE_SIZE:
+                sample = self.vectors[np.sort(np.random.default_rng(0).choice(n, TRAIN_SAMPLE_SIZE, replace=False))]
+            else:
+                sample = self.vectors
+            index.train(np.ascontiguousarray(sample, dtype='float32'))
+            self.trained_on = n
+        index.add(np.ascontiguousarray(self.vectors, dtype='float32'))
+        self.index = index
+
+    def _needs_rebuild(self):
+        """
+        True when the index does not use the configured encoding or projection (e.g. the
+        setting changed, or PQ / PCA now have enough vectors), or a trained quantizer or
+        PCA has seen the corpus double.
+        """
+        if self.index is None:
+            return True
+        n, dim = self.vectors.shape
+        target = "flat" if self.encoding == "pq" and n < PQ_MIN_TRAIN_VECTORS else self.encoding
+        if self._index_encoding() != target:
+            return True
+        projection = self._target_projection(dim, n)
+        if self._index_projection() != projection:
+            return True
+        if target in ("sq8", "pq") or (projection and projection[0] == "pca"):
+            return n >= 2 * max(self.trained_on, 1)
+        return False
+
+    def add_documents(self, embeddings, metas, embed_model=None, replace_sources=None):
+        """
+        Appends documents. embed_model names the model the embeddings came from; an
+        empty store adopts it, a non-empty one raises EmbedModelMismatch if it differs.
+        Chunks of the files in replace_sources are removed in the same snapshot, so a
+        re-processed file is swapped for its new chunks without disappearing in between.
+        """
         if not embeddings:
             return
-        
+
         vectors = np.array(embeddings).astype('float32')
-        
-        # Reload index from disk just in case it was created by another process/request
-        # This is a simple concurrency handling for this specific single-worker-but-reloaded case
-        if os.path.exists(INDEX_FILE) and os.path.exists(METADATA_FILE):
-             try:
-                disk_index = faiss.read_index(INDEX_FILE)
-                # Only reload if disk has MORE data or different pointer, 
-                # but careful not to overwrite memory-only changes if we were doing batching (we aren't).
-                if self.index is None or disk_index.ntotal != self.index.ntotal:
-                    self.index = disk_index
-                    with open(METADATA_FILE, 'rb') as f:
-                        self.metadata = pickle.load(f)
-             except Exception as e:
-                 print(f"Warning: Failed to reload index from disk: {e}")
 
-        if self.index is None:
-            print("Creating new FAISS index...")
-            self.index = faiss.IndexFlatL2(vectors.shape[1])
-        
-        self.index.add(vectors)
-        self.metadata.extend(metas)
-        self.save()
+        with store_write_lock():
+            # Another worker or the ingest CLI may have published since we loaded
+            self._refresh_for_write()
+            if embed_model and embed_model != self.embed_model:
+                if self.metadata:
+                    raise EmbedModelMismatch(f"Documents embedded with {embed_model}, but the store uses {self.embed_model}")
+                self.embed_model = embed_model
+            if vectors.ndim != 2 or (self.vectors is not None and vectors.shape[1] != self.vectors.shape[1]):
+                raise ValueError(f"Embedding shape {vectors.shape} does not match the index dimension")
+
+            if replace_sources and self.metadata:
+                drop = self.filters.mask({"source": sorted(replace_sources)})
+                if drop.any():
+                    print(f"Replacing {int(drop.sum())} chunks of {len(replace_sources)} re-processed files")
+                    self._drop_rows(drop, {})
+            self._append_vectors(vectors)
+            self.metadata.extend(metas)
+            self.lexical.add([meta.get('text', '') for meta in metas])
+            self.filters.add(metas)
+            self.fields.add(metas)
+
+            if self._needs_rebuild():
+                print(f"Building {self.encoding} FAISS index over {len(self.vectors)} vectors...")
+                self._build_index()
+            else:
+                self.index.add(vectors)
+            self._dirty = True
+            self._publish()
         print(f"Saved {len(embeddings)} new vectors. Total: {self.index.ntotal}")
 
 
-    def delete_file(self, filename, person_id):
+    def replace_documents(self, embeddings, metas, embed_model=None):
+        """Swaps the whole store for the given documents in a single published snapshot."""
+        with store_write_lock():
+            self._refresh_for_write()
+            self._reset()
+            self.embed_model = embed_model or self.embed_model
+            if embeddings:
+                self.add_documents(embeddings, metas, embed_model)
+            else:
+                self._publish()
+
+    def refit(self):
         """
-        Deletes all vectors associated with a specific file and person.
-        Since IndexFlatL2 doesn't support random deletion, we have to rebuild the index.
+        Rebuilds the index from the full vectors with the configured encoding and
+        projection, re-fitting PCA / quantizers on the current corpus, and publishes it.
         """
-        # Reload latest
-        self.load()
-        
-        if self.index is None or not self.metadata:
-            return False
+        self._check_writable()
+        with store_write_lock():
+            self._refresh_for_write()
+            if self.vectors is None or not len(self.vectors):
+                return False
+            self._build_index()
+            self._dirty = True
+            self._publish()
+        return True
 
-        print(f"Deleting file {filename} for person {person_id} from index...")
-        
-        # Identify indices to keep
-        keep_indices = []
-        new_metadata = []
-        
-        for i, meta in enumerate(self.metadata):
-            # Check if this item matches the file to delete
-            if meta.get('filename') == filename and meta.get('person') == person_id:
-                continue # Skip this one (delete it)
-            
-            keep_indices.append(i)
-            new_metadata.append(meta)
-            
-        if len(keep_indices) == len(self.metadata):
-            print("No matching documents found in index to delete.")
-            return False
+    def swap_embeddings(self, vectors, embed_model):
+        """
+        Replaces every row's vector with one from another embedding model (row i for
+        metadata[i]) and rebuilds the index; metadata and the text indexes are kept.
+        Readers switch over with the one published snapshot.
+        """
+        self._check_writable()
+        with store_write_lock():
+            self._refresh_for_write()
+            vectors = np.asarray(vectors, dtype='float32')
+            if len(vectors) != len(self.metadata):
+                raise ValueError(f"Got {len(vectors)} vectors for {len(self.metadata)} stored chunks")
+            self.embed_model = embed_model
+            self.trained_on = 0
+            if len(vectors):
+                self.vectors = vectors
+                self.vectors_path = None
+                print(f"Building {self.encoding} FAISS index over {len(vectors)} {embed_model} vectors...")
+                self._build_index()
+            self._dirty = True
+            self._publish()
 
-        # Rebuild Index
+    def delete_file(self, filename, person_id):
+        """Deletes all vectors associated with a specific file and person."""
         try:
-            # Reconstruct all vectors first
-            if self.index.ntotal > 0:
-                all_vectors = self.index.reconstruct_n(0, self.index.ntotal)
-                new_vectors = all_vectors[keep_indices]
-                
-                # Create new index
-                new_index = faiss.IndexFlatL2(new_vectors.shape[1])
-                new_index.add(new_vectors)
-                
-                self.index = new_index
-                self.metadata = new_metadata
-                self.save()
-                print(f"Successfully deleted vectors. New total: {self.index.ntotal}")
-                return True
-            return False
-            
-        except Exception as e:
-            print(f"Error rebuilding index during deletion: {e}")
+            removed = self.delete_matching({"filename": filename, "person": person_id}, allow_all=True)
+        except Exception:
             return False
+        if not removed:
+            print("No matching documents found in index to delete.")
+        return bool(removed)
 
-    def search(self, query_vector, k=5, person_filter=None):
-        if self.index is None or self.index.ntotal == 0:
-            return []
-        
-        query_vector = np.array([query_vector]).astype('float32')
-        # We search for more than k to allow for filtering
-        search_k = k * 5 if person_filter else k
-        distances, indices = self.index.search(query_vector, search_k)
-        
-        results = []
-        for i, idx in enumerate(indices[0]):
+    def delete_matching(self, filters, dry_run=False, timings=None, allow_all=False):
+        """
+        Deletes every chunk matching a filter expression (see backend/filter_index.py)
+        in a single pass over the index and publishes one snapshot, however many files
+        match. Returns the metadata of the removed chunks; dry_run only looks them up.
+        Raises FilterError if the filter matches every chunk, unless allow_all is set.
+        Per-phase durations (ms) are added to timings if given.
+        """
+        expr = parse_filter(filters)
+        if expr is None:
+            raise FilterError("Refusing to delete without a filter")
+        timings = {} if timings is None else timings
+        self._check_writable()
+        with store_write_lock():
+            self._refresh_for_write()
+            if self.index is None or not self.metadata:
+                return []
+
+            t0 = time.perf_counter()
+            drop = self.filters.mask(expr)
+            removed = [self.metadata[i] for i in np.flatnonzero(drop)]
+            timings["match_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+            if not dry_run and not allow_all and drop.all():
+                raise FilterError(f"Filter matches all {len(drop)} chunks in the index; refusing to delete everything")
+            if not removed or dry_run:
+                return removed
+
+            print(f"Deleting {len(removed)} chunks from index...")
+            try:
+                self._delete_rows(drop, timings)
+            except Exception as e:
+                print(f"Error updating index during deletion: {e}")
+                # Drop the half-applied change; the published snapshot is untouched
+                self.load()
+                raise
+        return removed
+
+    def _delete_rows(self, drop, timings):
+        """Removes the rows where drop is True and publishes. Must hold store_write_lock."""
+        self._drop_rows(drop, timings)
+        if self.index is None:
+            # Nothing left to be compatible with
+            self.embed_model = EMBED_MODEL
+
+        t0 = time.perf_counter()
+        self._dirty = True
+        self._publish()
+        timings["publish_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+        if self.index is None:
+            print("Successfully deleted vectors. Index is now empty.")
+        else:
+            print(f"Successfully deleted vectors. New total: {self.index.ntotal}")
+
+    def _drop_rows(self, drop, timings):
+        """Removes the rows where drop is True in memory, without publishing. Must hold store_write_lock."""
+        keep = np.flatnonzero(~drop)
+        t0 = time.perf_counter()
+        if not len(keep):
+            self._reset()
+            timings["index_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+            return
+
+        try:
+            # Compacts the codes in place and keeps the order of the remaining rows,
+            # so row ids stay aligned with the metadata without re-encoding anything
+            bitmap = np.packbits(drop, bitorder='little')
+            self.index.remove_ids(faiss.IDSelectorBitmap(len(drop), faiss.swig_ptr(bitmap)))
+            rebuild = False
+        except RuntimeError:
+            # Index types without remove_ids support
+            rebuild = True
+        self.metadata = [self.metadata[i] for i in keep]
+        self.vectors = np.array(self.vectors[keep], dtype='float32')
+        if rebuild:
+            self._build_index()
+        timings["index_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+
+        t0 = time.perf_counter()
+        self.lexical.keep(keep)
+        self.filters.keep(keep)
+        self.fields.keep(keep)
+        timings["catalog_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+
+    def _exact_rerank(self, query_vector, ids):
+        """Orders candidate ids by exact L2 distance to the query using the full vectors."""
+        if not ids:
+            return ids
+        candidates = np.asarray(self.vectors[np.sort(ids)], dtype='float32')
+        distances = ((candidates - query_vector[0]) ** 2).sum(axis=1)
+        return [int(i) for i in np.sort(ids)[np.argsort(distances)]]
+
+    def _dense_candidates(self, query_vector, limit, mask=None):
+        """
+        Row ids of the nearest vectors (exactly re-ranked for compressed encodings), best first.
+        With a filter mask only those rows are searched: small sets exactly against the
+        full vectors, larger ones inside FAISS with the mask as an ID selector.
+        """
+        search_k = limit
+        params = None
+        if mask is not None:
+            selected = np.flatnonzero(mask)
+            if not len(selected):
+                return []
+            if len(selected) <= FILTER_EXACT_MAX_ROWS and self.vectors is not None:
+                with SEARCH_SECONDS.time(backend="exact"), span("search_exact", rows=len(selected)):
+                    return self._exact_rerank(query_vector, selected.tolist())[:limit]
+            if isinstance(self._base_index(), faiss.IndexPQ):
+                # IndexPQ takes no ID selector: oversample by the filter's selectivity instead
+                search_k = limit * 2 * -(-len(mask) // len(selected))
+            else:
+                bitmap = np.packbits(mask, bitorder='little')
+                selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+                params = faiss.SearchParameters(sel=selector)
+        lossy = self._index_encoding() != "flat" or self._index_projection() is not None
+        rerank = self.rerank and lossy and self.vectors is not None
+        if rerank:
+            search_k *= VECTOR_RERANK_FACTOR
+        with SEARCH_SECONDS.time(backend="faiss"), span("search_dense", k=search_k, filtered=params is not None):
+            distances, indices = self.index.search(query_vector, min(search_k, self.index.ntotal), params=params)
+
+        candidates = []
+        for idx in indices[0]:
             if idx != -1 and idx < len(self.metadata):
-                item = self.metadata[idx]
-                if person_filter and item.get('person') != person_filter:
+                if mask is not None and not mask[idx]:
                     continue
-                results.append(item)
-                if len(results) >= k:
-                    break
+                candidates.append(int(idx))
+        if rerank:
+            with span("search_rerank", candidates=len(candidates)):
+                candidates = self._exact_rerank(query_vector, candidates)
+        return candidates[:limit]
+
+    def _lexical_candidates(self, query_text, limit, mask=None):
+        """Row ids ranked by BM25 over the chunk text, best first."""
+        with SEARCH_SECONDS.time(backend="bm25"), span("search_lexical"):
+            return [row for row, _ in self.lexical.search(query_text, limit, mask) if row < len(self.metadata)]
+
+    def search(self, query_vector, k=5, person_filter=None, mmr=None, mmr_lambda=None, timings=None,
+               query_text=None, mode=None, filters=None):
+        """
+        Top-k chunk metadata for the query.
+        mode (default SEARCH_MODE): "dense" searches FAISS with query_vector, "lexical"
+        ranks chunk text by BM25 against query_text, "hybrid" fuses both rankings
+        (reciprocal rank fusion). Without query_text the search is dense; without
+        query_vector it is lexical.
+        filters is a metadata filter expression (see backend/filter_index.py), ANDed
+        with person_filter; invalid expressions raise FilterError.
+        With mmr (default SEARCH_MMR) a wider candidate set is re-ranked for diversity,
+        so near-duplicate scans do not take every slot. If a timings dict is passed,
+        the retrieval mode and re-ranking time are recorded in it.
+        """
+        if self.index is None or self.index.ntotal == 0:
+            return []
+
+        mode = mode or SEARCH_MODE
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{mode}', expected one of {SEARCH_MODES}")
+        if not query_text:
+            mode = "dense"
+        elif query_vector is None:
+            mode = "lexical"
+        expr = merge_filters(parse_filter(filters), parse_filter({"person": person_filter}) if person_filter else None)
+        mmr = SEARCH_MMR if mmr is None else mmr
+        mmr_lambda = SEARCH_MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+        mmr = mmr and self.vectors is not None and mode != "lexical"
+        if timings is not None:
+            timings["search_mode"] = mode
+
+        if query_vector is not None:
+            query_vector = np.array([query_vector]).astype('float32')
+        cache_key = (
+            hashlib.sha1(query_vector.tobytes()).hexdigest() if mode != "lexical" else None,
+            query_text if mode != "dense" else None,
+            json.dumps(expr, sort_keys=True, ensure_ascii=False) if expr else None,
+            # Not "mmr and mmr_lambda": lambda 0 would equal False and hit the non-MMR entry
+            k, self.generation, mode, mmr, mmr_lambda if mmr else None,
+        )
+        cached = SEARCH_CACHE.get(cache_key)
+        annotate(cache_hit=cached is not None)
+        if cached is not None:
+            return list(cached)
+
+        mask = None
+        if expr is not None:
+            t0 = time.perf_counter()
+            with span("search_filter"):
+                mask = self.filters.mask(expr)
+            if timings is not None:
+                timings["filter_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+                timings["filter_rows"] = int(np.count_nonzero(mask))
+
+        pool = min(max(k * SEARCH_MMR_CANDIDATES, k), max(SEARCH_MMR_MAX_CANDIDATES, k)) if mmr else k
+        if mode == "dense":
+            candidates = self._dense_candidates(query_vector, pool, mask)
+        elif mode == "lexical":
+            candidates = self._lexical_candidates(query_text, pool, mask)
+        else:
+            limit = max(pool, k * HYBRID_CANDIDATES)
+            dense = self._dense_candidates(query_vector, limit, mask)
+            lexical = self._lexical_candidates(query_text, limit, mask)
+            candidates = reciprocal_rank_fusion([dense, lexical], HYBRID_RRF_K, limit)
+            if timings is not None:
+                timings["lexical_hits"] = len(lexical)
+
+        if mmr and len(candidates) > k:
+            candidates = candidates[:pool]
+            t0 = time.perf_counter()
+            with span("search_mmr", candidates=len(candidates)):
+                order = mmr_select(query_vector[0], self.vectors[np.array(candidates)], k, mmr_lambda)
+            elapsed = time.perf_counter() - t0
+            candidates = [candidates[i] for i in order]
+            MMR_SECONDS.observe(elapsed, backend="faiss")
+            if timings is not None:
+                timings["mmr_ms"] = round(elapsed * 1000, 3)
+                timings["mmr_candidates"] = pool
+
+        results = [self.metadata[idx] for idx in candidates[:k]]
+        SEARCH_CACHE.set(cache_key, list(results))
         return results
+
+    def candidates(self, query_vector, query_text, limit, person_filter=None, filters=None, mode=None):
+        """
+        Scored candidates for merging with other stores (backend/shard_router.py):
+        {"dense": [(row, squared L2 distance)], "lexical": [(row, BM25 score)]}, best
+        first. Dense distances are exact (full vectors), so they compare across shards.
+        """
+        result = {"dense": [], "lexical": []}
+        if self.index is None or self.index.ntotal == 0:
+            return result
+        mode = mode or SEARCH_MODE
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{mode}', expected one of {SEARCH_MODES}")
+        if not query_text:
+            mode = "dense"
+        elif query_vector is None:
+            mode = "lexical"
+        expr = merge_filters(parse_filter(filters), parse_filter({"person": person_filter}) if person_filter else None)
+        mask = self.filters.mask(expr)
+        if mode != "lexical":
+            query_vector = np.array([query_vector]).astype('float32')
+            rows = self._dense_candidates(query_vector, limit, mask)
+            if rows:
+                distances = ((np.asarray(self.vectors[rows], dtype='float32') - query_vector[0]) ** 2).sum(axis=1)
+                result["dense"] = [(row, float(d)) for row, d in zip(rows, distances)]
+        if mode != "dense":
+            with SEARCH_SECONDS.time(backend="bm25"):
+                result["lexical"] = [(row, score) for row, score in self.lexical.search(query_text, limit, mask)
+                                     if row < len(self.metadata)]
+        return result
+
+    def summary(self):
+        """{person: {"chunks", "files": {filename: source path}, "real_name"}} over all stored chunks."""
+        summary = {}
+        for meta in self.metadata:
+            person = meta.get('person', 'unknown')
+            if person not in summary:
+                # real_name: 姓名 extracted at ingest (backend/field_index.py)
+                summary[person] = {"chunks": 0, "files": {}, "real_name": self.fields.first(person, "name")}
+            summary[person]["chunks"] += 1
+            summary[person]["files"].setdefault(meta.get('filename', 'unknown'), meta.get('source', ''))
+        return summary
+
+    def stats(self, recall_sample=0, k=5):
+        """
+        Memory and layout statistics. With recall_sample > 0, estimates recall@k of the
+        encoded index (before re-ranking) against exact search over the full vectors,
+        using that many stored vectors as queries.
+        """
+        ntotal = self.index.ntotal if self.index else 0
+        dim = int(self.vectors.shape[1]) if self.vectors is not None else None
+        index_bytes = int(faiss.serialize_index(self.index).nbytes) if self.index else 0
+        result = {
+            "encoding": self._index_encoding(),
+            "configured_encoding": self.encoding,
+            "projection": self._projection_label(),
+            "configured_projection": f"{self.projection}:{self.projection_dim}" if self.projection != "none" else None,
+            "rerank": self.rerank,
+            "vectors": ntotal,
+            "dim": dim,
+            "index_bytes": index_bytes,
+            "index_bytes_per_vector": round(index_bytes / ntotal, 1) if ntotal else None,
+            "full_vectors_bytes": int(self.vectors.nbytes) if self.vectors is not None else 0,
+            "full_vectors_memory_mapped": isinstance(self.vectors, np.memmap),
+            "index_memory_mapped": self.read_only,
+            "generation": self.generation,
+            "trained_on": self.trained_on,
+            "embed_model": self.embed_model,
+            "configured_embed_model": EMBED_MODEL,
+            "lexical_terms": len(self.lexical.postings),
+            "filter_values": {field: len(values) for field, values in self.filters.rows.items()},
+            "field_persons": len(self.fields.entries),
+        }
+        if recall_sample and ntotal:
+            rng = np.random.default_rng(0)
+            sample = np.sort(rng.choice(ntotal, min(recall_sample, ntotal), replace=False))
+            queries = np.ascontiguousarray(self.vectors[sample], dtype='float32')
+            k = min(k, ntotal)
+            exact = faiss.IndexFlatL2(dim)
+            exact.add(np.ascontiguousarray(self.vectors, dtype='float32'))
+            _, truth = exact.search(queries, k)
+            _, found = self.index.search(queries, k)
+            hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+            result[f"recall@{k}"] = round(hits / (len(sample) * k), 4)
+        return result
@@ -0,0 +1,47 @@
+"""
+Synthetic document corpora for benchmarks: root/person_XX/doc_YYY.{jpg,png,pdf}.
+"""
+import os
+import random
+from PIL import Image, ImageDraw
+
+
+def _render_page(width, height, label, rng):
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    draw.text((40, 40), label, fill="black")
+    # Some line noise so images do not compress to nothing
+    for i in range(60):
+        y = 80 + i * (height - 120) // 60
+        draw.line((40, y, rng.randint(width // 3, width - 40), y), fill=(rng.randint(0, 80),) * 3, width=2)
+    return image
+
+
+def generate_corpus(root, persons=5, files_per_person=10, pdf_ratio=0.2, pages_per_pdf=3,
+                    size=(1240, 1754), seed=0):
+    """
+    Writes a synthetic corpus and returns {"files": n, "pages": n, "bytes": n}.
+    PDFs need poppler (pdftoppm) at ingest time; use pdf_ratio=0 without it.
+    """
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    stats = {"files": 0, "pages": 0, "bytes": 0}
+    width, height = size
+    for p in range(persons):
+        person_dir = os.path.join(root, f"person_{p:02d}")
+        os.makedirs(person_dir, exist_ok=True)
+        for f in range(files_per_person):
+            label = f"person {p} document {f}"
+            if rng.random() < pdf_ratio:
+                path = os.path.join(person_dir, f"doc_{f:03d}.pdf")
+                pages = [_render_page(width, height, f"{label} page {i + 1}", rng) for i in range(pages_per_pdf)]
+                pages[0].save(path, save_all=True, append_images=pages[1:])
+                stats["pages"] += pages_per_pdf
+            else:
+                ext = rng.choice([".jpg", ".png"])
+                path = os.path.join(person_dir, f"doc_{f:03d}{ext}")
+                _render_page(width, height, label, rng).save(path)
+                stats["pages"] += 1
+            stats["files"] += 1
+            stats["bytes"] += os.path.getsize(path)
+    return stats
@@ -0,0 +1,270 @@
+"""
+Vector index micro-benchmark and recall harness.
+
+Generates clustered synthetic vectors at bge-m3 dimension with person labels and,
+for each FAISS index configuration, measures build time, add / delete cost,
+index memory, single and batched query latency, person-filtered query latency
+(each query is filtered to the person of the row it was drawn from and searched
+with an ID selector, as VectorStore does) and recall@k against the exact (Flat)
+baseline. Each run appends one JSON line per (size, index) to the output file
+so runs can be compared over time.
+
+Usage (from the OCR_RAG directory):
+    python -m bench.index_bench --sizes 10000,100000 --indexes Flat,SQfp16,SQ8,HNSW32 --output index_bench.jsonl
+Index names are faiss.index_factory strings; "{nlist}" is replaced by ~4*sqrt(n).
+"""
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import time
+
+import faiss
+import numpy as np
+
+DEFAULT_INDEXES = "Flat,SQfp16,SQ8,PQ64,HNSW32,IVF{nlist},Flat"
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def synthetic_vectors(n, dim, n_persons, seed=0, batch=100_000):
+    """Clustered unit vectors (one loose cluster per person) plus person labels."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_persons, dim)).astype("float32")
+    labels = rng.zipf(1.5, n) % n_persons
+    vectors = np.empty((n, dim), dtype="float32")
+    for start in range(0, n, batch):
+        end = min(start + batch, n)
+        noise = rng.standard_normal((end - start, dim)).astype("float32")
+        vectors[start:end] = centers[labels[start:end]] + 1.5 * noise
+    faiss.normalize_L2(vectors)
+    return vectors, labels
+
+
+def make_queries(vectors, n_queries, seed=1):
+    """Perturbed copies of random corpus vectors; returns (queries, ids of their source rows)."""
+    rng = np.random.default_rng(seed)
+    idx = rng.choice(len(vectors), n_queries, replace=False)
+    queries = vectors[idx] + 0.05 * rng.standard_normal((n_queries, vectors.shape[1])).astype("float32")
+    faiss.normalize_L2(queries)
+    return queries, idx
+
+
+def index_bytes(index):
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def recall_at_k(found, truth, k):
+    """Share of the true top-k found; -1 padding (persons with fewer than k rows) is not counted."""
+    hits = expected = 0
+    for f, t in zip(found, truth):
+        relevant = set(t[:k]) - {-1}
+        hits += len(set(f[:k]) & relevant)
+        expected += len(relevant)
+    return hits / max(expected, 1)
+
+
+def selector_params(index, selector):
+    """Search parameters carrying the ID selector; IVF and HNSW take their own type (and keep nprobe / efSearch)."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    base = faiss.downcast_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=base.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def filtered_search(index, queries, labels, persons, k):
+    """
+    Mirrors VectorStore._dense_candidates: the person's rows are passed to FAISS as an
+    IDSelectorBitmap. IndexPQ takes no selector, so it oversamples by the filter's
+    selectivity and drops other persons' rows instead.
+    """
+    takes_selector = not isinstance(faiss.downcast_index(index), faiss.IndexPQ)
+    results = []
+    for q, person in zip(queries, persons):
+        mask = labels == person
+        if takes_selector:
+            bitmap = np.packbits(mask, bitorder="little")
+            params = selector_params(index, faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap)))
+            _, indices = index.search(q.reshape(1, -1), k, params=params)
+        else:
+            search_k = min(k * 2 * -(-len(mask) // int(mask.sum())), index.ntotal)
+            _, indices = index.search(q.reshape(1, -1), search_k)
+        kept = [i for i in indices[0] if i != -1 and mask[i]][:k]
+        results.append(kept + [-1] * (k - len(kept)))
+    return np.array(results)
+
+
+def time_per_query(index, queries, k, single_count):
+    t0 = time.perf_counter()
+    for q in queries[:single_count]:
+        index.search(q.reshape(1, -1), k)
+    single = (time.perf_counter() - t0) / single_count
+    t0 = time.perf_counter()
+    index.search(queries, k)
+    batched = (time.perf_counter() - t0) / len(queries)
+    return single, batched
+
+
+def delete_cost(index, n_delete):
+    """
+    Milliseconds to delete n_delete vectors, via remove_ids and via the
+    reconstruct-and-rebuild path VectorStore.delete_file uses (None if unsupported).
+    """
+    ids = np.arange(n_delete, dtype="int64")
+    costs = {}
+
+    clone = faiss.clone_index(index)
+    t0 = time.perf_counter()
+    try:
+        clone.remove_ids(faiss.IDSelectorBatch(ids))
+        costs["delete_remove_ids_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+    except RuntimeError:
+        costs["delete_remove_ids_ms"] = None
+
+    t0 = time.perf_counter()
+    try:
+        vectors = index.reconstruct_n(0, index.ntotal)
+        rebuilt = faiss.IndexFlatL2(vectors.shape[1])
+        rebuilt.add(vectors[n_delete:])
+        costs["delete_rebuild_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+    except RuntimeError:
+        costs["delete_rebuild_ms"] = None
+    return costs
+
+
+def bench_index(factory, vectors, labels, queries, truth, truth_filtered, query_persons, args):
+    n, dim = vectors.shape
+    nlist = max(16, int(4 * np.sqrt(n)))
+    factory_str = factory.replace("{nlist}", str(nlist))
+    index = faiss.index_factory(dim, factory_str)
+
+    t0 = time.perf_counter()
+    if not index.is_trained:
+        train = vectors[np.random.default_rng(2).choice(n, min(n, args.train_size), replace=False)]
+        index.train(train)
+    train_s = time.perf_counter() - t0
+
+    add_batch = min(args.add_batch, n)
+    base = n - add_batch
+    t0 = time.perf_counter()
+    index.add(vectors[:base])
+    build_s = time.perf_counter() - t0 + train_s
+    t0 = time.perf_counter()
+    index.add(vectors[base:])
+    add_s = time.perf_counter() - t0
+
+    if factory_str.startswith("IVF"):
+        faiss.extract_index_ivf(index).nprobe = args.nprobe
+    if "HNSW" in factory_str:
+        faiss.downcast_index(index).hnsw.efSearch = args.ef_search
+
+    single_s, batched_s = time_per_query(index, queries, args.k, min(args.single_queries, len(queries)))
+    _, found = index.search(queries, args.k)
+
+    t0 = time.perf_counter()
+    found_filtered = filtered_search(index, queries, labels, query_persons, args.k)
+    filtered_s = (time.perf_counter() - t0) / len(queries)
+
+    delete_costs = delete_cost(index, min(args.delete_count, n))
+
+    return {
+        "index": factory_str,
+        "train_s": round(train_s, 3),
+        "build_s": round(build_s, 3),
+        "add_ms_per_1k": round(add_s / add_batch * 1000 * 1000, 3),
+        **delete_costs,
+        "index_bytes": index_bytes(index),
+        "bytes_per_vector": round(index_bytes(index) / n, 1),
+        "query_single_ms": round(single_s * 1000, 4),
+        "query_batched_ms": round(batched_s * 1000, 4),
+        "query_filtered_ms": round(filtered_s * 1000, 4),
+        f"recall@{args.k}": round(recall_at_k(found, truth, args.k), 4),
+        f"filtered_recall@{args.k}": round(recall_at_k(found_filtered, truth_filtered, args.k), 4),
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="FAISS index micro-benchmark with recall against Flat.")
+    parser.add_argument("--sizes", default="10000,100000", help="Comma-separated corpus sizes (10k-10M)")
+    parser.add_argument("--indexes", default=DEFAULT_INDEXES,
+                        help="Comma-separated faiss.index_factory strings (IVF entries keep their comma: 'IVF{nlist},Flat')")
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--persons", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--single-queries", type=int, default=50, help="Queries timed one at a time")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--add-batch", type=int, default=1000)
+    parser.add_argument("--delete-count", type=int, default=100)
+    parser.add_argument("--train-size", type=int, default=100_000)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=0, help="faiss OpenMP threads (0 = default)")
+    parser.add_argument("--output", default="index_bench.jsonl")
+    return parser
+
+
+def split_index_specs(spec):
+    """Splits the --indexes list; a component after an IVF prefix (e.g. 'Flat', 'PQ32') stays attached."""
+    parts = [p.strip() for p in spec.split(",") if p.strip()]
+    specs = []
+    for part in parts:
+        if specs and specs[-1].startswith("IVF") and "," not in specs[-1]:
+            specs[-1] += "," + part
+        else:
+            specs.append(part)
+    return specs
+
+
+def main():
+    args = build_parser().parse_args()
+    if args.threads:
+        faiss.omp_set_num_threads(args.threads)
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    specs = split_index_specs(args.indexes)
+    run_id = datetime.datetime.now().isoformat(timespec="seconds")
+    revision = git_revision()
+
+    for n in sizes:
+        print(f"== n={n} dim={args.dim}: generating vectors")
+        vectors, labels = synthetic_vectors(n, args.dim, args.persons)
+        queries, query_rows = make_queries(vectors, args.queries)
+        # Each query is filtered to the person of the row it was drawn from
+        query_persons = labels[query_rows]
+
+        # Exact ground truth, unfiltered and person-filtered
+        exact = faiss.IndexFlatL2(args.dim)
+        exact.add(vectors)
+        _, truth = exact.search(queries, args.k)
+        truth_filtered = []
+        for q, person in zip(queries, query_persons):
+            ids = np.flatnonzero(labels == person)
+            d = ((vectors[ids] - q) ** 2).sum(axis=1)
+            top = ids[np.argsort(d)[:args.k]]
+            truth_filtered.append(list(top) + [-1] * (args.k - len(top)))
+        del exact
+
+        for spec in specs:
+            try:
+                result = bench_index(spec, vectors, labels, queries, truth, truth_filtered, query_persons, args)
+            except Exception as e:
+                result = {"index": spec, "error": str(e)}
+            record = {"run": run_id, "revision": revision, "n": n, "dim": args.dim,
+                      "persons": args.persons, "k": args.k, **result}
+            print(json.dumps(record))
+            with open(args.output, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
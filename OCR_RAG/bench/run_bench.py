@@ -0,0 +1,288 @@
+"""
+Offline end-to-end benchmark: ingest throughput and query latency against the
+local stub backends (bench/stub_backends.py), no GPU servers needed.
+
+Scenarios:
+  ingest  DataProcessor.process_directory over a synthetic corpus
+  upload  POST /api/upload of a synthetic folder to a live uvicorn server
+  chat    concurrent POST /api/chat (ndjson) with TTFB / total latency
+
+Usage (from the OCR_RAG directory):
+    python -m bench.run_bench --persons 5 --files-per-person 10 --queries 50 --output bench_results.json
+PDF pages need poppler (pdftoppm) for pdf2image; pass --pdf-ratio 0 without it.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from .corpus import generate_corpus
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCH_DIR)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def latency_summary(samples):
+    if not samples:
+        return {"count": 0}
+    arr = np.array(samples) * 1000
+    return {
+        "count": len(samples),
+        "p50_ms": round(float(np.percentile(arr, 50)), 1),
+        "p99_ms": round(float(np.percentile(arr, 99)), 1),
+        "max_ms": round(float(arr.max()), 1),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def start_stub_server(args):
+    port = free_port()
+    cmd = [
+        sys.executable, "-m", "bench.stub_backends", "--port", str(port),
+        "--ocr-latency-ms", str(args.ocr_latency_ms),
+        "--embed-latency-ms", str(args.embed_latency_ms),
+        "--llm-ttft-ms", str(args.llm_ttft_ms),
+        "--llm-token-ms", str(args.llm_token_ms),
+        "--jitter", str(args.jitter),
+        "--error-rate", str(args.error_rate),
+        "--dim", str(args.dim),
+    ]
+    proc = subprocess.Popen(cmd, cwd=PROJECT_DIR)
+    base = f"http://127.0.0.1:{port}"
+    import httpx
+    for _ in range(100):
+        try:
+            if httpx.get(f"{base}/health", timeout=0.5).status_code == 200:
+                return proc, base
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("Stub backend server did not start")
+
+
+def start_app_server():
+    """Runs backend.main:app in a background thread; returns (server, base_url)."""
+    import uvicorn
+    from backend.main import app
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+async def bench_ingest(corpus_dir, corpus_stats):
+    from backend.processor import DataProcessor
+    from backend.vector_store import shared_store
+
+    file_latencies = []
+
+    class TimedProcessor(DataProcessor):
+        async def process_file(self, file_path, person_name="unknown"):
+            t0 = time.perf_counter()
+            try:
+                return await super().process_file(file_path, person_name)
+            finally:
+                file_latencies.append(time.perf_counter() - t0)
+
+    processor = TimedProcessor()
+    t0 = time.perf_counter()
+    await processor.process_directory(corpus_dir)
+    elapsed = time.perf_counter() - t0
+    store = shared_store()
+    return {
+        "files": corpus_stats["files"],
+        "pages": corpus_stats["pages"],
+        "seconds": round(elapsed, 2),
+        "pages_per_sec": round(corpus_stats["pages"] / elapsed, 2) if elapsed else None,
+        "file_latency": latency_summary(file_latencies),
+        "index_vectors": store.index.ntotal if store.index else 0,
+        "index_writer": processor.index_writer.stats(),
+    }
+
+
+async def bench_upload(base_url, corpus_dir, corpus_stats):
+    import httpx
+    files = []
+    handles = []
+    for root, _, names in os.walk(corpus_dir):
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            handle = open(path, "rb")
+            handles.append(handle)
+            rel = os.path.relpath(path, os.path.dirname(corpus_dir))
+            files.append(("files", (rel, handle, "application/octet-stream")))
+    try:
+        async with httpx.AsyncClient(timeout=None) as client:
+            t0 = time.perf_counter()
+            response = await client.post(f"{base_url}/api/upload", files=files)
+            elapsed = time.perf_counter() - t0
+    finally:
+        for handle in handles:
+            handle.close()
+    return {
+        "status": response.status_code,
+        "files": corpus_stats["files"],
+        "pages": corpus_stats["pages"],
+        "bytes": corpus_stats["bytes"],
+        "seconds": round(elapsed, 2),
+        "pages_per_sec": round(corpus_stats["pages"] / elapsed, 2) if elapsed else None,
+    }
+
+
+async def bench_chat(base_url, queries, concurrency, answer_mode):
+    import httpx
+    questions = ["他的身份证号是多少", "住址在哪里", "联系电话是多少", "合同的主要条款是什么", "出生日期"]
+    ttfb, ttfa, totals = [], [], []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i, client):
+        nonlocal errors
+        async with semaphore:
+            body = {"query": questions[i % len(questions)], "response_format": "ndjson", "answer_mode": answer_mode}
+            t0 = time.perf_counter()
+            first = None
+            first_answer = None
+            try:
+                async with client.stream("POST", f"{base_url}/api/chat", json=body) as response:
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        now = time.perf_counter()
+                        if first is None:
+                            first = now - t0
+                        if first_answer is None and json.loads(line).get("type") == "answer":
+                            first_answer = now - t0
+                totals.append(time.perf_counter() - t0)
+                if first is not None:
+                    ttfb.append(first)
+                if first_answer is not None:
+                    ttfa.append(first_answer)
+            except httpx.HTTPError:
+                errors += 1
+
+    t0 = time.perf_counter()
+    async with httpx.AsyncClient(timeout=None) as client:
+        await asyncio.gather(*[one(i, client) for i in range(queries)])
+    elapsed = time.perf_counter() - t0
+    return {
+        "queries": queries,
+        "concurrency": concurrency,
+        "answer_mode": answer_mode,
+        "errors": errors,
+        "qps": round(queries / elapsed, 2) if elapsed else None,
+        "time_to_first_byte": latency_summary(ttfb),
+        "time_to_first_answer": latency_summary(ttfa),
+        "total": latency_summary(totals),
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Offline ingest / query benchmark against stub backends.")
+    parser.add_argument("--scenarios", default="ingest,upload,chat", help="Comma-separated: ingest,upload,chat")
+    parser.add_argument("--persons", type=int, default=5)
+    parser.add_argument("--files-per-person", type=int, default=10)
+    parser.add_argument("--pdf-ratio", type=float, default=0.2)
+    parser.add_argument("--pages-per-pdf", type=int, default=3)
+    parser.add_argument("--image-size", default="1240x1754", help="WIDTHxHEIGHT of synthetic pages")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--answer-mode", default="full", choices=["full", "capped", "none"])
+    parser.add_argument("--ocr-latency-ms", type=float, default=200.0)
+    parser.add_argument("--embed-latency-ms", type=float, default=20.0)
+    parser.add_argument("--llm-ttft-ms", type=float, default=300.0)
+    parser.add_argument("--llm-token-ms", type=float, default=5.0)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--output", default=None, help="Write results as JSON to this file")
+    parser.add_argument("--keep-data", action="store_true", help="Keep the temporary data directory")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    width, height = (int(v) for v in args.image_size.lower().split("x"))
+
+    work_dir = tempfile.mkdtemp(prefix="rag_bench_")
+    stub_proc, stub_base = start_stub_server(args)
+    server = None
+    try:
+        # Must be set before backend modules are imported (config reads them at import time)
+        os.environ.update({
+            "RAG_DATA_DIR": os.path.join(work_dir, "data"),
+            "OCR_API_BASE": f"{stub_base}/v1",
+            "EMBED_API_BASE": f"{stub_base}/v1",
+            "LLM_API_BASE": f"{stub_base}/v1",
+        })
+        sys.path.insert(0, PROJECT_DIR)
+
+        corpus_kwargs = dict(persons=args.persons, files_per_person=args.files_per_person,
+                             pdf_ratio=args.pdf_ratio, pages_per_pdf=args.pages_per_pdf, size=(width, height))
+        results = {"config": vars(args), "scenarios": {}}
+
+        if "ingest" in scenarios:
+            corpus_dir = os.path.join(work_dir, "corpus_ingest")
+            stats = generate_corpus(corpus_dir, seed=1, **corpus_kwargs)
+            results["scenarios"]["ingest"] = asyncio.run(bench_ingest(corpus_dir, stats))
+            print("ingest:", json.dumps(results["scenarios"]["ingest"], ensure_ascii=False))
+
+        if "upload" in scenarios or "chat" in scenarios:
+            server, thread, app_base = start_app_server()
+
+        if "upload" in scenarios:
+            corpus_dir = os.path.join(work_dir, "corpus_upload")
+            stats = generate_corpus(corpus_dir, seed=2, **corpus_kwargs)
+            results["scenarios"]["upload"] = asyncio.run(bench_upload(app_base, corpus_dir, stats))
+            print("upload:", json.dumps(results["scenarios"]["upload"], ensure_ascii=False))
+
+        if "chat" in scenarios:
+            results["scenarios"]["chat"] = asyncio.run(
+                bench_chat(app_base, args.queries, args.concurrency, args.answer_mode))
+            print("chat:", json.dumps(results["scenarios"]["chat"], ensure_ascii=False))
+
+        results["peak_rss_mb"] = peak_rss_mb()
+        print(f"peak RSS: {results['peak_rss_mb']} MB")
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            print(f"Results written to {args.output}")
+    finally:
+        if server is not None:
+            server.should_exit = True
+            thread.join(timeout=5)
+        stub_proc.terminate()
+        stub_proc.wait(timeout=5)
+        if args.keep_data:
+            print(f"Data kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Lightweight OpenAI-compatible stand-ins for the OCR, embedding and LLM servers.
+
+Serves /v1/chat/completions (OCR when the request carries an image, LLM
+otherwise, streaming supported) and /v1/embeddings, with configurable latency,
+jitter and error rate, so ingest and query paths can be measured without GPUs.
+
+Usage (from the OCR_RAG directory):
+    python -m bench.stub_backends --port 9100 --ocr-latency-ms 300 --error-rate 0.01
+Then point the app at it:
+    OCR_API_BASE=http://127.0.0.1:9100/v1 EMBED_API_BASE=... LLM_API_BASE=...
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+SAMPLE_FIELDS = [
+    "姓名 {name}",
+    "性别 男 民族 汉",
+    "出生 1990年1月1日",
+    "住址 北京市海淀区中关村大街{n}号",
+    "公民身份号码 11010119900101{n:04d}",
+    "联系电话 138{n:08d}",
+]
+FILLER = "本合同由甲乙双方在平等自愿的基础上签订，双方应严格遵守合同约定的各项条款。"
+NAMES = ["张三", "李四", "王五", "赵六", "陈七", "刘八"]
+
+
+class StubConfig:
+    def __init__(self, args):
+        self.ocr_latency = args.ocr_latency_ms / 1000
+        self.embed_latency = args.embed_latency_ms / 1000
+        self.llm_ttft = args.llm_ttft_ms / 1000
+        self.llm_token_latency = args.llm_token_ms / 1000
+        self.jitter = args.jitter
+        self.error_rate = args.error_rate
+        self.dim = args.dim
+        self.ocr_lines = args.ocr_lines
+        self.think_tokens = args.think_tokens
+        self.think_open_tag = args.think_open_tag
+        self.answer_tokens = args.answer_tokens
+        self.seed = args.seed
+
+
+def create_app(cfg):
+    app = FastAPI(title="Stub OpenAI-compatible backends")
+    rng = random.Random(cfg.seed)
+    counters = {"ocr": 0, "embeddings": 0, "llm": 0, "errors": 0}
+
+    async def delay(base):
+        if base <= 0:
+            return
+        spread = base * cfg.jitter
+        await asyncio.sleep(max(0.0, rng.uniform(base - spread, base + spread)))
+
+    def should_fail():
+        if cfg.error_rate > 0 and rng.random() < cfg.error_rate:
+            counters["errors"] += 1
+            return True
+        return False
+
+    def error_response():
+        return JSONResponse(status_code=500, content={"error": {"message": "stub injected failure", "type": "server_error"}})
+
+    def ocr_text(seed_bytes):
+        n = int(hashlib.sha1(seed_bytes).hexdigest()[:8], 16)
+        lines = [line.format(name=NAMES[n % len(NAMES)], n=n % 10000) for line in SAMPLE_FIELDS]
+        lines += [f"第{i + 1}条 {FILLER}" for i in range(cfg.ocr_lines)]
+        return "\n".join(lines)
+
+    def completion(content, model):
+        return {
+            "id": f"stub-{time.time_ns()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    def chunk_event(content, model, finish=None):
+        payload = {
+            "id": "stub-stream",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": content} if content is not None else {}, "finish_reason": finish}],
+        }
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok", **counters}
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        await delay(cfg.embed_latency)
+        if should_fail():
+            return error_response()
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        counters["embeddings"] += len(inputs)
+        data = []
+        for i, text in enumerate(inputs):
+            seed = int(hashlib.sha1(str(text).encode("utf-8")).hexdigest()[:8], 16)
+            vec = np.random.default_rng(seed).standard_normal(cfg.dim).astype("float32")
+            vec /= np.linalg.norm(vec)
+            data.append({"object": "embedding", "index": i, "embedding": vec.tolist()})
+        return {"object": "list", "data": data, "model": body.get("model", "stub"),
+                "usage": {"prompt_tokens": 0, "total_tokens": 0}}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "stub")
+        messages = body.get("messages", [])
+        image = None
+        for msg in messages:
+            if isinstance(msg.get("content"), list):
+                for part in msg["content"]:
+                    if part.get("type") == "image_url":
+                        image = part["image_url"]["url"]
+
+        if image is not None:
+            await delay(cfg.ocr_latency)
+            if should_fail():
+                return error_response()
+            counters["ocr"] += 1
+            return completion(ocr_text(image[-4096:].encode()), model)
+
+        if should_fail():
+            await delay(cfg.llm_ttft)
+            return error_response()
+        counters["llm"] += 1
+
+        # A continued assistant prefill (capped / no-reasoning modes) skips the think phase
+        continued = body.get("continue_final_message")
+        tokens = []
+        if not continued:
+            # Like qwq-32b, whose chat template already opens the think block (LLM_THINK_PREFILLED)
+            if cfg.think_open_tag:
+                tokens.append("<think>")
+            tokens += ["思考"] * cfg.think_tokens
+            tokens.append("</think>")
+        tokens += ["答案"] * cfg.answer_tokens
+
+        if not body.get("stream"):
+            await delay(cfg.llm_ttft + cfg.llm_token_latency * len(tokens))
+            return completion("".join(tokens), model)
+
+        async def stream():
+            await delay(cfg.llm_ttft)
+            for token in tokens:
+                yield chunk_event(token, model)
+                await delay(cfg.llm_token_latency)
+            yield chunk_event(None, model, finish="stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible OCR / embedding / LLM server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--ocr-latency-ms", type=float, default=200.0)
+    parser.add_argument("--embed-latency-ms", type=float, default=20.0)
+    parser.add_argument("--llm-ttft-ms", type=float, default=300.0)
+    parser.add_argument("--llm-token-ms", type=float, default=5.0)
+    parser.add_argument("--jitter", type=float, default=0.2, help="Relative latency jitter (0.2 = ±20%%)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--dim", type=int, default=1024, help="Embedding dimension (bge-m3: 1024)")
+    parser.add_argument("--ocr-lines", type=int, default=20, help="Filler lines per OCR'd page")
+    parser.add_argument("--think-tokens", type=int, default=100)
+    parser.add_argument("--think-open-tag", action="store_true",
+                        help="Emit the opening <think> tag (models whose template does not prefill it)")
+    parser.add_argument("--answer-tokens", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    uvicorn.run(create_app(StubConfig(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
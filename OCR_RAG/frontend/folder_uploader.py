@@ -9,13 +9,24 @@ import base64
 from io import BytesIO
 
 
-def folder_uploader(key: str = "folder_uploader", height: int = 200):
+# FastAPI 后端地址（分块上传接口 /api/upload/chunks/...，见 backend/upload_intake.py）
+DEFAULT_API_BASE = "http://localhost:8501"
+CHUNK_SIZE = 8 * 1024 * 1024  # 每个分块的字节数（后端上限 UPLOAD_CHUNK_MAX_BYTES）
+PARALLEL_FILES = 3  # 同时上传的文件数
+
+
+def folder_uploader(key: str = "folder_uploader", height: int = 200, api_base: str = DEFAULT_API_BASE,
+                    chunk_size: int = CHUNK_SIZE, parallel_files: int = PARALLEL_FILES):
     """
     创建一个文件夹上传组件
-    
+
+    文件在浏览器中按 chunk_size 切片（File.slice），以二进制分块直接上传到后端的
+    可续传接口，parallel_files 个文件并行，每个文件单独显示进度；上传完成的文件
+    立即进入后端的处理队列。浏览器和 Streamlit 进程都不会把整个文件夹读入内存。
+
     返回值:
         dict: 包含 folder_name 和 files 列表
-              files 列表中每个元素包含 name, path, data (base64)
+              files 列表中每个元素包含 name, path, size, status（不含文件内容）
     """
     
     html_code = f"""
@@ -74,6 +85,24 @@ def folder_uploader(key: str = "folder_uploader", height: int = 200):
         .file-item:last-child {{
             border-bottom: none;
         }}
+        .file-progress {{
+            height: 4px;
+            background: #eee;
+            border-radius: 2px;
+            margin-top: 3px;
+        }}
+        .file-progress-bar {{
+            height: 100%;
+            width: 0;
+            background: #1976d2;
+            border-radius: 2px;
+        }}
+        .file-item.done .file-progress-bar {{
+            background: #00c853;
+        }}
+        .file-item.failed .file-progress-bar {{
+            background: #ff4b4b;
+        }}
         .folder-name {{
             font-weight: bold;
             color: #1976d2;
@@ -117,10 +146,14 @@ def folder_uploader(key: str = "folder_uploader", height: int = 200):
     
     <script>
         const SUPPORTED_EXTENSIONS = ['.pdf', '.png', '.jpg', '.jpeg'];
-        let collectedFiles = [];
+        const API_BASE = {json.dumps(api_base.rstrip('/'))};
+        const CHUNK_SIZE = {int(chunk_size)};
+        const PARALLEL_FILES = {int(parallel_files)};
+        const MAX_RETRIES = 3;
+        let selectedFiles = [];
         let folderName = '';
         
-        document.getElementById('folder-input-{key}').addEventListener('change', async function(e) {{
+        document.getElementById('folder-input-{key}').addEventListener('change', function(e) {{
             const files = Array.from(e.target.files);
             const container = document.getElementById('container-{key}');
             const fileListDiv = document.getElementById('file-list-{key}');
@@ -147,56 +180,122 @@ def folder_uploader(key: str = "folder_uploader", height: int = 200):
             
             container.classList.add('has-files');
             folderNameDiv.textContent = '📂 文件夹: ' + folderName;
-            statusText.textContent = '正在读取文件...';
             
-            // 读取文件并转换为 base64
-            collectedFiles = [];
+            // 只记录文件句柄，不读取内容；上传时再按分块切片
+            selectedFiles = supportedFiles.map(file => {{
+                const div = document.createElement('div');
+                div.className = 'file-item';
+                div.innerHTML = '<span></span><div class="file-progress"><div class="file-progress-bar"></div></div>';
+                div.querySelector('span').textContent = '📄 ' + file.webkitRelativePath;
+                return {{ file: file, row: div, status: 'pending' }};
+            }});
             fileListDiv.innerHTML = '';
-            
-            for (let i = 0; i < supportedFiles.length; i++) {{
-                const file = supportedFiles[i];
-                const reader = new FileReader();
-                
-                await new Promise((resolve) => {{
-                    reader.onload = function(e) {{
-                        collectedFiles.push({{
-                            name: file.name,
-                            path: file.webkitRelativePath,
-                            data: e.target.result.split(',')[1],  // base64 部分
-                            type: file.type
-                        }});
-                        
-                        const div = document.createElement('div');
-                        div.className = 'file-item';
-                        div.textContent = '📄 ' + file.name;
-                        fileListDiv.appendChild(div);
-                        
-                        statusText.textContent = `已读取 ${{i + 1}} / ${{supportedFiles.length}} 个文件`;
-                        resolve();
-                    }};
-                    reader.readAsDataURL(file);
-                }});
-            }}
+            selectedFiles.forEach(item => fileListDiv.appendChild(item.row));
             
             fileListDiv.style.display = 'block';
-            statusText.textContent = `已选择 ${{supportedFiles.length}} 个文件，点击确认上传`;
+            const totalMb = supportedFiles.reduce((sum, f) => sum + f.size, 0) / 1048576;
+            statusText.textContent = `已选择 ${{supportedFiles.length}} 个文件 (${{totalMb.toFixed(1)}} MB)，点击确认上传`;
             sendBtn.classList.add('show');
         }});
         
-        function sendToStreamlit() {{
+        function uploadId(file) {{
+            // 同一文件（路径、大小、修改时间不变）得到同一 id，刷新页面后可续传
+            const key = file.webkitRelativePath + '|' + file.size + '|' + file.lastModified;
+            let h1 = 0x811c9dc5, h2 = 0x01000193;
+            for (let i = 0; i < key.length; i++) {{
+                const c = key.charCodeAt(i);
+                h1 = Math.imul(h1 ^ c, 0x01000193) >>> 0;
+                h2 = Math.imul(h2 ^ c, 0x5bd1e995) >>> 0;
+            }}
+            return 'fu_' + h1.toString(16) + h2.toString(16) + '_' + file.size;
+        }}
+        
+        function setProgress(item, sent) {{
+            const pct = item.file.size ? Math.round(sent / item.file.size * 100) : 100;
+            item.row.querySelector('.file-progress-bar').style.width = pct + '%';
+        }}
+        
+        async function receivedBytes(id) {{
+            const res = await fetch(`${{API_BASE}}/api/upload/chunks/${{id}}`);
+            if (!res.ok) throw new Error('HTTP ' + res.status);
+            return (await res.json()).received;
+        }}
+        
+        async function uploadFile(item) {{
+            const file = item.file;
+            const id = uploadId(file);
+            let offset = await receivedBytes(id);
+            let retries = 0;
+            while (offset < file.size) {{
+                setProgress(item, offset);
+                try {{
+                    const res = await fetch(`${{API_BASE}}/api/upload/chunks/${{id}}?offset=${{offset}}`, {{
+                        method: 'PUT',
+                        headers: {{ 'Content-Type': 'application/octet-stream' }},
+                        body: file.slice(offset, offset + CHUNK_SIZE)
+                    }});
+                    if (res.ok || res.status === 409) {{
+                        // 409: 服务器已收到的字节数与 offset 不一致，从服务器的位置继续
+                        offset = (await res.json()).received;
+                        if (res.ok) retries = 0;
+                        continue;
+                    }}
+                    throw new Error('HTTP ' + res.status);
+                }} catch (err) {{
+                    if (++retries > MAX_RETRIES) throw err;
+                    await new Promise(r => setTimeout(r, 1000 * retries));
+                    offset = await receivedBytes(id);
+                }}
+            }}
+            setProgress(item, file.size);
+            const res = await fetch(`${{API_BASE}}/api/upload/chunks/${{id}}/complete`, {{
+                method: 'POST',
+                headers: {{ 'Content-Type': 'application/json' }},
+                body: JSON.stringify({{ path: file.webkitRelativePath, size: file.size }})
+            }});
+            if (!res.ok) throw new Error('HTTP ' + res.status);
+        }}
+        
+        async function sendToStreamlit() {{
+            const statusText = document.getElementById('status-{key}');
+            document.getElementById('send-btn-{key}').style.display = 'none';
+            let next = 0, done = 0, failed = 0;
+            
+            async function worker() {{
+                while (next < selectedFiles.length) {{
+                    const item = selectedFiles[next++];
+                    try {{
+                        await uploadFile(item);
+                        item.status = 'uploaded';
+                        item.row.classList.add('done');
+                        done++;
+                    }} catch (err) {{
+                        item.status = 'failed';
+                        item.row.classList.add('failed');
+                        item.row.querySelector('span').textContent += ' ❌ ' + err.message;
+                        failed++;
+                    }}
+                    statusText.textContent = `已上传 ${{done}} / ${{selectedFiles.length}} 个文件` + (failed ? `，失败 ${{failed}} 个` : '');
+                }}
+            }}
+            await Promise.all(Array.from({{ length: Math.min(PARALLEL_FILES, selectedFiles.length) }}, worker));
+            
+            // 只把文件清单（不含内容）发送到 Streamlit
             const data = {{
                 folder_name: folderName,
-                files: collectedFiles
+                files: selectedFiles.map(item => ({{
+                    name: item.file.name,
+                    path: item.file.webkitRelativePath,
+                    size: item.file.size,
+                    status: item.status
+                }}))
             }};
-            
-            // 发送到 Streamlit
             window.parent.postMessage({{
                 type: 'streamlit:setComponentValue',
                 value: JSON.stringify(data)
             }}, '*');
             
-            document.getElementById('status-{key}').textContent = '已提交！请点击处理按钮';
-            document.getElementById('send-btn-{key}').style.display = 'none';
+            statusText.textContent += failed ? '。失败的文件可重新选择文件夹续传' : '。已提交后端处理';
         }}
     </script>
     """
@@ -226,8 +325,11 @@ def parse_folder_data(data_str: str) -> dict:
 
 def save_uploaded_folder(data: dict, upload_dir: str) -> tuple:
     """
-    保存上传的文件夹内容到指定目录
-    
+    返回已上传文件夹中各文件在 upload_dir 下的路径
+
+    分块上传的文件已由后端写入 upload_dir（按相对路径）并加入处理队列，这里不再
+    接收文件内容；旧版组件发送的 base64 数据仍逐个文件解码保存。
+
     Args:
         data: 从 parse_folder_data 获取的数据
         upload_dir: 保存目录
@@ -247,6 +349,11 @@ def save_uploaded_folder(data: dict, upload_dir: str) -> tuple:
     
     for file_info in files:
         try:
+            if 'data' not in file_info:
+                if file_info.get('status') == 'uploaded':
+                    saved_paths.append(os.path.join(upload_dir, file_info['path']))
+                continue
+
             file_name = file_info['name']
             file_data = base64.b64decode(file_info['data'])
             
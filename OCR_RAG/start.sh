@@ -3,6 +3,8 @@
 # Define project directory
 PROJECT_DIR="/home/ubuntu/chen/ocr_agent"
 PORT=8501
+# Uvicorn worker processes (the index is shared memory-mapped; --reload only works with 1)
+WORKERS=${WORKERS:-1}
 
 # Navigate to project directory
 cd "$PROJECT_DIR" || exit
@@ -41,5 +43,9 @@ fi
 # --- 3. Start Application ---
 echo "Starting RAG Agent (FastAPI + HTML)..."
 # Run FastAPI via Uvicorn module to ensure correct python env
-python -m uvicorn backend.main:app --host 0.0.0.0 --port $PORT --reload
+if [ "$WORKERS" -gt 1 ]; then
+    python -m uvicorn backend.main:app --host 0.0.0.0 --port $PORT --workers $WORKERS
+else
+    python -m uvicorn backend.main:app --host 0.0.0.0 --port $PORT --reload
+fi
 